@@ -3,6 +3,7 @@ from colorama import Fore, Style
 from itertools import groupby
 import pandas as pd
 import networkx as nx
+import topo.shared as shared
 import os
 import datetime
 import sys
@@ -21,17 +22,7 @@ def load_all_degrees(date, db_dir):
         err_msg("Unable to find degree file {} on local disk".format(fn))
         exit(1)
 
-    G = nx.Graph()
-
-    with open(fn, "r") as f:
-        for line in f:
-            as1 = line.replace("\n", "").split(" ")[0]
-            as2 = line.replace("\n", "").split(" ")[1]
-
-            G.add_edge(as1, as2)
-
-    for node in G.nodes:
-        degrees[node] = G.degree[node]
+    degrees.update(shared.degrees(fn))
 
 
 ####
@@ -7,7 +7,7 @@ import sys
 from datetime import datetime
 from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from io import StringIO
+from utils.results import ColumnarResults
 
 
 
@@ -23,7 +23,7 @@ class ASPathFeatureComputer:
         self.db_dir = db_dir        # Database directory
         self.model = dict()         # ml model dictionnary, one per metric
         self.metrics = metrics      # All considered metrics
-        self.results = []           # Inference results
+        self.results = ColumnarResults()  # Inference results
         self.override = override
         self.method = method
         self.nbdays = nbdays        # Number of days to consider to train the inference model.
@@ -127,43 +127,22 @@ class ASPathFeatureComputer:
                 for m in self.metrics:
                     new_line[m] = preds[m][i][1]
 
-                self.results.append(new_line.copy())
+                self.results.append(new_line)
 
     
     # Transform the results into a CSV string format
     def to_string(self, label):
-        s = ""
         if len(self.results) < 1:
-            return s
+            return ""
 
-        keys = list(self.results[0].keys())
-
-        if label is not None:
-            keys.append("label")
-
-        s += " ".join(keys)
-        s += "\n"
-
-        for line in self.results:
-            str_line = [str(v) for v in list(line.values())]
-
-            if label is not None:
-                str_line.append(str(label))
-
-            s+= " ".join(str_line)
-            s += "\n"
-
-        return s
+        return self.results.to_string(label)
 
     def to_df(self, label):
-        s = self.to_string(label)
-        io_data = StringIO(s)
-        try:
-            df = pd.read_csv(io_data, sep=" ")
-        except:
+        if len(self.results) < 1:
             print('Error to convert string to DF')
             exit(1)
-        return df
+
+        return self.results.to_df(label)
 
     '''
     def to_df(self):
@@ -198,7 +177,8 @@ class ASPathFeatureComputer:
 
             self.asp_inference(asplist, daily_sampling=True)
             with open(fn_pos_feat, "w") as f:
-                f.write(self.to_string(None))
+                if len(self.results):
+                    self.results.write(f)
 
         self.clear()
         
@@ -210,7 +190,8 @@ class ASPathFeatureComputer:
 
             self.asp_inference(asplist, daily_sampling=True)
             with open(fn_neg_feat, "w") as f:
-                f.write(self.to_string(None))
+                if len(self.results):
+                    self.results.write(f)
 
         self.clear()
 
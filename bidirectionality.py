@@ -11,14 +11,16 @@ from colorama import Style
 from colorama import init
 init(autoreset=True)
 
-from utils.bidirectionality import bidirectional_links
+from utils.bidirectionality import bidirectional_links, bidirectional_links_timeline
+from utils.timeline import Timeline
 from utils.neighboring_vps import CountNeighboringVPs
 
 
 class Orchestrator:
-    def __init__(self, method, db_dir: str=None):
+    def __init__(self, method, db_dir: str=None, use_timeline: bool=True):
         self.db_dir = db_dir+'/'
         self.method = method
+        self.timeline = Timeline(db_dir) if use_timeline and os.path.isdir(db_dir) else None
 
         if not os.path.isdir(self.db_dir):
             print ('Database does not exist: exit.', file=sys.stderr)
@@ -37,6 +39,14 @@ class Orchestrator:
     def print_prefix(self):
         return Fore.GREEN+Style.BRIGHT+"[Orchestrator.py]: "+Style.NORMAL
 
+    # Bidirectional links from the appearance timeline of the edges if available,
+    # from the daily files otherwise.
+    def bidirectional_links(self, links, rib_file, bgp_topo_files, irr_topo_files, days, date_rib):
+        if self.timeline is not None:
+            return bidirectional_links_timeline(links, self.timeline, date_rib if rib_file is not None else None, days, threshold_days_appearance=1)
+
+        return bidirectional_links(links, rib_file, bgp_topo_files, irr_topo_files, threshold_days_appearance=1)
+
     def compute_edge_features_daily_sampling(self, ts: str=None, timespan: int=30, override: bool=False, 
                                              feat=['bidi','nb_vps']):
         date = datetime.strptime(ts, "%Y-%m-%d")
@@ -86,6 +96,7 @@ class Orchestrator:
             # We gather the BGP updates file names for the next 30 days
             bgp_topo_files = []
             irr_topo_files = []
+            days = []
             for i in range(0, timespan+1):
                 cur_date = date + timedelta(days=i)
     
@@ -95,6 +106,7 @@ class Orchestrator:
                 if os.path.isfile(bgp_topo_file) and os.path.isfile(irr_topo_file):
                     bgp_topo_files.append(bgp_topo_file)
                     irr_topo_files.append(irr_topo_file)
+                    days.append(cur_date)
     
             # We take the first day of the following month for the RIB dump.
             nb_days_cur_month = monthrange(date.year, date.month)[1]
@@ -108,10 +120,10 @@ class Orchestrator:
     
             # Merging the resulting dataframes.
             # bidi
-            df = bidirectional_links(positive_links, rib_file, bgp_topo_files, irr_topo_files, threshold_days_appearance=1)
+            df = self.bidirectional_links(positive_links, rib_file, bgp_topo_files, irr_topo_files, days, date_rib)
             df_positive = df_positive.merge(df, how='left')
     
-            df = bidirectional_links(negative_links, rib_file, bgp_topo_files, irr_topo_files, threshold_days_appearance=1)
+            df = self.bidirectional_links(negative_links, rib_file, bgp_topo_files, irr_topo_files, days, date_rib)
             df_negative = df_negative.merge(df, how='left')
 
             # Bidi New Edges
@@ -161,6 +173,7 @@ class Orchestrator:
             # We gather the BGP updates file names for the next 30 days
             bgp_topo_files = []
             irr_topo_files = []
+            days = []
             for i in range(0, timespan+1):
                 cur_date = date + timedelta(days=i)
 
@@ -170,6 +183,7 @@ class Orchestrator:
                 if os.path.isfile(bgp_topo_file) and os.path.isfile(irr_topo_file):
                     bgp_topo_files.append(bgp_topo_file)
                     irr_topo_files.append(irr_topo_file)
+                    days.append(cur_date)
 
             # We take the first day of the following month for the RIB dump.
             nb_days_cur_month = monthrange(date.year, date.month)[1]
@@ -182,7 +196,7 @@ class Orchestrator:
                 print(self.print_prefix()+"RIB not available for: {}".format(date_rib))
 
             # Merging the resulting dataframes.
-            df_tmp = bidirectional_links(links, rib_file, bgp_topo_files, irr_topo_files, threshold_days_appearance=1)
+            df_tmp = self.bidirectional_links(links, rib_file, bgp_topo_files, irr_topo_files, days, date_rib)
             df = df.merge(df_tmp, how='left')
 
         if "nb_vps" in feat:
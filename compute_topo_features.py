@@ -1,8 +1,12 @@
 import networkx as nx
+import numpy as np
+from collections import OrderedDict
 from time import time
 from colorama import Fore, Style
 import sys
 from datetime import datetime
+from math import log
+import topo.csr as csr
 
 
 res_zero = {"closeness_centrality_as1": 0, \
@@ -13,8 +17,6 @@ res_zero = {"closeness_centrality_as1": 0, \
         "eccentricity_as2": 0, \
         "degree_centrality_as1": 0, \
         "degree_centrality_as2": 0, \
-        # "number_of_cliques_as1": number_of_cliques_as1, \
-        # "number_of_cliques_as2": number_of_cliques_as2, \
         "average_neighbor_degree_as1": 0, \
         "average_neighbor_degree_as2": 0, \
         "triangles_as1": 0, \
@@ -24,7 +26,16 @@ res_zero = {"closeness_centrality_as1": 0, \
         "shortest_path": 0,
         "jaccard": 0,
         "adamic_adar": 0,
-        "preferential_attachement": 0}
+        "preferential_attachement": 0,
+        "pagerank_as1": 0,
+        "pagerank_as2": 0,
+        "eigenvector_centrality_as1": 0,
+        "eigenvector_centrality_as2": 0,
+        "number_of_cliques_as1": 0,
+        "number_of_cliques_as2": 0,
+        "square_clustering_as1": 0,
+        "square_clustering_as2": 0,
+        "simrank_similarity": 0}
 
 def prefix(msg, end="\n"):
     currentTime = datetime.now().strftime("%H:%M:%S")
@@ -145,6 +156,144 @@ def compute_harmonic_closeness_centrality_eccentricity(G: nx.Graph, as1, as2):
     return harm_as1, clos_as1, ecce_as1, harm_as2, clos_as2, ecce_as2
 
 
+##############################################################
+## Shared-BFS engine for the harmonic and closeness       #####
+## centrality and the eccentricity. These three features  #####
+## only depend on the number of nodes at each distance of #####
+## the focus AS (networkx sums 1/d in BFS order, i.e. by  #####
+## increasing distance). The distance vector of every     #####
+## focus AS is computed once on the topology as loaded    #####
+## and cached, and the distances after the edge (as1, as2)#####
+## appears are min(d_as1, d_as2 + 1), without any BFS.    #####
+##############################################################
+
+distance_feats = ["eccentricity", "harmonic_centrality", "closeness_centrality"]
+
+distance_keys = [
+    "harmonic_centrality_as1",
+    "closeness_centrality_as1",
+    "eccentricity_as1",
+    "harmonic_centrality_as2",
+    "closeness_centrality_as2",
+    "eccentricity_as2"
+]
+
+# Same order, per node
+distance_node_feats = ["harmonic_centrality", "closeness_centrality", "eccentricity"]
+
+# Shared-BFS engine of the process, see SharedBFS. It is a module variable so that
+# worker processes forked after it has been filled inherit it without any copy.
+bfs_engine = None
+
+
+def needs_distance_feats(feat_exclude):
+    return not ("eccentricity" in feat_exclude and "harmonic_centrality" in feat_exclude and "closeness_centrality" in feat_exclude)
+
+
+####
+# Same values as compute_harmonic_closeness_centrality_eccentricity_aux, computed
+# from levels[k], the number of nodes at distance k of the focus AS. The harmonic
+# centrality is a sequential sum (np.cumsum), in the same order as networkx.
+####
+
+def harmonic_closeness_eccentricity_from_levels(levels, nb_nodes):
+    harm = 0
+    if len(levels) > 1:
+        harm = float(np.cumsum(np.repeat(1 / np.arange(1, len(levels)), levels[1:]))[-1])
+
+    nb_reachable = int(levels.sum())
+    totsp = int((np.arange(len(levels)) * levels).sum())
+    if totsp > 0.0 and nb_nodes > 1:
+        clos = (nb_reachable - 1.0) / totsp
+        s = (nb_reachable - 1.0) / (nb_nodes - 1)
+        clos *= s
+    else:
+        clos = 0.0
+
+    ecce = len(levels) - 1
+
+    return harm, clos, ecce
+
+
+class SharedBFS:
+    def __init__(self, G: nx.Graph, key=None, max_size_mb=1024):
+        self.key = key  # Identifies the topology the distances are computed on
+        self.index = {n: i for i, n in enumerate(G)}  # Node to position in the distance vectors
+        self.nb_nodes = len(G)
+        self.cache = OrderedDict()  # Node to (distance vector, harm, clos, ecce), in LRU order
+        self.max_entries = max(2, int(max_size_mb * 1024 * 1024 / max(1, self.nb_nodes)))
+        self.nb_bfs = 0
+        self.nb_hits = 0
+
+    ####
+    # Run a BFS from node on G, which must be the topology the engine has been
+    # built for, and return the cache entry of node (without inserting it)
+    ####
+
+    def compute_entry(self, G: nx.Graph, node):
+        dists = nx.single_source_shortest_path_length(G, node)
+        self.nb_bfs += 1
+
+        # Distances are stored on one byte, unreachable nodes at the max value
+        ecce = max(dists.values())
+        dtype = np.uint8 if ecce < np.iinfo(np.uint8).max else np.uint32
+        vec = np.full(self.nb_nodes, np.iinfo(dtype).max, dtype=dtype)
+        vec[np.fromiter((self.index[n] for n in dists.keys()), dtype=np.int64, count=len(dists))] = \
+            np.fromiter(dists.values(), dtype=dtype, count=len(dists))
+
+        levels = np.bincount(vec[vec != np.iinfo(dtype).max])
+
+        return (vec,) + harmonic_closeness_eccentricity_from_levels(levels, self.nb_nodes)
+
+    def insert(self, node, entry):
+        self.cache[node] = entry
+        self.cache.move_to_end(node)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    def get(self, G: nx.Graph, node):
+        if node in self.cache:
+            self.nb_hits += 1
+            self.cache.move_to_end(node)
+            return self.cache[node]
+
+        entry = self.compute_entry(G, node)
+        self.insert(node, entry)
+
+        return entry
+
+    ####
+    # Harmonic, closeness centrality and eccentricity of node on the topology
+    ####
+
+    def stats(self, G: nx.Graph, node):
+        return self.get(G, node)[1:]
+
+    ####
+    # Same values as compute_harmonic_closeness_centrality_eccentricity on the topology
+    # with the edge (as1, as2), which must not be in the topology. No BFS is needed
+    # when the distance vectors of as1 and as2 are in the cache.
+    ####
+
+    def stats_after(self, G: nx.Graph, as1, as2):
+        vec_as1 = self.get(G, as1)[0]
+        vec_as2 = self.get(G, as2)[0]
+
+        # Unreachable nodes are set further than any node of the topology
+        unreachable = self.nb_nodes + 1
+        d_as1 = vec_as1.astype(np.int64)
+        d_as1[vec_as1 == np.iinfo(vec_as1.dtype).max] = unreachable
+        d_as2 = vec_as2.astype(np.int64)
+        d_as2[vec_as2 == np.iinfo(vec_as2.dtype).max] = unreachable
+
+        res = ()
+        for d in [np.minimum(d_as1, d_as2 + 1), np.minimum(d_as2, d_as1 + 1)]:
+            levels = np.bincount(d[d < unreachable])
+            res += harmonic_closeness_eccentricity_from_levels(levels, self.nb_nodes)
+
+        return res
+
+
 # dictionary with all the callback functions assiciated with
 # a specific key that represents the feature name, for the 
 # per-node graph features
@@ -172,16 +321,530 @@ base_func_link = {
 
 
 
+##############################################################
+## Incremental kernel for the local features. Adding the   #####
+## edge only changes the degree of the two focus ASes and  #####
+## the triangles they form with their common neighbors, so #####
+## the values with the edge are derived in closed form     #####
+## from the neighborhood without the edge.                 #####
+##############################################################
+
+# Features that can be computed by the incremental kernel
+local_feats = [
+    "degree_centrality",
+    "average_neighbor_degree",
+    "triangles",
+    "clustering",
+    "jaccard",
+    "adamic_adar",
+    "preferential_attachement"
+]
+
+
+def compute_local_features_aux(G: nx.Graph, focus):
+    nbrs = G._adj[focus]
+    vs = set(nbrs) - {focus}
+
+    # Same quantities (and thus the same rounding) as networkx
+    deg = G.degree(focus)
+    sum_nbr_deg = sum(G.degree(w) for w in nbrs)
+    twice_tri = sum(len(vs & (set(G._adj[w]) - {w})) for w in vs)
+
+    return deg, sum_nbr_deg, len(vs), twice_tri
+
+
+def average_neighbor_degree_from(deg, sum_nbr_deg):
+    if deg == 0:
+        return 0.0
+    return sum_nbr_deg / deg
+
+
+def clustering_from(d, twice_tri):
+    return 0 if twice_tri == 0 else twice_tri / (d * (d - 1))
+
+
+####
+# This function computes the local features of the link, without and with the edge,
+# in O(deg) time. The values without the edge are computed with the same formulas as
+# networkx, and the values with the edge are derived from them in closed form:
+#
+#   deg'(as1)                  = deg(as1) + 1
+#   sum of neighbor degrees'   = sum of neighbor degrees + deg(as2) + 1
+#   triangles'(as1)            = triangles(as1) + |CN(as1, as2)|
+#   |N'(as1) U N'(as2)|        = |N(as1) U N(as2) U {as1, as2}|
+#   CN'(as1, as2)              = CN(as1, as2), so adamic_adar does not change
+#
+# @param G              Networkx undirected graph, without the edge (as1, as2)
+# @param as1            First focus AS, must be in G
+# @param as2            Second focus AS, must be in G
+# @param feat_exclude   Features to exclude during the computation
+#
+# @return               The local features without and with the edge
+####
+
+def compute_local_features(G :nx.Graph, as1, as2, feat_exclude=["pagerank", "eigenvector_centrality", "square_clustering", "number_of_cliques", "simrank_similarity"]):
+    before = dict()
+    after = dict()
+
+    # Switch for convention
+    if int(as1) > int(as2):
+        as1, as2 = as2, as1
+
+    if warning_:
+        start = time()
+
+    deg_as1, sum_nbr_deg_as1, d_as1, twice_tri_as1 = compute_local_features_aux(G, as1)
+    deg_as2, sum_nbr_deg_as2, d_as2, twice_tri_as2 = compute_local_features_aux(G, as2)
+
+    # The common neighbors are built exactly as networkx does on the graph with the edge,
+    # so that adamic_adar sums the same terms in the same order
+    adj_as1_after = dict.fromkeys(list(G._adj[as1]) + [as2]).keys()
+    cn = nx.common_neighbors(G, as1, as2)
+    cn_after = adj_as1_after & G._adj[as2].keys() - {as1, as2}
+    nb_cn = len(cn)
+
+    # Self loops are ignored by networkx when counting triangles, but not in the degree
+    loop_as1 = as1 in G._adj[as1]
+    loop_as2 = as2 in G._adj[as2]
+
+    if "degree_centrality" not in feat_exclude:
+        s = 1.0 / (len(G) - 1.0)
+        before["degree_centrality_as1"], before["degree_centrality_as2"] = deg_as1 * s, deg_as2 * s
+        after["degree_centrality_as1"], after["degree_centrality_as2"] = (deg_as1 + 1) * s, (deg_as2 + 1) * s
+
+    if "average_neighbor_degree" not in feat_exclude:
+        before["average_neighbor_degree_as1"] = average_neighbor_degree_from(deg_as1, sum_nbr_deg_as1)
+        before["average_neighbor_degree_as2"] = average_neighbor_degree_from(deg_as2, sum_nbr_deg_as2)
+        after["average_neighbor_degree_as1"] = average_neighbor_degree_from(deg_as1 + 1, sum_nbr_deg_as1 + deg_as2 + 1 + loop_as1)
+        after["average_neighbor_degree_as2"] = average_neighbor_degree_from(deg_as2 + 1, sum_nbr_deg_as2 + deg_as1 + 1 + loop_as2)
+
+    if "triangles" not in feat_exclude:
+        before["triangles_as1"], before["triangles_as2"] = twice_tri_as1 // 2, twice_tri_as2 // 2
+        after["triangles_as1"], after["triangles_as2"] = twice_tri_as1 // 2 + nb_cn, twice_tri_as2 // 2 + nb_cn
+
+    if "clustering" not in feat_exclude:
+        before["clustering_as1"] = clustering_from(d_as1, twice_tri_as1)
+        before["clustering_as2"] = clustering_from(d_as2, twice_tri_as2)
+        after["clustering_as1"] = clustering_from(d_as1 + 1, twice_tri_as1 + 2 * nb_cn)
+        after["clustering_as2"] = clustering_from(d_as2 + 1, twice_tri_as2 + 2 * nb_cn)
+
+    if "jaccard" not in feat_exclude:
+        union_size = len(set(G._adj[as1]) | set(G._adj[as2]))
+        before["jaccard"] = 0 if union_size == 0 else nb_cn / union_size
+        after["jaccard"] = nb_cn / (union_size + (not loop_as1) + (not loop_as2))
+
+    if "adamic_adar" not in feat_exclude:
+        before["adamic_adar"] = sum(1 / log(G.degree(w)) for w in cn)
+        after["adamic_adar"] = sum(1 / log(G.degree(w)) for w in cn_after)
+
+    if "preferential_attachement" not in feat_exclude:
+        before["preferential_attachement"] = deg_as1 * deg_as2
+        after["preferential_attachement"] = (deg_as1 + 1) * (deg_as2 + 1)
+
+    if warning_:
+        stop = time() - start
+        prefix("compute_local_features for link {}-{} took {:.4f} s".format(as1, as2, stop))
+
+    return before, after
+
+
+# Keys of the local features that are not excluded, as returned by compute_local_features
+def local_keys(feat_exclude):
+    keys = []
+    for feat in local_feats:
+        if feat in feat_exclude:
+            continue
+        if feat in base_func_link:
+            keys.append(feat)
+        else:
+            keys += ["{}_as1".format(feat), "{}_as2".format(feat)]
+
+    return keys
+
+
+##############################################################
+## Same features on the CSR backend (topo/csr.py). G is a  #####
+## CSRView of the topology, and the values are the ones of #####
+## networkx (adamic_adar up to the summation order).       #####
+##############################################################
+
+def compute_degree_centrality_csr(G :csr.CSRView, as1, as2):
+    s = 1.0 / (len(G) - 1.0)
+    deg = G.degree([G.node_id(as1), G.node_id(as2)])
+
+    return int(deg[0]) * s, int(deg[1]) * s
+
+def compute_average_neighbor_degree_csr(G :csr.CSRView, as1, as2):
+    res = []
+    for asn in (as1, as2):
+        u = G.node_id(asn)
+        deg = int(G.degree([u])[0])
+        res.append(0.0 if deg == 0 else int(G.degree(G.neighbors(u)).sum()) / deg)
+
+    return res[0], res[1]
+
+def compute_triangles_csr(G :csr.CSRView, as1, as2):
+    twice_tri_as1, _ = G.triangles_and_degree(G.node_id(as1))
+    twice_tri_as2, _ = G.triangles_and_degree(G.node_id(as2))
+
+    return twice_tri_as1 // 2, twice_tri_as2 // 2
+
+def compute_clustering_csr(G :csr.CSRView, as1, as2):
+    res = []
+    for asn in (as1, as2):
+        twice_tri, d = G.triangles_and_degree(G.node_id(asn))
+        res.append(0 if twice_tri == 0 else twice_tri / (d * (d - 1)))
+
+    return res[0], res[1]
+
+def compute_shortest_path_csr(G :csr.CSRView, as1, as2):
+    d = int(G.bfs(G.node_id(as1))[G.node_id(as2)])
+    if d < 0:
+        raise nx.NetworkXNoPath("No path between {} and {}.".format(as1, as2))
+
+    return d + 1
+
+def compute_jaccard_csr(G :csr.CSRView, as1, as2):
+    u, v = G.node_id(as1), G.node_id(as2)
+    union_size = len(np.union1d(G.neighbors(u), G.neighbors(v)))
+    if union_size == 0:
+        return 0
+
+    return len(G.common_neighbors(u, v)) / union_size
+
+def compute_adamic_adar_csr(G :csr.CSRView, as1, as2):
+    cn = G.common_neighbors(G.node_id(as1), G.node_id(as2))
+
+    return sum(1 / log(d) for d in G.degree(cn).tolist())
+
+def compute_preferential_attachment_csr(G :csr.CSRView, as1, as2):
+    deg = G.degree([G.node_id(as1), G.node_id(as2)])
+
+    return int(deg[0]) * int(deg[1])
+
+def compute_harmonic_closeness_centrality_eccentricity_csr(G :csr.CSRView, as1, as2):
+    res_as1 = harmonic_closeness_eccentricity_from_levels(G.levels(G.node_id(as1)), len(G))
+    res_as2 = harmonic_closeness_eccentricity_from_levels(G.levels(G.node_id(as2)), len(G))
+
+    return res_as1 + res_as2
+
+
+##############################################################
+## Sparse kernels for the features that networkx computes  #####
+## on the whole graph. PageRank and the eigenvector        #####
+## centrality are power iterations of sparse products      #####
+## (same update and stopping rule as networkx), that can   #####
+## start from the vector of a nearby topology. The others  #####
+## only explore the neighborhood of the focus ASes.        #####
+##############################################################
+
+def pagerank_from(G :csr.CSRView, x, alpha=0.85, max_iter=20, tol=1.0e-06):
+    N = len(G)
+    S = G.row_lengths().astype(float)
+    dangling = S == 0
+    inv_S = np.zeros(N)
+    inv_S[~dangling] = 1.0 / S[~dangling]
+
+    x = x / x.sum()
+    for _ in range(max_iter):
+        xlast = x
+        x = alpha * (G.matvec(xlast * inv_S) + xlast[dangling].sum() / N) + (1 - alpha) / N
+        # check convergence, l1 norm
+        if np.absolute(x - xlast).sum() < N * tol:
+            return x
+
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+def eigenvector_centrality_from(G :csr.CSRView, x, max_iter=20, tol=1.0e-5):
+    N = len(G)
+
+    x = x / x.sum()
+    for _ in range(max_iter):
+        xlast = x
+        # Iterate with (A+I)
+        x = xlast + G.matvec(xlast)
+        x = x / (np.linalg.norm(x) or 1)
+        # check convergence, l1 norm
+        if np.absolute(x - xlast).sum() < N * tol:
+            return x
+
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+def compute_pagerank_csr(G :csr.CSRView, as1, as2):
+    x = pagerank_from(G, np.repeat(1.0 / len(G), len(G)))
+
+    return float(x[G.node_id(as1)]), float(x[G.node_id(as2)])
+
+def compute_eigenvector_centrality_csr(G :csr.CSRView, as1, as2):
+    x = eigenvector_centrality_from(G, np.repeat(1.0 / len(G), len(G)))
+
+    return float(x[G.node_id(as1)]), float(x[G.node_id(as2)])
+
+####
+# Neighborhood of u for the clique and square counts: the neighbors of u (self loop
+# ignored), and the edges leaving them (self loops ignored) as sources and targets
+####
+
+def neighborhood_edges_csr(G :csr.CSRView, u):
+    vs = G.neighbors(u)
+    vs = vs[vs != u]
+    srcs, nbrs = G.frontier_neighbors(vs)
+    keep = srcs != nbrs
+
+    return vs, srcs[keep], nbrs[keep]
+
+####
+# The maximal cliques that contain u are u plus the maximal cliques of the subgraph
+# induced by its neighbors, so only this subgraph is explored
+####
+
+def compute_number_of_cliques_csr(G :csr.CSRView, as1, as2):
+    res = []
+    for asn in (as1, as2):
+        vs, srcs, nbrs = neighborhood_edges_csr(G, G.node_id(asn))
+        if len(vs) == 0:
+            res.append(1)
+            continue
+
+        in_vs = np.zeros(len(G), dtype=bool)
+        in_vs[vs] = True
+        H = nx.Graph()
+        H.add_nodes_from(vs.tolist())
+        H.add_edges_from(zip(srcs[in_vs[nbrs]].tolist(), nbrs[in_vs[nbrs]].tolist()))
+        res.append(sum(1 for _ in nx.find_cliques(H)))
+
+    return res[0], res[1]
+
+####
+# Same counts as networkx square_clustering (self loops ignored): with k_x the number
+# of neighbors of u that are adjacent to x, there are sum(k_x * (k_x - 1) / 2) squares
+# over all x != u.
+####
+
+def compute_square_clustering_csr(G :csr.CSRView, as1, as2):
+    res = []
+    for asn in (as1, as2):
+        u = G.node_id(asn)
+        vs, srcs, nbrs = neighborhood_edges_csr(G, u)
+        d = len(vs)
+        if d - 1 <= 0:
+            res.append(0)
+            continue
+
+        in_vs = np.zeros(len(G), dtype=bool)
+        in_vs[vs] = True
+        k = np.bincount(nbrs, minlength=len(G))
+        k[u] = 0
+
+        uw_degrees = len(srcs) * (d - 1)
+        uw_count = d * (d - 1)
+        triangles = int(np.count_nonzero(in_vs[nbrs]))
+        squares = int((k * (k - 1)).sum()) // 2
+
+        potential = uw_degrees - uw_count - triangles - squares
+        res.append(squares / potential if potential > 0 else 0)
+
+    return res[0], res[1]
+
+####
+# SimRank is the expected value of C^t, with t the first time two random walks
+# started from as1 and as2 meet (Fogaras and Racz). It is estimated from nb_walks
+# pairs of walks, stopped when C^t gets below the tolerance. The walks are seeded
+# with the link, so that the topologies with and without the edge are compared
+# with the same random numbers.
+####
+
+def compute_simrank_similarity_csr(G :csr.CSRView, as1, as2, importance_factor=0.9, tolerance=1e-4, nb_walks=10000):
+    u, v = G.node_id(as1), G.node_id(as2)
+    if u == v:
+        return 1.0
+
+    rng = np.random.default_rng([int(as1), int(as2)])
+    walks_as1 = np.full(nb_walks, u, dtype=np.int64)
+    walks_as2 = np.full(nb_walks, v, dtype=np.int64)
+
+    res = 0.0
+    for t in range(1, int(np.ceil(log(tolerance) / log(importance_factor))) + 1):
+        walks_as1 = G.random_neighbors(walks_as1, rng.random(len(walks_as1)))
+        walks_as2 = G.random_neighbors(walks_as2, rng.random(len(walks_as2)))
+
+        stuck = (walks_as1 < 0) | (walks_as2 < 0)
+        met = (walks_as1 == walks_as2) & ~stuck
+        res += importance_factor ** t * np.count_nonzero(met)
+
+        walks_as1, walks_as2 = walks_as1[~(stuck | met)], walks_as2[~(stuck | met)]
+        if len(walks_as1) == 0:
+            break
+
+    return res / nb_walks
+
+
+# Callback functions of the CSR backend. The features that are missing
+# here are not available with this backend.
+base_func_csr = {
+    "pagerank": compute_pagerank_csr,
+    "eigenvector_centrality": compute_eigenvector_centrality_csr,
+    "degree_centrality": compute_degree_centrality_csr,
+    "number_of_cliques": compute_number_of_cliques_csr,
+    "average_neighbor_degree": compute_average_neighbor_degree_csr,
+    "triangles": compute_triangles_csr,
+    "clustering": compute_clustering_csr,
+    "square_clustering": compute_square_clustering_csr
+    }
+
+base_func_link_csr = {
+    "shortest_path": compute_shortest_path_csr,
+    "jaccard": compute_jaccard_csr,
+    "adamic_adar": compute_adamic_adar_csr,
+    "preferential_attachement": compute_preferential_attachment_csr,
+    "simrank_similarity": compute_simrank_similarity_csr
+}
+
+
+##############################################################
+## Sparse engine: the features above for the topology     #####
+## without and with the edge of each link. The PageRank    #####
+## and eigenvector vectors of the topology are computed    #####
+## once, the iterations without the edge start from them,  #####
+## and the ones with the edge start from the vectors       #####
+## without the edge: a few tens of products are enough.    #####
+##############################################################
+
+sparse_feats = ["pagerank", "eigenvector_centrality", "number_of_cliques", "square_clustering", "simrank_similarity"]
+
+spectral_func = {
+    "pagerank": pagerank_from,
+    "eigenvector_centrality": eigenvector_centrality_from
+}
+
+# Features that are estimated, and thus not equal to the networkx values
+approx_feats = ["pagerank", "eigenvector_centrality", "simrank_similarity"]
+
+# Sparse engine of the process, see SparseEngine. Like bfs_engine, it is inherited
+# by the worker processes forked after it has been filled.
+sparse_engine = None
+
+
+def needs_sparse_feats(feat_exclude):
+    return any(feat not in feat_exclude for feat in sparse_feats)
+
+
+####
+# The difference of the values with and without the edge is of the order of the
+# networkx tolerance: both iterations are run to a much smaller tolerance, so that
+# the difference is not an artefact of where they stopped.
 ####
-# This function computes all the graph features, but exculde some of these features
+
+class SparseEngine:
+    def __init__(self, topo: csr.CSRTopology, key=None, max_iter=1000, tol=1.0e-12):
+        self.key = key  # Identifies the topology
+        self.topo = topo
+        self.max_iter = max_iter
+        self.tol = tol
+        self.base = dict()  # Feature to its vector on the topology
+
+    def base_vector(self, feat):
+        if feat not in self.base:
+            G = self.topo.view()
+            self.base[feat] = spectral_func[feat](G, np.repeat(1.0 / len(G), len(G)), max_iter=self.max_iter,
+                                                  tol=self.tol)
+
+        return self.base[feat]
+
+    def compute(self, G: csr.CSRView, as1, as2, feat_exclude, start=None, node_cache=None):
+        feats = dict()
+        vectors = dict()
+
+        for feat in sparse_feats:
+            if feat in feat_exclude:
+                continue
+
+            if warning_:
+                ts = time()
+            try:
+                if feat in spectral_func:
+                    x = self.base_vector(feat) if start is None else start[feat]
+                    # ASes that are not in the topology start with the uniform value
+                    x = np.concatenate((x, np.repeat(1.0 / len(G), len(G) - len(x))))
+                    if G.removed is not None or G.added is not None or start is not None:
+                        x = spectral_func[feat](G, x, max_iter=self.max_iter, tol=self.tol)
+                    vectors[feat] = x
+                    feats["{}_as1".format(feat)] = float(x[G.node_id(as1)])
+                    feats["{}_as2".format(feat)] = float(x[G.node_id(as2)])
+                elif feat in base_func_csr:
+                    feats["{}_as1".format(feat)], feats["{}_as2".format(feat)] = \
+                        with_node_cache(node_cache, [feat], as1, as2, lambda: base_func_csr[feat](G, as1, as2))
+                else:
+                    feats[feat] = base_func_link_csr[feat](G, as1, as2)
+            except:
+                # If an error occur (no convergence), notify it
+                if feat in base_func_csr:
+                    feats["{}_as1".format(feat)], feats["{}_as2".format(feat)] = None, None
+                else:
+                    feats[feat] = None
+
+            if warning_:
+                prefix("sparse {} for link {}-{} took {:.4f} s".format(feat, as1, as2, time() - ts))
+
+        return feats, vectors
+
+    ####
+    # Features without the edge. Also returns the PageRank and eigenvector vectors,
+    # to start the iterations with the edge from.
+    ####
+
+    def compute_before(self, as1, as2, had_edge, feat_exclude, node_cache=None):
+        G = self.topo.view(removed=(as1, as2) if had_edge else None)
+
+        return self.compute(G, as1, as2, feat_exclude, node_cache=None if had_edge else node_cache)
+
+    ####
+    # Features with the edge, starting from the vectors without the edge, or from
+    # the ones of the topology if they are not available
+    ####
+
+    def compute_after(self, as1, as2, had_edge, feat_exclude, vectors=None, node_cache=None):
+        G = self.topo.view(added=None if had_edge else (as1, as2))
+
+        return self.compute(G, as1, as2, feat_exclude, start=vectors, node_cache=node_cache if had_edge else None)[0]
+
+
+####
+# Values of the per-node features feats for as1 and as2, in the order returned by
+# func (all the features of as1, then all the ones of as2). They are taken from the
+# node cache (see topo/node_cache.py) if it has them all, else computed by func and
+# cached. The node cache must only be given for the topology as loaded.
+####
+
+def with_node_cache(node_cache, feats, as1, as2, func):
+    if node_cache is None:
+        return func()
+
+    keys = [(asn, feat) for asn in (as1, as2) for feat in feats]
+    values = [node_cache.get(asn, feat) for (asn, feat) in keys]
+    if None not in values:
+        return tuple(values)
+
+    values = func()
+    for ((asn, feat), value) in zip(keys, values):
+        node_cache.put(asn, feat, value)
+
+    return values
+
+
+####
+# This function computes all the graph features, but exculde some of these features.
+# The backend is chosen from the type of G: the networkx functions for a networkx
+# graph, the CSR ones for a view of a CSRTopology.
 # 
-# @param G              Networkx undirected graph
+# @param G              Networkx undirected graph, or CSRView
 # @param as1            First focus AS
 # @param as2            Second focus AS
 # @param feat_exclude   Features to exclude during the computation
+# @param node_cache     Cache of the per-node features, only if G is the topology as loaded
 ####
 
-def compute_all_features(G :nx.Graph, as1, as2, feat_exclude=["pagerank", "eigenvector_centrality", "square_clustering", "number_of_cliques", "simrank_similarity"]):
+def compute_all_features(G :nx.Graph, as1, as2, feat_exclude=["pagerank", "eigenvector_centrality", "square_clustering", "number_of_cliques", "simrank_similarity"], node_cache=None):
 
     results = dict()
 
@@ -189,6 +852,14 @@ def compute_all_features(G :nx.Graph, as1, as2, feat_exclude=["pagerank", "eigen
     if int(as1) > int(as2):
         as1, as2 = as2, as1
 
+    # Switch for the backend
+    if isinstance(G, csr.CSRView):
+        funcs, funcs_link = base_func_csr, base_func_link_csr
+        func_dist = compute_harmonic_closeness_centrality_eccentricity_csr
+    else:
+        funcs, funcs_link = base_func, base_func_link
+        func_dist = compute_harmonic_closeness_centrality_eccentricity
+
     # Add the two AS in the result dictionary
     results["as1"] = as1
     results["as2"] = as2
@@ -199,7 +870,8 @@ def compute_all_features(G :nx.Graph, as1, as2, feat_exclude=["pagerank", "eigen
             if warning_:
                 start = time()
             try:
-                results["{}_as1".format(feat)], results["{}_as2".format(feat)] = base_func[feat](G, as1, as2)
+                results["{}_as1".format(feat)], results["{}_as2".format(feat)] = \
+                    with_node_cache(node_cache, [feat], as1, as2, lambda: funcs[feat](G, as1, as2))
             except:
                 # If a Networkx error occur, notify it
                 results["{}_as1".format(feat)], results["{}_as2".format(feat)] = None, None
@@ -214,7 +886,7 @@ def compute_all_features(G :nx.Graph, as1, as2, feat_exclude=["pagerank", "eigen
             if warning_:
                 start = time()
             try:
-                results[feat] = base_func_link[feat](G, as1, as2)
+                results[feat] = funcs_link[feat](G, as1, as2)
             except:
                 # If a Networkx error occur, notify it
                 results[feat] = None
@@ -230,7 +902,8 @@ def compute_all_features(G :nx.Graph, as1, as2, feat_exclude=["pagerank", "eigen
         start = time()
     if not ("eccentricity" in feat_exclude and "harmonic_centrality" in feat_exclude and "closeness_centrality" in feat_exclude):
         try:
-            results["harmonic_centrality_as1"], results["closeness_centrality_as1"], results["eccentricity_as1"], results["harmonic_centrality_as2"], results["closeness_centrality_as2"], results["eccentricity_as2"] = compute_harmonic_closeness_centrality_eccentricity(G, as1, as2)
+            results["harmonic_centrality_as1"], results["closeness_centrality_as1"], results["eccentricity_as1"], results["harmonic_centrality_as2"], results["closeness_centrality_as2"], results["eccentricity_as2"] = \
+                with_node_cache(node_cache, distance_node_feats, as1, as2, lambda: func_dist(G, as1, as2))
         except:
             results["harmonic_centrality_as1"], results["closeness_centrality_as1"], results["eccentricity_as1"], results["harmonic_centrality_as2"], results["closeness_centrality_as2"], results["eccentricity_as2"] = None, None, None, None, None, None
 
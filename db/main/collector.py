@@ -16,11 +16,14 @@ from utils.collect_peeringdb import collect_peeringdb
 from utils.collect_irr import CollectIRR
 from utils.irrparser import parse_irr_snapshot
 from utils.collect_cone import collect_cone_snapshot
-from utils.peeringdbparser import read_asn_facilities, read_asn_ixps, read_asn_country, read_ixps
+from utils.peeringdbparser import parse_peeringdb_snapshot
+from utils.timeline import Timeline
+from utils.mrtcache import MRTCache
+from utils.scheduler import Scheduler
 
 
 class Orchestrator:
-    def __init__(self, db_dir: str=None):
+    def __init__(self, db_dir: str=None, mrt_cache: bool=False, mrt_cache_size: float=50, offline: bool=False):
 
         self.db_dir = db_dir
 
@@ -43,6 +46,11 @@ class Orchestrator:
         if not os.path.isdir(self.db_dir+'/prefixes'):
             os.mkdir(self.db_dir+'/prefixes')
 
+        # Local cache of the MRT files, shared with the new edge path collection.
+        self.mrt_cache = None
+        if mrt_cache or offline:
+            self.mrt_cache = MRTCache(self.db_dir+'/mrt_cache', max_size=mrt_cache_size, offline=offline)
+
     def print_prefix(self):
         return Fore.GREEN+Style.BRIGHT+"[Orchestrator.py]: "+Style.NORMAL
 
@@ -84,6 +92,9 @@ class Orchestrator:
         else:
             print (self.print_prefix()+"RIB File (caida) {} already exists.".format(rib_file))
 
+        # Index the edges of the day in the appearance timeline.
+        Timeline(self.db_dir).update(month_first_day, sources_list=["ribs"])
+
     def download_timestamp_rib_helper(self, ts: str=None, override: bool=False, nb_vps: int=20, max_workers_rib: int=5):
         month_first_day = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S").replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
@@ -103,7 +114,7 @@ class Orchestrator:
 
         # Check if the RIB topo is not yet in the DB.
         if not os.path.isfile(rib_file) or not os.path.isfile(allpaths_file) or not os.path.isfile(prefixes_file) or override: 
-            cr = CollectRibs(nb_vps=nb_vps, max_workers=max_workers_rib)
+            cr = CollectRibs(nb_vps=nb_vps, max_workers=max_workers_rib, cache=self.mrt_cache, checkpoint_dir=self.db_dir+'/tmp/checkpoints')
             cr.build_snapshot(month_first_day.strftime("%Y-%m-%d"), \
                 ixp_file=ixp_file, \
                 outfile=rib_file, \
@@ -112,6 +123,9 @@ class Orchestrator:
         else:
             print (self.print_prefix()+"RIB File {} already exists.".format(rib_file))
 
+        # Index the edges of the day in the appearance timeline.
+        Timeline(self.db_dir).update(month_first_day, sources_list=["ribs2"])
+
 
     def download_timestamp_updates_helper(self, ts: str=None, override: bool=False, max_workers: int=100, nb_vps: int=20):
         # month_first_day = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S").replace(day=1, hour=0, minute=0, second=0, microsecond=0)
@@ -132,11 +146,14 @@ class Orchestrator:
 
         # Check if the updates topo is not yet in the DB.
         if not os.path.isfile(update_file) or override: 
-            cu = CollectUpdates(nb_vps=nb_vps, max_workers=max_workers)
+            cu = CollectUpdates(nb_vps=nb_vps, max_workers=max_workers, cache=self.mrt_cache, checkpoint_dir=self.db_dir+'/tmp/checkpoints')
             cu.build_snapshot(ts_start=cur_day, ts_end=cur_day_end, ixp_file=ixp_file, outfile=update_file)
         else:
             print (self.print_prefix()+"Update File {} already exists.".format(update_file))
 
+        # Index the edges of the day in the appearance timeline.
+        Timeline(self.db_dir).update(cur_day, sources_list=["updates"])
+
     def download_timestamp_peeringdb(self, ts: str=None, override: bool=False):
 
         date_str = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S").strftime("%Y-%m-%d")
@@ -160,10 +177,8 @@ class Orchestrator:
             
             # Parse the raw json file and save results in correponding files.
             if file_available:
-                read_asn_facilities(peeringdb_tmp_file, peeringdb_file_fac)
-                read_asn_ixps(peeringdb_tmp_file, peeringdb_file_ixp)
-                read_asn_country(peeringdb_tmp_file, 'utils/asn_country_bgpview.txt', peeringdb_file_country)
-                read_ixps(peeringdb_tmp_file, caidaixp_tmp_file, peeringdb_file_ixplist)
+                parse_peeringdb_snapshot(peeringdb_tmp_file, caidaixp_tmp_file, 'utils/asn_country_bgpview.txt', \
+                    peeringdb_file_fac, peeringdb_file_ixp, peeringdb_file_country, peeringdb_file_ixplist)
 
                 # Remove the raw file.
                 os.remove(peeringdb_tmp_file)
@@ -199,6 +214,9 @@ class Orchestrator:
         else:
             print (self.print_prefix()+"IRR files for date {} already exists.".format(date_str))
 
+        # Index the edges of the day in the appearance timeline.
+        Timeline(self.db_dir).update(datetime.strptime(date_str, "%Y-%m-%d"), sources_list=["irr"])
+
     def download_timestamp_cone(self, ts: str=None, override: bool=False):
         # Take the first day of the month,
         date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S").replace(day=1, hour=0, minute=0, second=0, microsecond=0)
@@ -211,7 +229,15 @@ class Orchestrator:
             print (self.print_prefix()+"Cone file {} already exists.".format(cone_file))
 
 
-    def download_timestamp(self, \
+    ####
+    # Add the collection tasks of a day to the scheduler. The sources are collected
+    # in parallel, except that the RIBs and the updates are cleaned with the IXP
+    # list from PeeringDB, so they wait for its collection if it is in the scheduler.
+    # The monthly sources (RIBs, cone) are added once for all the days of a month.
+    ####
+
+    def add_timestamp_tasks(self, \
+        scheduler: Scheduler, \
         ts: str=None, \
         rib_only: bool=False, \
         updates_only: bool=False, \
@@ -227,46 +253,91 @@ class Orchestrator:
         max_workers_rib: int=5, \
         nb_vps_updates: int=20):
 
-        # First, we need to get peeringDB info, required to process ribs and updates.
+        date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S")
+        date_str = date.strftime("%Y-%m-%d")
+        month_str = date.replace(day=1).strftime("%Y-%m-%d")
+        ixp_deps = ['peeringdb '+os.path.basename(self.get_ixp_filename(date)).split('_')[0]]
+
         if not rib_only and not updates_only and not irr_only and not cone_only:
-            ppeeringdb = Process(target=self.download_timestamp_peeringdb, args=(ts, override_peeringdb,))
-            ppeeringdb.start()
-            ppeeringdb.join()
+            scheduler.add('peeringdb '+date_str, 'peeringdb', self.download_timestamp_peeringdb, (ts, override_peeringdb))
 
-        plist = []
         if not updates_only and not peeringdb_only and not irr_only and not cone_only:
-            prib = Process(target=self.download_timestamp_rib_caida_helper, args=(ts, override_rib))
-            plist.append(prib)
+            scheduler.add('rib_caida '+month_str, 'rib_caida', self.download_timestamp_rib_caida_helper, (ts, override_rib), ixp_deps)
 
         if not rib_only and not updates_only and not peeringdb_only and not cone_only:
-            pirr = Process(target=self.download_timestamp_irr, args=(ts, override_irr,))
-            plist.append(pirr)
+            scheduler.add('irr '+date_str, 'irr', self.download_timestamp_irr, (ts, override_irr))
 
         if not rib_only and not updates_only and not peeringdb_only and not irr_only:
-            pcone = Process(target=self.download_timestamp_cone, args=(ts, override_cone,))
-            plist.append(pcone)
-
-        # Start the processes.
-        for p in plist:
-            p.start()
-
-        # Wait for the processes to terminate.
-        for p in plist:
-            p.join()
+            scheduler.add('cone '+month_str, 'cone', self.download_timestamp_cone, (ts, override_cone))
 
         if not updates_only and not peeringdb_only and not irr_only and not cone_only:
-            prib = Process(target=self.download_timestamp_rib_helper, args=(ts, override_rib, nb_vps_updates, max_workers_rib))
-            prib.start()
-            prib.join()
+            scheduler.add('rib '+month_str, 'rib', self.download_timestamp_rib_helper, (ts, override_rib, nb_vps_updates, max_workers_rib), ixp_deps)
 
         if not rib_only and not peeringdb_only and not irr_only and not cone_only:  
-            pupdates = Process(target=self.download_timestamp_updates_helper, args=(ts, override_updates, max_workers_updates, nb_vps_updates))
-            pupdates.start()
-            pupdates.join()
+            scheduler.add('updates '+date_str, 'updates', self.download_timestamp_updates_helper, (ts, override_updates, max_workers_updates, nb_vps_updates), ixp_deps)
+
+    ####
+    # Collect the data of every day in [ts, ts_end) (only the day of ts if ts_end
+    # is None). concurrency is the maximum number of tasks running at the same time
+    # for each source (1 by default), max_parallel for all the sources.
+    ####
+
+    def download_period(self, \
+        ts: str=None, \
+        ts_end: str=None, \
+        concurrency: dict=None, \
+        max_parallel: int=4, \
+        **kwargs):
+
+        scheduler = Scheduler(concurrency=concurrency, max_parallel=max_parallel)
+
+        cur_date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S")
+        end_date = datetime.strptime(ts_end, "%Y-%m-%dT%H:%M:%S") if ts_end is not None else cur_date + timedelta(days=1)
+        while cur_date < end_date:
+            self.add_timestamp_tasks(scheduler, cur_date.strftime("%Y-%m-%dT%H:%M:%S"), **kwargs)
+            cur_date += timedelta(days=1)
+
+        return scheduler.run()
+
+    def download_timestamp(self, \
+        ts: str=None, \
+        rib_only: bool=False, \
+        updates_only: bool=False, \
+        peeringdb_only: bool=False, \
+        irr_only: bool=False, \
+        cone_only: bool=False, \
+        override_rib: bool=False, \
+        override_updates: bool=False, \
+        override_peeringdb: bool=False, \
+        override_irr: bool=False, \
+        override_cone: bool=False, \
+        max_workers_updates: int=100, \
+        max_workers_rib: int=5, \
+        nb_vps_updates: int=20, \
+        concurrency: dict=None, \
+        max_parallel: int=4):
+
+        return self.download_period(ts, None, \
+            concurrency=concurrency, \
+            max_parallel=max_parallel, \
+            rib_only=rib_only, \
+            updates_only=updates_only, \
+            peeringdb_only=peeringdb_only, \
+            irr_only=irr_only, \
+            cone_only=cone_only, \
+            override_rib=override_rib, \
+            override_updates=override_updates, \
+            override_peeringdb=override_peeringdb, \
+            override_irr=override_irr, \
+            override_cone=override_cone, \
+            max_workers_updates=max_workers_updates, \
+            max_workers_rib=max_workers_rib, \
+            nb_vps_updates=nb_vps_updates)
 
 # Make the CLI.
 @click.command()
 @click.option('--date', help='Date for which to collect data, in the following format "YYYY-MM-DDThh:mm:ss".', type=str)
+@click.option('--date_end', default=None, help='If given, collect the data of every day from date to date_end (excluded), in the following format "YYYY-MM-DDThh:mm:ss".', type=str)
 @click.option('--rib_only', default=False, help='Only download the RIB data.', type=bool)
 @click.option('--updates_only', default=False, help='Only download the updates data.', type=bool)
 @click.option('--peeringdb_only', default=False, help='Only download the PeeringDB data.', type=bool)
@@ -281,9 +352,15 @@ class Orchestrator:
 @click.option('--max_workers_rib', default=2, help='Maximum number of workers when downloading the ribs.', type=int)
 @click.option('--nb_vps', default=10, help='Number of vantage points from which to download updates data .', type=int)
 @click.option('--db_dir', default="db", help='Directory where is database.', type=str)
+@click.option('--mrt_cache', default=False, help='Keep the downloaded and parsed MRT files in a local cache (db_dir/mrt_cache).', type=bool)
+@click.option('--mrt_cache_size', default=50, help='Size budget of the MRT cache, in GB.', type=float)
+@click.option('--max_parallel', default=4, help='Maximum number of collection tasks running at the same time.', type=int)
+@click.option('--concurrency', default="", help='Maximum number of tasks running at the same time per source, e.g. "updates=2,irr=2" (sources: peeringdb, rib_caida, rib, updates, irr, cone; 1 by default).', type=str)
+@click.option('--offline', default=False, help='Only read the MRT files from the local cache, without downloading them (the jobs with MRT data missing from the cache fail).', type=bool)
 
 def launch_orchestrator(\
     date,\
+    date_end=None,\
     rib_only=False,\
     updates_only=False,\
     peeringdb_only=False,\
@@ -297,12 +374,27 @@ def launch_orchestrator(\
     max_workers=4,\
     max_workers_rib=2,\
     nb_vps=10,\
-    db_dir="db"):
+    db_dir="db",\
+    mrt_cache=False,\
+    mrt_cache_size=50,\
+    max_parallel=4,\
+    concurrency="",\
+    offline=False):
     """Collect raw data used for hijack detection and store it in a database."""
 
-    o = Orchestrator(db_dir)
-    o.download_timestamp(\
+    # Maximum number of tasks per source, e.g. "updates=2,irr=2".
+    concurrency_dict = {}
+    for item in concurrency.split(','):
+        if '=' in item:
+            source, nb = item.split('=')
+            concurrency_dict[source.strip()] = int(nb)
+
+    o = Orchestrator(db_dir, mrt_cache=mrt_cache, mrt_cache_size=mrt_cache_size, offline=offline)
+    o.download_period(\
         ts=date, \
+        ts_end=date_end, \
+        concurrency=concurrency_dict, \
+        max_parallel=max_parallel, \
         rib_only=rib_only, \
         updates_only=updates_only, \
         peeringdb_only=peeringdb_only, \
@@ -1,8 +1,10 @@
 import os
 import bz2
+import zlib
+import shutil
+import tempfile
 import requests
 import networkx as nx
-import bgpkit
 from datetime import datetime, timedelta
 from concurrent import futures
 
@@ -14,13 +16,63 @@ init(autoreset=True)
 from utils.cleaning import remove_asprepending
 from utils.mvp import get_vps
 from utils.vps import get_vps_info
+from utils.edgefile import write_edges
+from utils.mrtcache import MRTCache
+from utils.checkpoint import Checkpoint, checkpoint_key, run_tasks
+import utils.mrtcache as mrtcache
+
+####
+# The RIB snapshot is aggregated in shards. Every worker deduplicates the AS
+# paths and the (prefix, origin AS) pairs of its MRT file and writes them in
+# nb_shards files, a path or a pair going to the shard of the hash of its line.
+# Only the AS links of the file are sent back to the main process. The shards
+# are then deduplicated independently by the workers, so that no process holds
+# all the paths or all the pairs, and concatenated in the output files.
+####
+
+watched_ixps = set()
+
+def init_worker(ixp_set):
+    global watched_ixps
+    watched_ixps = ixp_set
+
+def shard_filename(shard_dir, key, kind, shard):
+    return "{}/{}_{}_{}.txt".format(shard_dir, key, kind, shard)
+
+def write_shards(lines, shard_dir, key, kind, nb_shards):
+    shards = [[] for _ in range(nb_shards)]
+    for line in lines:
+        shards[zlib.crc32(line.encode("utf-8")) % nb_shards].append(line)
+
+    for shard in range(nb_shards):
+        with open(shard_filename(shard_dir, key, kind, shard), 'w') as fd:
+            fd.writelines(line+'\n' for line in shards[shard])
+
+# Unique lines of a shard for all the MRT files, written in outfile.
+def merge_shard(params_list):
+    shard_dir, keys, kind, shard, outfile = params_list
+    lines = set()
+    for key in keys:
+        with open(shard_filename(shard_dir, key, kind, shard), 'r') as fd:
+            lines.update(fd)
+
+    with open(outfile, 'w') as fd:
+        fd.writelines(lines)
+
+    return len(lines)
 
 class CollectRibs:
-    def __init__(self, nb_vps: int=20, max_workers: int=10):
+    def __init__(self, nb_vps: int=20, max_workers: int=10, cache: MRTCache=None, checkpoint_dir: str=None):
 
         # Max number of processes when download mrt files.
         self.max_workers = max_workers
 
+        # Local cache of the MRT data (None to always download them).
+        self.cache = cache
+
+        # Directory of the checkpoints of the MRT files already processed (None for no checkpoint).
+        self.checkpoint_dir = checkpoint_dir
+
         # Get list of vantage points with MVP.
         self.vps_info = get_vps_info()
         vps_set = get_vps(nb_vps)
@@ -54,114 +106,154 @@ class CollectRibs:
         return ixps
 
     # Helper function that uses the bgpkit broker to retrieve MRT files to
-    # download.
+    # download (or the MRT cache, if any, in the last parameter).
     def query_helper(params_list):
-        broker = bgpkit.Broker()
-        return broker.query( \
-            ts_start=params_list[0], \
-            ts_end=params_list[1], \
-            data_type=params_list[2], \
-            collector_id=params_list[3])
+        return mrtcache.query(params_list[:4], params_list[4])
 
     # Helper function that uses the bgpkit parser to download and parse the
-    # MRT files.
-    def parser_helper(params_list):
-        parser = bgpkit.Parser( \
-            url=params_list[0], \
-            filters={"peer_ips": params_list[1], \
-                'type':'announce'})
-
-        failed = True
-        while failed:
+    # MRT files (or reads them from the MRT cache, if any, in the last parameter).
+    # The AS paths and the prefixes of the origin ASes are written in the shards,
+    # the AS links are returned in the order they are first seen.
+    def rib_helper(params_list):
+        url, peers, cache, shard_dir, nb_shards = params_list
+        for attempt in range(3):
+            edges = {}
+            paths = {}
+            prefixes = {}
             try:
-                tmp = parser.parse_all()
-                failed = False
+                for bgp_route in mrtcache.routes(url, peers, cache):
+                    # Transform the as path into a list of integers.
+                    try:
+                        aspath = list(map(lambda x: int(x), bgp_route['as_path'].split(' ')))
+                    except ValueError:
+                        continue
+                    # Clean up the as path.
+                    aspath = remove_asprepending(aspath, watched_ixps)
+                    paths[' '.join(list(map(lambda x:str(x), aspath)))] = None
+
+                    if len(aspath) > 0:
+                        # Update the ASN to prefix mapping.
+                        prefixes['{} {}'.format(bgp_route['prefix'], aspath[-1])] = None
+
+                        # Update the topology.
+                        for i in range(0, len(aspath)-1):
+                            edges[(aspath[i], aspath[i+1])] = None
+
+                key = checkpoint_key(url, peers)
+                write_shards(paths, shard_dir, key, "paths", nb_shards)
+                write_shards(prefixes, shard_dir, key, "prefixes", nb_shards)
+
+                return list(edges)
+            except mrtcache.OfflineMiss:
+                raise
             except:
-                print (self.print_prefix()+'BGPKIT parser failed with params {}'.format(parser))
+                print (Fore.CYAN+Style.BRIGHT+"[collect_ribs.py]: "+Style.NORMAL+'BGPKIT parser failed with params {}'.format(params_list[:2]))
+
+        raise RuntimeError('BGPKIT parser failed with params {}'.format(params_list[:2]))
+
+    # Deduplicate the shards of a kind (paths or prefixes) and concatenate them in outfile.
+    def merge_shards(self, shard_dir, keys, kind, nb_shards, outfile):
+        params = [(shard_dir, keys, kind, shard, "{}/{}_{}.txt".format(shard_dir, kind, shard)) for shard in range(nb_shards)]
+
+        with futures.ProcessPoolExecutor(self.max_workers) as executor:
+            nb_lines = sum(executor.map(merge_shard, params))
+
+        with open(outfile, 'w') as fd:
+            for p in params:
+                with open(p[4], 'r') as fd_shard:
+                    shutil.copyfileobj(fd_shard, fd)
 
-        return tmp
+        return nb_lines
 
-    def build_snapshot(self, date: str=None, ixp_file:str=None, outfile: str=None, outfile_paths: str=None, outfile_prefixes: str=None):
+    def build_snapshot(self, date: str=None, ixp_file:str=None, outfile: str=None, outfile_paths: str=None, outfile_prefixes: str=None, nb_shards: int=16):
         date = datetime.strptime(date, "%Y-%m-%d")
 
         # Initialize the current start and end date. We download the RIB files at midnight.
         date_start = date + timedelta(minutes=-10)
         end_start = date + timedelta(minutes=+10)
 
-        # AS-level topology build from the AS paths.
-        topo = nx.DiGraph()
-        allpaths = set()
-        asn_prefix_mapping = {}
+        # AS-level topology build from the AS paths: AS to its successors, the ASes
+        # being in the order they are first seen (as in a DiGraph).
+        topo = {}
 
-        # Load IXP ASN file.
+        # Load IXP ASN file. The results of the MRT files depend on it, and so do their checkpoints.
         ixp_set = self.get_ixps(ixp_file)
+        ixp_key = checkpoint_key(*sorted(ixp_set))
+
+        # The MRT files of the output already processed by a previous run are not
+        # processed again. The shards are kept with the checkpoints.
+        checkpoint = None
+        if self.checkpoint_dir is not None and outfile is not None:
+            checkpoint = Checkpoint(self.checkpoint_dir, os.path.basename(outfile))
+            shard_dir = checkpoint.job_dir
+        else:
+            shard_dir = tempfile.mkdtemp(prefix="ribs_")
 
         print (self.print_prefix()+'{} -> {}: Searching for BGP MRT file (nb_vps={})'.format(date_start.strftime("%Y-%m-%d"), end_start.strftime("%Y-%m-%d"), len(self.peers)))
         # Get the MRT file download.
         params_query = []
         for c in self.collectors:
-            params_query.append((date_start, end_start, 'rib', c)) 
+            params_query.append((date_start, end_start, 'rib', c, self.cache)) 
 
-        parser_params = []
+        tasks = []
         with futures.ProcessPoolExecutor(self.max_workers) as executor:
             for result in executor.map(CollectRibs.query_helper, params_query):
-                for broker_item in result:
-                    parser_params.append([broker_item.url, ', '.join(self.peers)]) 
+                for url in result:
+                    tasks.append((CollectRibs.rib_helper, [url, ', '.join(self.peers), self.cache, shard_dir, nb_shards], ('ribs', url, ', '.join(self.peers), nb_shards, ixp_key))) 
 
         print (self.print_prefix()+'{} -> {}: BGP MRT files found, starting to parse them...'.format(date_start.strftime("%Y-%m-%d"), end_start.strftime("%Y-%m-%d")))
 
+        # Only the MRT files that failed are processed again. After three failures,
+        # the snapshot is built from the files that were processed successfully.
+        results = []
         failed = 0
         while failed < 3:
             try:
-                with futures.ProcessPoolExecutor(self.max_workers) as executor:
-                    for result in executor.map(CollectRibs.parser_helper, parser_params):
-                        for bgp_route in result:
-                            # Transform the as path into a list of integers.
-                            try:
-                                aspath = list(map(lambda x: int(x), bgp_route['as_path'].split(' ')))
-                            except ValueError:
-                                continue
-                            # Clean up the as path.
-                            aspath = remove_asprepending(aspath, ixp_set)
-                            allpaths.add(' '.join(list(map(lambda x:str(x), aspath))))
-
-                            if aspath is not None:
-                                # Update the ASN to prefix mapping.
-                                if aspath[-1] not in asn_prefix_mapping:
-                                    asn_prefix_mapping[aspath[-1]] = set()
-                                asn_prefix_mapping[aspath[-1]].add(bgp_route['prefix'])
-
-                                # Update the topology.
-                                for i in range(0, len(aspath)-1):
-                                    topo.add_edge(aspath[i], aspath[i+1])
-                            else:
-                                print (bgp_route)
+                with futures.ProcessPoolExecutor(self.max_workers, initializer=init_worker, initargs=(ixp_set,)) as executor:
+                    results = run_tasks(tasks, executor.submit, checkpoint, raise_errors=(failed < 2), fatal=(mrtcache.OfflineMiss,))
                 failed = 3
+            except mrtcache.OfflineMiss:
+                raise
             except:
                 failed += 1
-                if failed < 3:
-                    print (self.print_prefix()+'Execution has failed, retrying ...')
-                else:   
-                    print (self.print_prefix()+'Execution has failed again, moving to the next hour ...')
+                print (self.print_prefix()+'Execution has failed, retrying ...')
+
+        keys = []
+        for (i, task) in enumerate(tasks):
+            result = results[i] if i < len(results) else None
+            if result is None:
+                print (self.print_prefix()+'Execution has failed again, some MRT files are missing ...')
+                continue
+
+            keys.append(checkpoint_key(task[1][0], task[1][1]))
+            for as1, as2 in result:
+                if as1 not in topo:
+                    topo[as1] = {}
+                if as2 not in topo:
+                    topo[as2] = {}
+                topo[as1][as2] = None
+            results[i] = None
 
         # Print in a file the resulting topology.
         if outfile is not None:
             with open(outfile, 'w') as fd:
-                for as1, as2 in topo.edges():
-                    fd.write("{} {}\n".format(as1, as2))
+                for as1 in topo:
+                    for as2 in topo[as1]:
+                        fd.write("{} {}\n".format(as1, as2))
+            write_edges(outfile, [(as1, as2) for as1 in topo for as2 in topo[as1]])
 
         # Print in a file the resulting unique as path.
         if outfile_paths is not None:
-            with open(outfile_paths, 'w') as fd:
-                for path in allpaths:
-                    fd.write(path+'\n')
+            self.merge_shards(shard_dir, keys, "paths", nb_shards, outfile_paths)
 
         # Print in a file the resulting asn to prefix mapping.
         if outfile_prefixes is not None:
-            with open(outfile_prefixes, 'w') as fd:
-                for asn in asn_prefix_mapping:
-                    for p in asn_prefix_mapping[asn]:
-                        fd.write('{} {}\n'.format(p, asn))
+            self.merge_shards(shard_dir, keys, "prefixes", nb_shards, outfile_prefixes)
+
+        if checkpoint is not None:
+            checkpoint.clear()
+        else:
+            shutil.rmtree(shard_dir, ignore_errors=True)
 
         print (self.print_prefix()+'{} -> {}: BGP MRT files processed successfully'.format(date_start.strftime("%Y-%m-%d"), end_start.strftime("%Y-%m-%d")))
 
@@ -235,6 +327,7 @@ class CollectRibs:
             with open(outfile, 'w') as fd:
                 for as1, as2 in topo.edges():
                     fd.write("{} {}\n".format(as1, as2))
+            write_edges(outfile, topo.edges())
 
         # Print in a file the resulting unique as path.
         if outfile_paths is not None:
@@ -1,25 +1,55 @@
 import os
 import requests
-import bgpkit
+import threading
+import multiprocessing
 from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
 import networkx as nx
 from datetime import datetime, timedelta
 
 from utils.mvp import get_vps
 from utils.vps import get_vps_info
 from utils.cleaning import remove_asprepending
+from utils.edgefile import write_edges
+from utils.mrtcache import MRTCache
+from utils.checkpoint import Checkpoint, checkpoint_key, run_tasks
+import utils.mrtcache as mrtcache
 
 from colorama import Fore
 from colorama import Style
 from colorama import init
 init(autoreset=True)
 
+####
+# The hours of the day are collected as a pipeline: up to max_hours_in_flight
+# hours are processed at the same time (broker queries, downloads and parsing),
+# by threads that share one pool of worker processes for the whole day. The
+# workers return the AS links of the MRT files they parse, not the routes, and
+# the links of the hours are added to the topology in the order of the hours.
+####
+
+watched_ixps = set()
+
+def init_worker(ixp_set):
+    global watched_ixps
+    watched_ixps = ixp_set
+
 class CollectUpdates:
-    def __init__(self, nb_vps: int=10, max_workers: int=4):
+    def __init__(self, nb_vps: int=10, max_workers: int=4, cache: MRTCache=None, max_hours_in_flight: int=3, checkpoint_dir: str=None):
 
         # Max number of processes when download mrt files.
         self.max_workers = max_workers
 
+        # Max number of hours processed at the same time.
+        self.max_hours_in_flight = max_hours_in_flight
+
+        # Local cache of the MRT data (None to always download them).
+        self.cache = cache
+
+        # Directory of the checkpoints of the MRT files already processed (None for no checkpoint).
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint = None
+
         # Get list of vantage points with MVP.
         self.nb_vps = nb_vps
         self.vps_info = get_vps_info()
@@ -42,22 +72,29 @@ class CollectUpdates:
     def print_prefix(self):
         return Fore.YELLOW+Style.BRIGHT+"[collect_updates.py]: "+Style.NORMAL
 
-    def update_peers(self, nb_vps):
-        self.vps_set = get_vps(nb_vps)
+    # Collectors and peer IPs of the nb_vps vantage points.
+    def select_peers(self, nb_vps):
+        vps_set = get_vps(nb_vps)
 
         # Retrieve a list of collectors from which to download data
-        self.collectors = set()
-        for vp in self.vps_set:
-            self.collectors.add(vp[0])
+        collectors = set()
+        for vp in vps_set:
+            collectors.add(vp[0])
         
         # From the VP's asn, retrieve the corresponding peer's IPs.
-        self.peers = []
+        peers = []
 
-        for collector, asn in self.vps_set:
+        for collector, asn in vps_set:
             if asn in self.vps_info:
                 for vp in self.vps_info[asn]:
                     if vp[0].lower() == collector.lower():
-                        self.peers.append(vp[2])
+                        peers.append(vp[2])
+
+        return collectors, peers
+
+    def update_peers(self, nb_vps):
+        self.vps_set = get_vps(nb_vps)
+        self.collectors, self.peers = self.select_peers(nb_vps)
 
     # Function to load the ixps number from ixp file.
     def get_ixps(self, infile):
@@ -71,100 +108,148 @@ class CollectUpdates:
         return ixps
 
     # Helper function that uses the bgpkit broker to retrieve MRT files to
-    # download.
+    # download (or the MRT cache, if any, in the last parameter).
     def query_helper(params_list):
-        broker = bgpkit.Broker()
-        return broker.query( \
-            ts_start=params_list[0], \
-            ts_end=params_list[1], \
-            data_type=params_list[2], \
-            collector_id=params_list[3])
+        return mrtcache.query(params_list[:4], params_list[4])
 
     # Helper function that uses the bgpkit parser to download and parse the
-    # MRT files.
-    def parser_helper(params_list):
-        # print ('start: ', params_list[0], params_list[1])
-        parser = bgpkit.Parser( \
-            url=params_list[0], \
-            filters={"peer_ips": params_list[1], \
-                'type':'announce'})
-
-        failed = True
-        while failed:
+    # MRT files (or reads them from the MRT cache, if any, in the last parameter).
+    # Returns the AS links of the AS paths, in the order they are first seen.
+    def edges_helper(params_list):
+        for attempt in range(3):
+            edges = {}
             try:
-                tmp = parser.parse_all()
-                failed = False
+                for bgp_route in mrtcache.routes(params_list[0], params_list[1], params_list[2]):
+                    # Transform the as path into a list of integers.
+                    try:
+                        aspath = list(map(lambda x: int(x), bgp_route['as_path'].split(' ')))
+                    except ValueError:
+                        continue
+                    # Clean up the as path.
+                    aspath = remove_asprepending(aspath, watched_ixps)
+
+                    for i in range(0, len(aspath)-1):
+                        edges[(aspath[i], aspath[i+1])] = None
+
+                return list(edges)
+            except mrtcache.OfflineMiss:
+                raise
             except:
-                print (self.print_prefix()+'BGPKIT parser failed with params {}'.format(parser))
+                print (Fore.YELLOW+Style.BRIGHT+"[collect_updates.py]: "+Style.NORMAL+'BGPKIT parser failed with params {}'.format(params_list[:2]))
+
+        raise RuntimeError('BGPKIT parser failed with params {}'.format(params_list[:2]))
 
-        # print ('stop: ', params_list[0], len(tmp))
-        return tmp
+    # Submit a task to the worker pool, a new pool being started if the workers
+    # of the current one died.
+    def submit(self, fn, params_list):
+        with self.pool_lock:
+            return self.executor.submit(fn, params_list)
+
+    ####
+    # Pool of worker processes. The workers are started from the threads of the
+    # hours, while the other threads print and submit tasks: they are not forked
+    # from this multi-threaded process (they could inherit a held lock, e.g., the
+    # one of stdout) but started by a fork server, and get their state from
+    # init_worker.
+    ####
+
+    def new_pool(self):
+        return futures.ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("forkserver"), initializer=init_worker, initargs=(self.ixp_set,))
+
+    def restart_pool(self, executor):
+        with self.pool_lock:
+            if self.executor is executor:
+                executor.shutdown(wait=False)
+                self.executor = self.new_pool()
+
+    ####
+    # AS links of one hour. On failure, the hour is processed again: only the MRT
+    # files that failed, the others being checkpointed. The number of vantage points
+    # is divided by two only after nb_tries failures with the same vantage points
+    # (dead workers included), and the hour fails when no vantage point is left.
+    ####
+
+    def collect_hour(self, cur_ts_start, cur_end_start, nb_tries: int=3):
+        cur_nb_vps = self.nb_vps
+        nb_failures = 0
+
+        while True:
+            collectors, peers = self.select_peers(cur_nb_vps)
+            print (self.print_prefix()+'{} -> {}: Searching for BGP MRT file (nb_vps={})'.format(cur_ts_start, cur_end_start, len(peers)))
+
+            executor = self.executor
+            try:
+                # Get the MRT file download.
+                query_futures = []
+                for c in collectors:
+                    query_futures.append(self.submit(CollectUpdates.query_helper, (cur_ts_start, cur_end_start, 'update', c, self.cache)))
+
+                tasks = []
+                for f in query_futures:
+                    for url in f.result():
+                        tasks.append((CollectUpdates.edges_helper, [url, ', '.join(peers), self.cache], ('updates', url, ', '.join(peers), self.ixp_key)))
+
+                print (self.print_prefix()+'{} -> {}: BGP MRT files found, starting to parse them...'.format(cur_ts_start, cur_end_start))
+
+                edges = {}
+                for result in run_tasks(tasks, self.submit, self.checkpoint):
+                    for edge in result:
+                        edges[edge] = None
+
+                return list(edges)
+            except BrokenProcessPool:
+                # The workers have died (e.g., out of memory): a new pool is started, and
+                # the failure counts as any other, in case an MRT file always kills its worker.
+                self.restart_pool(executor)
+                print (self.print_prefix()+'Workers have died, retrying ...')
+            except mrtcache.OfflineMiss:
+                raise
+            except:
+                print (self.print_prefix()+'Execution has failed, retrying ...')
+
+            nb_failures += 1
+            if nb_failures == nb_tries:
+                # Divide the number of VPs to use by two.
+                cur_nb_vps = int(cur_nb_vps/2.)
+                nb_failures = 0
+                if cur_nb_vps == 0:
+                    raise RuntimeError('{} -> {}: Execution has failed with every number of VPs'.format(cur_ts_start, cur_end_start))
+
+                print (self.print_prefix()+'{} -> {}: Execution has failed {} times, retrying with {} VPs ...'.format(cur_ts_start, cur_end_start, nb_tries, cur_nb_vps))
 
     def build_snapshot(self, ts_start: str=None, ts_end: str=None, ixp_file: str=None, outfile: str=None):
         # AS-level topology build from the AS paths.
         topo = nx.DiGraph()
 
-        # Load IXP ASN file.
-        ixp_set = self.get_ixps(ixp_file)
+        # Load IXP ASN file. The results of the MRT files depend on it, and so do their checkpoints.
+        self.ixp_set = self.get_ixps(ixp_file)
+        self.ixp_key = checkpoint_key(*sorted(self.ixp_set))
 
-        # Initialize the current start and end date.
+        # Process the data hour by hour to limit memory utilization.
+        hours = []
         cur_ts_start = ts_start
         cur_end_start = ts_start + timedelta(hours=1)
-
-        # Process the data hour by hour to limit memory utilization.
         while cur_end_start <= ts_end:
-            cur_nb_vps = self.nb_vps
-            failed = True
-
-            while failed:
-                self.update_peers(cur_nb_vps)
-                print (self.print_prefix()+'{} -> {}: Searching for BGP MRT file (nb_vps={})'.format(cur_ts_start, cur_end_start, len(self.peers)))
-                
-                try:
-                    # Get the MRT file download.
-                    params_query = []
-                    for c in self.collectors:
-                        params_query.append((cur_ts_start, cur_end_start, 'update', c)) 
-
-                    parser_params = []
-                    with futures.ProcessPoolExecutor(self.max_workers) as executor:
-                        for result in executor.map(CollectUpdates.query_helper, params_query):
-                            for broker_item in result:
-                                parser_params.append([broker_item.url, ', '.join(self.peers)])
-
-                    print (self.print_prefix()+'{} -> {}: BGP MRT files found, starting to parse them...'.format(cur_ts_start, cur_end_start))
-
-                    with futures.ProcessPoolExecutor(self.max_workers) as executor:
-                        for result in executor.map(CollectUpdates.parser_helper, parser_params):
-                            for bgp_route in result:
-                                # Transform the as path into a list of integers.
-                                try:
-                                    aspath = list(map(lambda x: int(x), bgp_route['as_path'].split(' ')))
-                                except ValueError:
-                                    continue
-                                # Clean up the as path.
-                                aspath = remove_asprepending(aspath, ixp_set)
-
-                                if aspath is not None:
-                                    # Update the topology.
-                                    for i in range(0, len(aspath)-1):
-                                        topo.add_edge(aspath[i], aspath[i+1])
-                                else:
-                                    print (bgp_route)
-                                    
-                    failed = False
-                except:
-                    failed = True
-                    # Divide the number of VPs to use by two.
-                    cur_nb_vps = cur_nb_vps/2.
-                    self.update_peers(cur_nb_vps)
-
-                    print (self.print_prefix()+'Execution has failed, retrying ...')
+            hours.append((cur_ts_start, cur_end_start))
 
             # Move to the next hour.
             cur_ts_start = cur_end_start
             cur_end_start = cur_end_start + timedelta(hours=1)
 
+        # The MRT files of the output already processed by a previous run are not processed again.
+        if self.checkpoint_dir is not None and outfile is not None:
+            self.checkpoint = Checkpoint(self.checkpoint_dir, os.path.basename(outfile))
+
+        self.pool_lock = threading.Lock()
+        self.executor = self.new_pool()
+        try:
+            with futures.ThreadPoolExecutor(self.max_hours_in_flight) as hours_executor:
+                for edges in hours_executor.map(lambda hour: self.collect_hour(*hour), hours):
+                    # Update the topology.
+                    topo.add_edges_from(edges)
+        finally:
+            self.executor.shutdown()
+
         print (self.print_prefix()+'{} -> {}: topo size: {} {}'.format(ts_start, ts_end, topo.number_of_nodes(), topo.number_of_edges()))
         
         # Print in a file the resulting topology.
@@ -172,6 +257,10 @@ class CollectUpdates:
             with open(outfile, 'w') as fd:
                 for as1, as2 in topo.edges():
                     fd.write("{} {}\n".format(as1, as2))
+            write_edges(outfile, topo.edges())
+
+        if self.checkpoint is not None:
+            self.checkpoint.clear()
 
 if __name__ == "__main__":
     cu = CollectUpdates(nb_vps=20, max_workers=20)
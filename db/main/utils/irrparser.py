@@ -1,5 +1,9 @@
+import os
 import networkx as nx
 import re 
+from collections import deque
+from concurrent import futures
+from utils.edgefile import write_edges
 
 from colorama import Fore
 from colorama import Style
@@ -82,36 +86,48 @@ class ASset:
             else:
                 members_line = False
 
-    def get_as_set_members_recursively(as_set_name: str, as_set_dic: dict, max_rec: int=10):
-        # Initialisation of the recursion.
-        members_rec = set()
-        as_set_next_iter = as_set_dic[as_set_name].as_set_rec
-        as_set_already_iter = as_set_dic[as_set_name].as_set_rec
-        nb_iter = 0
-
-        while nb_iter < 10 and len(as_set_next_iter) > 0:
-            # Update the set of AS sets already processed, to avoid processing twice the same AS set.
-            as_set_already_iter = as_set_already_iter.union(as_set_next_iter)
-
-            new_as_set_next_iter = set()
-
-            # For every AS set in the batch for the current iteration.
-            for as_set in as_set_next_iter:
-
-                if as_set in as_set_dic:
-                    # Add the members of this AS set.
-                    members_rec = members_rec.union(as_set_dic[as_set].as_members)
-
-                    # Add the AS set of this AS set in the next batch.
-                    for as_set_tmp in as_set_dic[as_set].as_set_rec:
-                        if as_set_tmp not in as_set_already_iter:
-                            new_as_set_next_iter.add(as_set_tmp)
+    ####
+    # Recursive members of all the AS sets, i.e., the members of the AS sets that
+    # every AS set references directly or transitively (as_members_rec). The
+    # references between the AS sets form a graph: its strongly connected
+    # components (the AS sets referencing each other) share the same members, and
+    # the components are resolved once each, from the leaves of the condensation
+    # up, so that an AS set referenced by many others is expanded only once.
+    # The references to AS sets that are not in the dumps are ignored.
+    ####
+
+    @staticmethod
+    def resolve_members_recursively(as_set_dic: dict):
+        ref_graph = nx.DiGraph()
+        ref_graph.add_nodes_from(as_set_dic)
+        for as_set_name, as_set in as_set_dic.items():
+            for as_set_tmp in as_set.as_set_rec:
+                if as_set_tmp in as_set_dic:
+                    ref_graph.add_edge(as_set_name, as_set_tmp)
+
+        cond = nx.condensation(ref_graph)
+
+        # Members of the AS sets of every component and of the components it references.
+        closure = {}
+        for c in reversed(list(nx.topological_sort(cond))):
+            names = cond.nodes[c]['members']
+            succ = list(cond.successors(c))
+
+            # Members of the referenced components, shared when there is only one.
+            if len(succ) == 1:
+                below = closure[succ[0]]
+            else:
+                below = frozenset().union(*(closure[d] for d in succ))
 
-            # Prepare the next iteration.
-            as_set_next_iter = new_as_set_next_iter
-            nb_iter += 1
+            own = frozenset().union(*(as_set_dic[name].as_members for name in names))
+            closure[c] = below if own <= below else below | own
 
-        return members_rec
+            # An AS set referencing itself, directly or in a cycle, is its own recursive member.
+            if len(names) > 1 or ref_graph.has_edge(next(iter(names)), next(iter(names))):
+                for name in names:
+                    as_set_dic[name].as_members_rec = closure[c]
+            else:
+                as_set_dic[next(iter(names))].as_members_rec = below
 
 
 class AutNum:
@@ -160,12 +176,15 @@ class AutNum:
             if line.startswith('changed'):
                 self.changed = line.rstrip('\n').replace('changed: ', '')
 
-    def get_links(self, as_set_dic):
+    ####
+    # References of the import and export lines: the direct AS numbers (int) and
+    # the names of the AS set objects (str), in the order of the lines.
+    ####
+
+    def get_references(self):
         import_line = False
         export_line = False
 
-        cur_as = self.aut_num.replace('AS', '')
-
         for line in self.text.split('\n'):
 
             if line.startswith(' '):
@@ -178,94 +197,145 @@ class AutNum:
             if line.startswith('import:') or line.startswith("mp-import") or (subline and import_line):
                 import_line = True
                 export_line = False
-
-                # Find direct AS numbers.
-                as_list = set(map(lambda x:x.replace(' ', ''), re.findall(' AS[0-9]+ ', line)))
-                for asn in as_list:
-                    yield (cur_as, int(asn.replace('AS', '')), 0)
-
-                # Recusively find ases in as-set.
-                as_object_list = re.findall('to AS[a-zA-Z0-9:_.-]+ ', line)
-                for obj in as_object_list:
-                    # Remove direct AS labels.
-                    obj_name = obj.replace('to ', '').replace(' ', '')
-
-                    if obj_name not in as_list and obj_name != 'AS-ANY':
-                        # Return all the links infered from the AS set object.
-                        if obj_name in as_set_dic:
-                            for as_member in as_set_dic[obj_name].as_members:
-                                yield (cur_as, int(as_member.replace('AS', '')), 1)
-                            
-                            for as_member in as_set_dic[obj_name].as_members_rec:
-                                yield (cur_as, int(as_member.replace('AS', '')), 1)
-
             elif line.startswith('export:') or line.startswith("mp-export") or (subline and export_line):
                 export_line = True
                 import_line = False
-
-                # Find direct AS numbers.
-                as_list = set(map(lambda x:x.replace(' ', ''), re.findall(' AS[0-9]+ ', line)))
-                for asn in as_list:
-                    yield (cur_as, int(asn.replace('AS', '')), 0)
-
-                # Recusively find ases in as-set.
-                as_object_list = re.findall('to AS[a-zA-Z0-9:_.-]+ ', line)
-                for obj in as_object_list:
-                    # Remove direct AS labels.
-                    obj_name = obj.replace('to ', '').replace(' ', '')
-
-                    if obj_name not in as_list and obj_name != 'AS-ANY':
-                        # Return all the links infered from the AS set object.
-                        if obj_name in as_set_dic:
-                            for as_member in as_set_dic[obj_name].as_members:
-                                yield (cur_as, int(as_member.replace('AS', '')), 1)
-                            
-                            for as_member in as_set_dic[obj_name].as_members_rec:
-                                yield (cur_as, int(as_member.replace('AS', '')), 1)
-
             else:
                 import_line = False
                 export_line = False
+                continue
+
+            # Find direct AS numbers.
+            as_list = set(map(lambda x:x.replace(' ', ''), re.findall(' AS[0-9]+ ', line)))
+            for asn in as_list:
+                yield int(asn.replace('AS', ''))
+
+            # Find the as-set objects, to expand recursively.
+            as_object_list = re.findall('to AS[a-zA-Z0-9:_.-]+ ', line)
+            for obj in as_object_list:
+                # Remove direct AS labels.
+                obj_name = obj.replace('to ', '').replace(' ', '')
+
+                if obj_name not in as_list and obj_name != 'AS-ANY':
+                    yield obj_name
+
+    def get_links(self, as_set_dic):
+        return expand_references(self.aut_num.replace('AS', ''), self.get_references(), as_set_dic)
+
+
+####
+# Links (cur_as, as2, t) of the references of an aut-num object: t is 0 for the
+# direct AS numbers, 1 for the members of the AS sets.
+####
+
+def expand_references(cur_as: str, references, as_set_dic: dict):
+    for ref in references:
+        if isinstance(ref, int):
+            yield (cur_as, ref, 0)
+
+        # Return all the links infered from the AS set object.
+        elif ref in as_set_dic:
+            for as_member in as_set_dic[ref].as_members:
+                yield (cur_as, int(as_member.replace('AS', '')), 1)
+
+            for as_member in as_set_dic[ref].as_members_rec:
+                yield (cur_as, int(as_member.replace('AS', '')), 1)
+
+
+####
+# RPSL objects of an IRR dump, read line by line: the objects are separated by
+# one or more empty lines. Only one object is in memory at a time.
+####
+
+def iter_objects(infile: str):
+    lines = []
+    with open(infile, 'r', encoding='utf-8', errors='ignore') as fd:
+        for line in fd:
+            if line.rstrip('\n'):
+                lines.append(line)
+            elif len(lines):
+                yield ''.join(lines).rstrip('\n')
+                lines = []
+
+    if len(lines):
+        yield ''.join(lines).rstrip('\n')
+
+
+####
+# Worker side: the AS and the references of every aut-num object of the chunk.
+# The as-set objects are expanded by the main process, once they are all read.
+####
+
+def autnum_helper(objs: list):
+    refs = []
+    for obj in objs:
+        autnum = AutNum(obj)
+        autnum.init_metadata()
+        refs.append((autnum.aut_num.replace('AS', ''), list(autnum.get_references())))
+
+    return refs
 
 
 def print_prefix():
     return Fore.MAGENTA+Style.BRIGHT+"[irrparser.py]: "+Style.NORMAL
 
 
-def parse_irr_snapshot(infile_list: list, outfile: str):
-    # First, process the as-set objects and infer their members, recursively.
+####
+# Infer the AS topology from the IRR dumps. Every dump is read once: the as-set
+# objects are parsed on the fly, and the aut-num objects are sent by chunks of
+# chunk_size objects to a pool of max_workers processes, which extract their
+# import/export references. At most two chunks per worker are in flight, so that
+# the memory does not depend on the size of the dumps. The AS sets referenced by
+# the aut-num objects are expanded once all the as-set objects are known.
+####
+
+def parse_irr_snapshot(infile_list: list, outfile: str, max_workers: int=None, chunk_size: int=2000):
+    max_workers = max_workers if max_workers is not None else os.cpu_count()
     as_set_dic = {}
+    refs = []
+
+    print (print_prefix()+"Reading the as-set and aut-num objects.")
+    with futures.ProcessPoolExecutor(max_workers) as executor:
+        pending = deque()
+
+        def submit(chunk):
+            pending.append(executor.submit(autnum_helper, chunk))
+            while len(pending) > 2*max_workers:
+                refs.extend(pending.popleft().result())
 
-    print (print_prefix()+"Reading the as-set objects.")
-    for infile in infile_list:
-        print (print_prefix()+infile)
-        with open(infile, 'r', encoding='utf-8', errors='ignore') as fd:
-            for obj in fd.read().split('\n\n'):
+        for infile in infile_list:
+            print (print_prefix()+infile)
+            chunk = []
+            for obj in iter_objects(infile):
                 if 'as-set:' in obj:
                     as_set = ASset(obj)
                     as_set.init_metadata()
                     as_set.get_members()
                     as_set_dic[as_set.as_set_name] = as_set
 
+                if obj.startswith('aut-num:'):
+                    chunk.append(obj)
+                    if len(chunk) >= chunk_size:
+                        submit(chunk)
+                        chunk = []
+
+            if len(chunk):
+                submit(chunk)
+
+        while len(pending):
+            refs.extend(pending.popleft().result())
+
     print (print_prefix()+'Build as-set objects recursively.')
     # Run the recursive ASset membership inference.
-    for as_set_name, as_set in as_set_dic.items():
-        as_set.as_members_rec = ASset.get_as_set_members_recursively(as_set_name, as_set_dic, max_rec=10)
+    ASset.resolve_members_recursively(as_set_dic)
 
-    # Second, process the aut-num objects and infer the AS topologly.
-    aut_num_list = []
+    # Then, infer the AS topology from the references of the aut-num objects.
     topo = nx.DiGraph()
 
-    print (print_prefix()+"Constructing the topology.")    
-    for infile in infile_list:
-        print (print_prefix()+infile)
-        with open(infile, 'r', encoding='utf-8', errors='ignore') as fd:
-            for obj in fd.read().split('\n\n'):
-                if obj.startswith('aut-num:'):
-                    autnum = AutNum(obj)
-                    autnum.init_metadata()
-                    for (as1, as2, t) in autnum.get_links(as_set_dic):
-                        topo.add_edge(as1, as2)
+    print (print_prefix()+"Constructing the topology.")
+    for (cur_as, references) in refs:
+        for (as1, as2, t) in expand_references(cur_as, references, as_set_dic):
+            topo.add_edge(as1, as2)
 
     print (print_prefix()+"IRR topo size {} nodes and {} edges".format(topo.number_of_nodes(), topo.number_of_edges()))
 
@@ -273,6 +343,7 @@ def parse_irr_snapshot(infile_list: list, outfile: str):
     with open(outfile, 'w') as fd:
         for as1, as2 in topo.edges():
             fd.write('{} {}\n'.format(as1, as2))
+    write_edges(outfile, topo.edges())
 
 
 
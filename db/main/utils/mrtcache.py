@@ -0,0 +1,228 @@
+import os
+import gzip
+import json
+import hashlib
+import bgpkit
+from datetime import datetime, timedelta, timezone
+
+from colorama import Fore
+from colorama import Style
+
+
+####
+# Local cache of the MRT data. The announcements parsed from an MRT file with a
+# peer filter are stored once, gzip compressed, one route per line, in a file
+# named after the hash of the URL and of the filter; the lists of MRT files found
+# with the bgpkit broker are stored in the same way, once all the files of the
+# queried period are published (publication_delay). The collections that read
+# the same files again (updates, RIBs and new edge paths of the same hours, reruns
+# and retries after a failure) read them from the cache instead of downloading
+# and parsing them again.
+#
+# The files are written under a temporary name and renamed once complete. A file
+# read from the cache is touched, and the least recently used files are removed
+# when the cache is larger than its size budget. In offline mode, nothing is
+# downloaded: the data missing from the cache directory raises OfflineMiss, so
+# that no output is written from incomplete data.
+#
+# The same module is in db/main/utils and newedge/main/utils.
+####
+
+route_fields = ["timestamp", "peer_asn", "peer_ip", "prefix", "as_path"]
+
+# Delay after the end of a period after which all its MRT files are assumed to be
+# published by the collectors. The broker answers for more recent periods may be
+# incomplete: they are not cached.
+publication_delay = timedelta(hours=6)
+
+
+####
+# Data missing from the cache in offline mode. It is not retried by the
+# collections, the job fails instead.
+####
+
+class OfflineMiss(RuntimeError):
+    pass
+
+
+def published(ts_end):
+    try:
+        if isinstance(ts_end, str):
+            ts_end = datetime.fromisoformat(ts_end)
+    except ValueError:
+        return False
+
+    if ts_end.tzinfo is not None:
+        ts_end = ts_end.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return ts_end + publication_delay <= datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def print_prefix():
+    return Fore.BLUE+Style.BRIGHT+"[mrtcache.py]: "+Style.NORMAL
+
+
+def cache_key(*params):
+    return hashlib.sha256('\n'.join(map(str, params)).encode("utf-8")).hexdigest()
+
+
+def route_line(route):
+    return '\t'.join('' if route[field] is None else repr(route[field]) if field == "timestamp" else str(route[field]) \
+        for field in route_fields)+'\n'
+
+
+def line_route(line):
+    timestamp, peer_asn, peer_ip, prefix, as_path = line.rstrip('\n').split('\t')
+    return {
+        "timestamp": float(timestamp),
+        "peer_asn": int(peer_asn) if peer_asn else None,
+        "peer_ip": peer_ip,
+        "prefix": prefix,
+        "as_path": as_path if as_path else None}
+
+
+class MRTCache:
+    def __init__(self, cache_dir: str, max_size: float=50, offline: bool=False):
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size*1e9)  # Size budget, in GB
+        self.offline = offline
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def filename(self, key, ext):
+        return "{}/{}.{}".format(self.cache_dir, key, ext)
+
+    def hit(self, fn):
+        if not os.path.isfile(fn):
+            return False
+
+        try:
+            os.utime(fn)
+        except OSError:
+            return False
+
+        return True
+
+    ####
+    # Remove the least recently used files until the cache fits in its budget.
+    ####
+
+    def evict(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                st = os.stat(self.cache_dir+'/'+name)
+                files.append((st.st_mtime, st.st_size, name))
+            except FileNotFoundError:
+                continue
+
+        size = sum(f[1] for f in files)
+        for (_, fsize, name) in sorted(files):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(self.cache_dir+'/'+name)
+            except FileNotFoundError:
+                pass
+            size -= fsize
+
+    ####
+    # URLs of the MRT files found by the bgpkit broker for the query parameters
+    # (ts_start, ts_end, data_type, collector_id, with UTC times). Only the lists
+    # of the periods ended publication_delay ago are cached.
+    ####
+
+    def query(self, params_list):
+        fn = self.filename(cache_key("query", *params_list), "json")
+        if self.hit(fn):
+            with open(fn, 'r') as fd:
+                return json.load(fd)
+
+        if self.offline:
+            raise OfflineMiss('Offline: no MRT file in the cache for {}'.format(params_list))
+
+        urls = broker_query(params_list)
+
+        # The files of the recent hours may not all be published yet
+        if not len(urls) or not published(params_list[1]):
+            return urls
+
+        fn_tmp = "{}.{}.tmp".format(fn, os.getpid())
+        with open(fn_tmp, 'w') as fd:
+            json.dump(urls, fd)
+        os.replace(fn_tmp, fn)
+
+        return urls
+
+    ####
+    # Announcements of the MRT file at url from the peers (comma separated IPs),
+    # as dicts with the route_fields. When they are not in the cache, the routes
+    # are streamed from the bgpkit parser and written to the cache at the same time.
+    ####
+
+    def routes(self, url, peers):
+        fn = self.filename(cache_key("routes", url, peers), "routes.gz")
+        if self.hit(fn):
+            with gzip.open(fn, 'rt') as fd:
+                for line in fd:
+                    yield line_route(line)
+            return
+
+        if self.offline:
+            raise OfflineMiss('Offline: MRT file {} not in the cache'.format(url))
+
+        fn_tmp = "{}.{}.tmp".format(fn, os.getpid())
+        try:
+            with gzip.open(fn_tmp, 'wt', compresslevel=1) as fd:
+                for route in parse_routes(url, peers):
+                    fd.write(route_line(route))
+                    yield route
+            os.replace(fn_tmp, fn)
+        finally:
+            if os.path.isfile(fn_tmp):
+                os.remove(fn_tmp)
+
+        self.evict()
+
+
+def broker_query(params_list):
+    broker = bgpkit.Broker()
+    return [broker_item.url for broker_item in broker.query( \
+        ts_start=params_list[0], \
+        ts_end=params_list[1], \
+        data_type=params_list[2], \
+        collector_id=params_list[3])]
+
+
+def parse_routes(url, peers):
+    parser = bgpkit.Parser( \
+        url=url, \
+        filters={"peer_ips": peers, \
+            'type':'announce'})
+
+    return iter(parser)
+
+
+####
+# Routes of the MRT file, from the cache if any
+####
+
+def routes(url, peers, cache: MRTCache=None):
+    if cache is None:
+        return parse_routes(url, peers)
+
+    return cache.routes(url, peers)
+
+
+####
+# URLs of the MRT files for the broker query parameters, from the cache if any
+####
+
+def query(params_list, cache: MRTCache=None):
+    if cache is None:
+        return broker_query(params_list)
+
+    return cache.query(params_list)
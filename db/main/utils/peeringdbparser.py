@@ -9,13 +9,24 @@ init(autoreset=True)
 def print_prefix():
     return Fore.BLUE+Style.BRIGHT+"[peerindbparser.py]: "+Style.NORMAL
 
-def read_asn_facilities(peeringdb_file, outfile):
+####
+# Read the PeeringDB from a CAIDA's snaphot. The parsers below take the loaded
+# data, so that the snapshot is read only once for all of them; they read the
+# snapshot themselves when it is not given.
+####
+
+def load_peeringdb(peeringdb_file):
+    with open(peeringdb_file, 'r') as fd:
+        return json.load(fd)
+
+def read_asn_facilities(peeringdb_file, outfile, data: dict=None):
     print (print_prefix()+"Parsing facilities, saving in: {}".format(outfile))
 
     net_to_fac = {}  # AS ID -> Fac list.
 
     # Read the PeeringDB from a CAIDA's snaphot.
-    data = json.load(open(peeringdb_file, 'r'))
+    if data is None:
+        data = load_peeringdb(peeringdb_file)
 
     # Focus on the netfac item, and get facilities for every AS.
     for netfac in data['netfac']["data"]:
@@ -34,13 +45,14 @@ def read_asn_facilities(peeringdb_file, outfile):
 
             fd.write('{} {}\n'.format(k, s))
 
-def read_asn_ixps(peeringdb_file, outfile):
+def read_asn_ixps(peeringdb_file, outfile, data: dict=None):
     print (print_prefix()+"Parsing ixps, saving in: {}".format(outfile))
 
     net_to_ixp = {}  # AS ID -> Fac list.
     
     # Read the PeeringDB from a CAIDA's snaphot.
-    data = json.load(open(peeringdb_file, 'r'))
+    if data is None:
+        data = load_peeringdb(peeringdb_file)
 
     # Focus on the netixlan item, and get ixp for every AS.
     for netixlan in data['netixlan']["data"]:
@@ -59,7 +71,7 @@ def read_asn_ixps(peeringdb_file, outfile):
 
             fd.write('{} {}\n'.format(k, s))
 
-def read_ixps(peeringdb_file, caidaixp_tmp_file, outfile):
+def read_ixps(peeringdb_file, caidaixp_tmp_file, outfile, data: dict=None):
     print (print_prefix()+"Parsing caida ixps, saving in: {}".format(outfile))
 
     # Read the IXP info from a CAIDA's files.
@@ -70,7 +82,8 @@ def read_ixps(peeringdb_file, caidaixp_tmp_file, outfile):
                 caida_ixp_asn.add(json.loads(line.rstrip('\n|\r'))['asn'])
 
     # Read the PeeringDB from a CAIDA's snaphot.
-    data = json.load(open(peeringdb_file, 'r'))
+    if data is None:
+        data = load_peeringdb(peeringdb_file)
 
     # Get the ASN of all the network with type "route server".
     route_server_asn = set()
@@ -84,7 +97,7 @@ def read_ixps(peeringdb_file, caidaixp_tmp_file, outfile):
 
 
 
-def read_asn_country(peeringdb_file, bgpview_file, outfile):
+def read_asn_country(peeringdb_file, bgpview_file, outfile, data: dict=None):
     print (print_prefix()+"Parsing country, saving in: {}".format(outfile))
 
     org_to_country = {} # Org ID -> country.
@@ -99,7 +112,8 @@ def read_asn_country(peeringdb_file, bgpview_file, outfile):
             asn_to_country[asn] = (country, 'bgpview')
 
     # Read the PeeringDB from a CAIDA's snaphot.
-    data = json.load(open(peeringdb_file, 'r'))
+    if data is None:
+        data = load_peeringdb(peeringdb_file)
 
     # Get the country for every organisation.
     for org in data['org']["data"]:
@@ -114,3 +128,18 @@ def read_asn_country(peeringdb_file, bgpview_file, outfile):
     with open(outfile, 'w') as fd:
         for asn, value in asn_to_country.items():
             fd.write('{} {} {}\n'.format(asn, value[0], value[1]))
+
+
+####
+# Parse a PeeringDB snapshot into the facility, ixp, country and IXP list files,
+# reading the snapshot once.
+####
+
+def parse_peeringdb_snapshot(peeringdb_file, caidaixp_tmp_file, bgpview_file, outfile_fac, outfile_ixp, outfile_country, outfile_ixplist):
+    print (print_prefix()+"Reading {}".format(peeringdb_file))
+    data = load_peeringdb(peeringdb_file)
+
+    read_asn_facilities(peeringdb_file, outfile_fac, data=data)
+    read_asn_ixps(peeringdb_file, outfile_ixp, data=data)
+    read_asn_country(peeringdb_file, bgpview_file, outfile_country, data=data)
+    read_ixps(peeringdb_file, caidaixp_tmp_file, outfile_ixplist, data=data)
@@ -0,0 +1,100 @@
+import time
+from multiprocessing import Process
+from multiprocessing.connection import wait
+
+from colorama import Fore
+from colorama import Style
+
+
+####
+# Scheduler of the collection tasks. Every task runs in its own process once the
+# tasks it depends on are finished (whether they succeeded or not: a source is
+# collected without the data of a failed one, as when it is missing in the
+# database). A task belongs to a source (rib, updates, irr...): at most
+# concurrency[source] tasks of a source run at the same time, and at most
+# max_parallel tasks overall. The tasks are started in the order they are added.
+####
+
+class Task:
+    def __init__(self, name: str, source: str, target, args: tuple=(), deps: list=None):
+        self.name = name
+        self.source = source
+        self.target = target
+        self.args = args
+        self.deps = [d for d in (deps or []) if d != name]
+
+        self.process = None
+        self.start_ts = None
+        self.stop_ts = None
+        self.exitcode = None
+
+
+class Scheduler:
+    def __init__(self, concurrency: dict=None, max_parallel: int=4):
+        self.concurrency = concurrency or {}
+        self.max_parallel = max_parallel
+        self.tasks = dict()  # Task name to task, in the order they are added
+
+    def print_prefix(self):
+        return Fore.MAGENTA+Style.BRIGHT+"[scheduler.py]: "+Style.NORMAL
+
+    # Add a task, unless a task with the same name was already added (the monthly
+    # sources for several days of the same month). The dependencies that are not
+    # tasks of the scheduler are ignored.
+    def add(self, name: str, source: str, target, args: tuple=(), deps: list=None):
+        if name not in self.tasks:
+            self.tasks[name] = Task(name, source, target, args, deps)
+
+        return self.tasks[name]
+
+    def ready(self, task, running):
+        if task.process is not None:
+            return False
+        if any(d in self.tasks and self.tasks[d].exitcode is None for d in task.deps):
+            return False
+        if len(running) >= self.max_parallel:
+            return False
+
+        nb_source = sum(1 for t in running if t.source == task.source)
+        return nb_source < max(1, self.concurrency.get(task.source, 1))
+
+    def run(self):
+        running = []
+        start_ts = time.time()
+
+        while True:
+            for task in self.tasks.values():
+                if self.ready(task, running):
+                    print (self.print_prefix()+'Starting {}'.format(task.name))
+                    task.process = Process(target=task.target, args=task.args)
+                    task.start_ts = time.time()
+                    task.process.start()
+                    running.append(task)
+
+            if not len(running):
+                break
+
+            # Wait for at least one of the running tasks to finish.
+            wait([t.process.sentinel for t in running])
+            for task in list(running):
+                if not task.process.is_alive():
+                    task.process.join()
+                    task.stop_ts = time.time()
+                    task.exitcode = task.process.exitcode
+                    running.remove(task)
+                    print (self.print_prefix()+'{} finished in {:.1f} s (exit code {})'.format(task.name, task.stop_ts - task.start_ts, task.exitcode))
+
+        self.report(time.time() - start_ts)
+
+        return all(t.exitcode == 0 for t in self.tasks.values())
+
+    # Print the timings of the tasks.
+    def report(self, total_time):
+        print (self.print_prefix()+'Task timings:')
+        for task in sorted(self.tasks.values(), key=lambda t: t.start_ts):
+            print (self.print_prefix()+'  {:<30} {:>10.1f} s  start +{:.1f} s  {}'.format( \
+                task.name, \
+                task.stop_ts - task.start_ts, \
+                task.start_ts - min(t.start_ts for t in self.tasks.values()), \
+                'ok' if task.exitcode == 0 else 'failed ({})'.format(task.exitcode)))
+        print (self.print_prefix()+'All tasks done in {:.1f} s'.format(total_time))
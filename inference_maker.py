@@ -7,7 +7,7 @@ import pandas as pd
 #import click
 import sys
 from datetime import datetime
-from io import StringIO
+from utils.results import ColumnarResults
 
 
 all_feats_cat = {
@@ -34,7 +34,7 @@ class InferenceMaker:
         self.overide = overide
         self.method = method
         self.fpr_weights = fpr_weights 
-        self.results = []
+        self.results = ColumnarResults()
         self.nb_days_training_data = nb_days_training_data
 
         if not os.path.isdir(self.db_dir+'/cases'):
@@ -122,37 +122,21 @@ class InferenceMaker:
                 line["proba"] = pred_proba[i][pred[i]]
                 line["sensitivity"] = fpr_weight
 
-                self.results.append(line.copy())
+                self.results.append(line)
 
     # transform the results of an inference into a CSV-form string
     def to_string(self):
-        s = ""
         if len(self.results) < 1:
-            return s
+            return ""
 
-        keys = list(self.results[0].keys())
-
-
-        s += " ".join(keys)
-        s += "\n"
-
-        for line in self.results:
-            str_line = [str(v) for v in list(line.values())]
-
-            s+= " ".join(str_line)
-            s += "\n"
-
-        return s
+        return self.results.to_string()
 
     def to_df(self):
-        s = self.to_string()
-        io_data = StringIO(s)
-        try:
-            df = pd.read_csv(io_data, sep=" ")
-        except:
+        if len(self.results) < 1:
             print('Error to convert string to DF')
             exit(1)
-        return df
+
+        return self.results.to_df()
 
     #def to_df(self):
     #    try:
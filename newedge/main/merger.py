@@ -1,20 +1,36 @@
 import os
-import csv
 import networkx as nx
+import numpy as np
 from datetime import datetime, timedelta
 from concurrent import futures
 import click 
 
+from utils.edgefile import load_edges, iter_edges, write_edges
+from utils.timeline import Timeline
+
 from colorama import Fore
 from colorama import Style
 from colorama import init
 init(autoreset=True)
 
+# Day files merged in the topology, in the order they are read.
+day_files = ["_updates.txt", "_ribs2.txt", "_ribs.txt"]
+
+# An edge is stored as a single key, the smallest ASN in the high 32 bits and
+# the largest in the low 32 bits.
+def edge_keys(edges):
+    edges = np.sort(np.asarray(edges, dtype=np.uint64).reshape(-1, 2), axis=1)
+    return (edges[:, 0] << np.uint64(32)) | edges[:, 1]
+
+def key_edges(keys):
+    return keys >> np.uint64(32), keys & np.uint64(0xffffffff)
+
 class TopoGenerator:
     def __init__(self, db_dir: str, max_workers: str):
         self.db_dir = db_dir
         self.max_workers = max_workers
         self.prefix_dir = 'merged_topology'
+        self.index_dir = 'tmp/merged_index'
 
         # Init the database directory for the full topology if not created yet.
         if not os.path.isdir(self.db_dir+'/'+self.prefix_dir):
@@ -35,12 +51,26 @@ class TopoGenerator:
                             start_date:str, \
                             stop_date:str, \
                             override: bool=False, \
-                            nbdays: int=300):
+                            nbdays: int=300, \
+                            incremental: bool=False, \
+                            timeline: bool=False):
 
         # Transform string date to datetime object.
         start_date = datetime.strptime(start_date, "%Y-%m-%dT%H:%M:%S")
         stop_date = datetime.strptime(stop_date, "%Y-%m-%dT%H:%M:%S")
 
+        # The days are built from the appearance timeline of the edges.
+        if timeline:
+            for d in TopoGenerator.daterange(start_date, stop_date):
+                print (TopoGenerator.print_prefix()+self.get_topo_timeline(d.strftime("%Y-%m-%dT%H:%M:%S"), override, nbdays))
+            return
+
+        # The days are built one after the other from the persisted index.
+        if incremental:
+            for d in TopoGenerator.daterange(start_date, stop_date):
+                print (TopoGenerator.print_prefix()+self.get_topo_incremental(d.strftime("%Y-%m-%dT%H:%M:%S"), override, nbdays))
+            return
+
         # Generating the list of parameters used by the process pool exectur afterwards.
         paramslist = []
         for d in TopoGenerator.daterange(start_date, stop_date):
@@ -87,10 +117,7 @@ class TopoGenerator:
             updates_filename = db_dir+'/topology/'+cur_date.strftime("%Y-%m-%d")+"_updates.txt"
             
             if os.path.isfile(updates_filename): 
-                with open(updates_filename, 'r') as fd:
-                    csv_reader = csv.reader(fd, delimiter=' ')
-                    for row in csv_reader:
-                        topo_all.add_edge(int(row[0]), int(row[1]))
+                topo_all.add_edges_from(iter_edges(updates_filename))
             else: 
                 print (TopoGenerator.print_prefix()+datestr+': Update file {} does not exist, skipping it.'.format(updates_filename))
 
@@ -101,10 +128,7 @@ class TopoGenerator:
             if os.path.isfile(rib_filename): 
                 # print (TopoGenerator.print_prefix()+'Reading RIB file {}.'.format(rib_filename))
 
-                with open(rib_filename, 'r') as fd:
-                    csv_reader = csv.reader(fd, delimiter=' ')
-                    for row in csv_reader:
-                        topo_all.add_edge(int(row[0]), int(row[1]))
+                topo_all.add_edges_from(iter_edges(rib_filename))
 
             # Get the RIB from the CAIDA data.
             rib_filename = db_dir+'/topology/'+cur_date.strftime("%Y-%m-%d")+"_ribs.txt"
@@ -112,19 +136,162 @@ class TopoGenerator:
             if os.path.isfile(rib_filename): 
                 # print (TopoGenerator.print_prefix()+'Reading RIB file {}.'.format(rib_filename))
 
-                with open(rib_filename, 'r') as fd:
-                    csv_reader = csv.reader(fd, delimiter=' ')
-                    for row in csv_reader:
-                        topo_all.add_edge(int(row[0]), int(row[1]))
+                topo_all.add_edges_from(iter_edges(rib_filename))
 
         # Writing the resulting topology (caida + rib from peers + updates) in the database.
         fname = db_dir+'/'+prefix_dir+'/{}.txt'.format(datetime.strptime(datestr, "%Y-%m-%dT%H:%M:%S").strftime("%Y-%m-%d"))
         with open(fname, 'w', 1) as fd:
             for as1, as2 in topo_all.edges():
                 fd.write("{} {}\n".format(as1, as2))
+        write_edges(fname, topo_all.edges())
 
         return '{}: Graph built and save'.format(datestr)
 
+    ####
+    # Incremental mode. A persisted index keeps, for every edge seen in the window
+    # of the last built day, the last day it was seen (as a date ordinal). The
+    # topology of the next day is obtained by reading the files of that day only,
+    # updating the last seen day of their edges, and expiring the edges that were
+    # last seen before the first day of the window. The result is the same set of
+    # edges as get_topo_date, written once per edge with the smallest ASN first.
+    # The index is rebuilt from the files when it cannot be advanced: a different
+    # window size, a date before the index, or a day file of the window modified
+    # after the index was written.
+    ####
+
+    # Edges of the files of a given day, as keys.
+    def read_day_edges(paramslist):
+        db_dir = paramslist[0]
+        cur_date = paramslist[1]
+
+        keys = [np.zeros(0, dtype=np.uint64)]
+        for suffix in day_files:
+            filename = db_dir+'/topology/'+cur_date.strftime("%Y-%m-%d")+suffix
+
+            if os.path.isfile(filename):
+                keys.append(edge_keys(load_edges(filename)))
+            elif suffix == "_updates.txt":
+                print (TopoGenerator.print_prefix()+cur_date.strftime("%Y-%m-%d")+': Update file {} does not exist, skipping it.'.format(filename))
+
+        return np.unique(np.concatenate(keys))
+
+    def index_filename(self, nbdays: int):
+        return self.db_dir+'/'+self.index_dir+'/{}.npz'.format(nbdays)
+
+    # Load the index, returns None if it does not exist or cannot be advanced to date.
+    def load_index(self, date, nbdays: int):
+        fn = self.index_filename(nbdays)
+        if not os.path.isfile(fn):
+            return None
+
+        with np.load(fn) as data:
+            keys, last, index_day = data["keys"], data["last"], int(data["day"])
+
+        if index_day > date.toordinal():
+            return None
+
+        # Days already in the index that were modified after it was written.
+        index_mtime = os.path.getmtime(fn)
+        first_day = date - timedelta(days=nbdays)
+        for cur_date in TopoGenerator.daterange(first_day, datetime.fromordinal(index_day) + timedelta(days=1)):
+            for suffix in day_files:
+                filename = self.db_dir+'/topology/'+cur_date.strftime("%Y-%m-%d")+suffix
+                if os.path.isfile(filename) and os.path.getmtime(filename) > index_mtime:
+                    return None
+
+        return keys, last, index_day
+
+    def save_index(self, keys, last, day: int, nbdays: int):
+        if not os.path.isdir(self.db_dir+'/'+self.index_dir):
+            os.makedirs(self.db_dir+'/'+self.index_dir)
+
+        fn = self.index_filename(nbdays)
+        fn_tmp = '{}.{}.tmp'.format(fn, os.getpid())
+        with open(fn_tmp, 'wb') as fd:
+            np.savez(fd, keys=keys, last=last, day=day)
+        os.replace(fn_tmp, fn)
+
+    # Generate the topology for a given day from the index of the previous days.
+    def get_topo_incremental(self, datestr: str, override: bool=False, nbdays: int=300):
+        date = datetime.strptime(datestr, "%Y-%m-%dT%H:%M:%S").replace(hour=0, minute=0, second=0, microsecond=0)
+        fname = self.db_dir+'/'+self.prefix_dir+'/{}.txt'.format(date.strftime("%Y-%m-%d"))
+
+        # In case the full topology already exists, we just return the corresponding file.
+        if os.path.isfile(fname) and not override:
+            return "{}: New edge topology already exists.".format(datestr)
+
+        first_day = date - timedelta(days=nbdays)
+
+        index = self.load_index(date, nbdays)
+        if index is None or index[2] < first_day.toordinal():
+            keys, last = np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int32)
+            start_day = first_day
+        else:
+            keys, last, index_day = index
+            start_day = datetime.fromordinal(index_day) + timedelta(days=1)
+
+        # Read the new days (in parallel when rebuilding the window).
+        days = list(TopoGenerator.daterange(start_day, date + timedelta(days=1)))
+        paramslist = [[self.db_dir, cur_date] for cur_date in days]
+        if len(days) > 1 and self.max_workers > 1:
+            with futures.ProcessPoolExecutor(self.max_workers) as executor:
+                day_keys = list(executor.map(TopoGenerator.read_day_edges, paramslist))
+        else:
+            day_keys = [TopoGenerator.read_day_edges(params) for params in paramslist]
+
+        # Update the last seen day of the edges, keys stay sorted.
+        for (cur_date, new_keys) in zip(days, day_keys):
+            pos = np.searchsorted(keys, new_keys)
+            found = pos < len(keys)
+            found[found] = keys[pos[found]] == new_keys[found]
+
+            last[pos[found]] = cur_date.toordinal()
+            keys = np.insert(keys, pos[~found], new_keys[~found])
+            last = np.insert(last, pos[~found], cur_date.toordinal())
+
+        # Expire the edges that are out of the window.
+        keep = last >= first_day.toordinal()
+        keys, last = keys[keep], last[keep]
+
+        as1, as2 = key_edges(keys)
+        with open(fname, 'w', 1 << 20) as fd:
+            fd.writelines("{} {}\n".format(a, b) for (a, b) in zip(as1.tolist(), as2.tolist()))
+        write_edges(fname, np.column_stack((as1, as2)))
+
+        self.save_index(keys, last, date.toordinal(), nbdays)
+
+        return '{}: Graph built incrementally from {} new day(s) and save ({} edges)'.format(datestr, len(days), len(keys))
+
+    ####
+    # Timeline mode: the edges of the window are the edges whose appearance
+    # timeline (see utils/timeline.py) has a day in the window, in the updates or
+    # in the RIBs. The days of the window missing from the timeline are indexed
+    # first.
+    ####
+
+    def get_topo_timeline(self, datestr: str, override: bool=False, nbdays: int=300):
+        date = datetime.strptime(datestr, "%Y-%m-%dT%H:%M:%S").replace(hour=0, minute=0, second=0, microsecond=0)
+        fname = self.db_dir+'/'+self.prefix_dir+'/{}.txt'.format(date.strftime("%Y-%m-%d"))
+
+        # In case the full topology already exists, we just return the corresponding file.
+        if os.path.isfile(fname) and not override:
+            return "{}: New edge topology already exists.".format(datestr)
+
+        first_day = date - timedelta(days=nbdays)
+        sources_list = ["updates", "ribs2", "ribs"]
+
+        tl = Timeline(self.db_dir)
+        nb_indexed = tl.update(first_day, date, sources_list=sources_list)
+
+        # Undirected edges, with the smallest ASN first.
+        edges = np.unique(np.sort(tl.edges_seen(sources_list, first_day, date), axis=1), axis=0)
+
+        with open(fname, 'w', 1 << 20) as fd:
+            fd.writelines("{} {}\n".format(a, b) for (a, b) in edges.tolist())
+        write_edges(fname, edges)
+
+        return '{}: Graph built from the timeline ({} day(s) indexed) and save ({} edges)'.format(datestr, nb_indexed, len(edges))
+
 # Make the CLI.
 @click.command()
 @click.option('--date', help='Date for which to collect the full topology, in the following format "YYYY-MM-DDThh:mm:ss".', type=str)
@@ -133,6 +300,8 @@ class TopoGenerator:
 @click.option('--nbdays', default=300, help='Number of prior days to consider, default=300.', type=int)
 @click.option('--override', default=False, help='Override existing files.', type=bool)
 @click.option('--max_workers', default=10, help='Max number of worker when interval of time is used.', type=int)
+@click.option('--incremental', default=False, help='Build the topologies from a persisted index of the last day every edge was seen, reading only the new days.', type=bool)
+@click.option('--timeline', default=False, help='Build the topologies from the appearance timeline of the edges (db_dir/timeline).', type=bool)
 
 def generate_topology(\
     date, \
@@ -140,19 +309,28 @@ def generate_topology(\
     db_dir, \
     nbdays, \
     override, \
-    max_workers):
+    max_workers, \
+    incremental, \
+    timeline):
     """ Get the full (ie merged) topology from the downloaded updates and rib."""
 
     tc = TopoGenerator(db_dir, max_workers)
     if date_end is None:
-        #tc.get_topo_date(date, override, nbdays=nbdays)
-        paramslist = [db_dir, date, override, nbdays, 'merged_topology']
-        tc.get_topo_date(paramslist)
+        if timeline:
+            print (TopoGenerator.print_prefix()+tc.get_topo_timeline(date, override, nbdays=nbdays))
+        elif incremental:
+            print (TopoGenerator.print_prefix()+tc.get_topo_incremental(date, override, nbdays=nbdays))
+        else:
+            #tc.get_topo_date(date, override, nbdays=nbdays)
+            paramslist = [db_dir, date, override, nbdays, 'merged_topology']
+            tc.get_topo_date(paramslist)
     else:
         tc.get_topo_interval(date, \
                             date_end, \
                             override, \
-                            nbdays=nbdays)
+                            nbdays=nbdays, \
+                            incremental=incremental, \
+                            timeline=timeline)
 
 if __name__ == "__main__":
     generate_topology()
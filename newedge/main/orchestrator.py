@@ -1,5 +1,4 @@
 import os
-import csv
 import networkx as nx
 from datetime import datetime, timedelta
 import click 
@@ -10,19 +9,29 @@ from colorama import init
 init(autoreset=True)
 
 from utils.get_paths import GetPath
+from utils.edgefile import load_edges, iter_edges
+from utils.timeline import Timeline
+from utils.verdicts import VerdictIndex
+from utils.mrtcache import MRTCache
 
 
 class NewEdgeFinder:
-    def __init__(self, db_dir: str, nb_vps: int, max_workers: int):
+    def __init__(self, db_dir: str, nb_vps: int, max_workers: int, use_timeline: bool=False, mrt_cache: bool=False, mrt_cache_size: float=50, offline: bool=False):
         self.db_dir = db_dir
         self.nb_vps = nb_vps
         self.max_workers = max_workers
+        self.use_timeline = use_timeline
         self.prefix_dir = 'new_edge'
 
         # Init the database directory for the new edge cases if not created yet.
         if not os.path.isdir(self.db_dir+'/'+self.prefix_dir):
             os.mkdir(self.db_dir+'/'+self.prefix_dir)
 
+        # Local cache of the MRT files, shared with the collector.
+        self.mrt_cache = None
+        if mrt_cache or offline:
+            self.mrt_cache = MRTCache(self.db_dir+'/mrt_cache', max_size=mrt_cache_size, offline=offline)
+
     def print_prefix():
         return Fore.WHITE+Style.BRIGHT+"[NewEdgeFinder]: "+Style.NORMAL
 
@@ -60,60 +69,59 @@ class NewEdgeFinder:
             print('File already exist', out_filename)
             return None
         # All the suspicious cases detected the last nbdays days (to omit them).
-        suspicious_edges = {}
-        for cur_date in NewEdgeFinder.daterange(first_day, date):
-            case_filename = self.db_dir+'/cases/'+cur_date.strftime("%Y-%m-%d")
-            if os.path.isfile(case_filename):
-                with open(case_filename, 'r') as fd:
-                    for line in fd.readlines():
-                        if line.startswith('!sus'):
-                            linetab = line.rstrip().split(' ')
-                            as1 = int(linetab[1])
-                            as2 = int(linetab[2])
-
-                            if (as1, as2) not in suspicious_edges:
-                                suspicious_edges[(as1, as2)] = cur_date
-
-                        if line.startswith('!leg'):
-                            linetab = line.rstrip().split(' ')
-                            as1 = int(linetab[1])
-                            as2 = int(linetab[2])
-                            if (as1, as2) in suspicious_edges:
-                                del suspicious_edges[(as1, as2)]
+        # An edge is suspicious if its last verdict of the period is suspicious, since
+        # the day of the first suspicious verdict after its last legitimate one.
+        index = VerdictIndex(self.db_dir)
+        index.update(first_day, date - timedelta(days=1))
+        suspicious_edges = index.suspicious(first_day, date - timedelta(days=1))
 
         print (NewEdgeFinder.print_prefix()+"Number of suspicious edges: {}.".format(len(suspicious_edges)))
 
         # Load the graph before the date.
         topo_before = nx.Graph()
 
+        # With the timeline, only the edges of the current day are looked up: they
+        # are in the topology before the date if they were seen during the window
+        # of the merged topology of the previous day.
         filename = self.db_dir+'/merged_topology/'+(date - timedelta(days=1)).strftime("%Y-%m-%d")+".txt"
-        if os.path.isfile(filename): 
-            with open(filename, 'r') as fd:
-                csv_reader = csv.reader(fd, delimiter=' ')
-                for row in csv_reader:
-                    as1 = int(row[0])
-                    as2 = int(row[1])
-                    if ((as1, as2) not in suspicious_edges and (as2, as1) not in suspicious_edges) \
-                        or ((as1, as2) in suspicious_edges and (date-suspicious_edges[(as1, as2)]).days > 31) \
-                        or ((as2, as1) in suspicious_edges and (date-suspicious_edges[(as2, as1)]).days > 31):
-                        topo_before.add_edge(as1, as2)
-                    else:
-                        if (as1, as2) in suspicious_edges:
-                            print ('{} {} not added because suspicious {}'.format(as1, as2, suspicious_edges[(as1, as2)]))
-                        else:
-                            print ('{} {} not added because suspicious {}'.format(as1, as2, suspicious_edges[(as2, as1)]))
+        updates_filename = self.db_dir+'/topology/'+date.strftime("%Y-%m-%d")+"_updates.txt"
+        if self.use_timeline:
+            tl = Timeline(self.db_dir)
+            sources_list = ["updates", "ribs2", "ribs"]
+            day_before = date - timedelta(days=1)
+            first_day = day_before - timedelta(days=nbdays)
+            tl.update(first_day, day_before, sources_list=sources_list)
+
+            edges_before = []
+            if os.path.isfile(updates_filename):
+                edges = load_edges(updates_filename)
+                seen = tl.seen_edges(edges, sources_list, first_day, day_before) \
+                    | tl.seen_edges(edges[:, ::-1], sources_list, first_day, day_before)
+                edges_before = map(tuple, edges[seen].tolist())
+        elif os.path.isfile(filename):
+            edges_before = iter_edges(filename)
+        else:
+            edges_before = []
+
+        for as1, as2 in edges_before:
+            if ((as1, as2) not in suspicious_edges and (as2, as1) not in suspicious_edges) \
+                or ((as1, as2) in suspicious_edges and (date-suspicious_edges[(as1, as2)]).days > 31) \
+                or ((as2, as1) in suspicious_edges and (date-suspicious_edges[(as2, as1)]).days > 31):
+                topo_before.add_edge(as1, as2)
+            else:
+                if (as1, as2) in suspicious_edges:
+                    print ('{} {} not added because suspicious {}'.format(as1, as2, suspicious_edges[(as1, as2)]))
+                else:
+                    print ('{} {} not added because suspicious {}'.format(as1, as2, suspicious_edges[(as2, as1)]))
 
         # Check the diff with the edges in the current day to find the new edges.
-        filename = self.db_dir+'/topology/'+date.strftime("%Y-%m-%d")+"_updates.txt"
         topo_after = nx.Graph()
-        if os.path.isfile(filename): 
-            with open(filename, 'r') as fd:
-                csv_reader = csv.reader(fd, delimiter=' ')
-                for row in csv_reader:
-                    # Search for new link
-                    # Either the new link did not exist.
-                    if not topo_before.has_edge(int(row[0]), int(row[1])):
-                        topo_after.add_edge(int(row[0]), int(row[1]))
+        if os.path.isfile(updates_filename): 
+            for as1, as2 in iter_edges(updates_filename):
+                # Search for new link
+                # Either the new link did not exist.
+                if not topo_before.has_edge(as1, as2):
+                    topo_after.add_edge(as1, as2)
 
         # Get the ixp list filename.
         month_first_day = datetime.strptime(datestr, "%Y-%m-%dT%H:%M:%S").replace(day=1, hour=0, minute=0, second=0, microsecond=0)
@@ -123,7 +131,7 @@ class NewEdgeFinder:
 
         print (NewEdgeFinder.print_prefix()+datestr+': New edges computed. Found {} new edges.'.format(topo_after.number_of_edges()))
 
-        gp = GetPath(self.nb_vps, self.max_workers)
+        gp = GetPath(self.nb_vps, self.max_workers, cache=self.mrt_cache, checkpoint_dir=self.db_dir+'/tmp/checkpoints')
         edge_paths = gp.collect_paths(ts_start=date, ts_end=date + timedelta(days=1), edges=set(topo_after.edges()), ixp_file=ixp_file)
 
         # Print the new edge cases
@@ -146,6 +154,9 @@ class NewEdgeFinder:
 
                     fd.write("{} {},{},{},{}\n".format(as1, as2, aspath, str_tmp, past_sus))
 
+        # The paths are written, those of the MRT files processed are not needed anymore.
+        gp.clear_checkpoint()
+
 
 # Make the CLI.
 @click.command()
@@ -153,12 +164,20 @@ class NewEdgeFinder:
 @click.option('--nb_vps', default=10, help='Number of vantage points from which to download updates data .', type=int)
 @click.option('--max_workers', default=4, help='Maximum number of workers when downloading the updates.', type=int)
 @click.option('--db_dir', default="db", help='Directory where is database.', type=str)
+@click.option('--timeline', default=False, help='Look up the edges of the day in the appearance timeline (db_dir/timeline) instead of loading the merged topology.', type=bool)
+@click.option('--mrt_cache', default=False, help='Keep the downloaded and parsed MRT files in a local cache (db_dir/mrt_cache).', type=bool)
+@click.option('--mrt_cache_size', default=50, help='Size budget of the MRT cache, in GB.', type=float)
+@click.option('--offline', default=False, help='Only read the MRT files from the local cache, without downloading them (the jobs with MRT data missing from the cache fail).', type=bool)
 
 def compute_new_edge(\
     date, \
     nb_vps, \
     max_workers, \
-    db_dir):
+    db_dir, \
+    timeline, \
+    mrt_cache, \
+    mrt_cache_size, \
+    offline):
     """ Get the new edge links that appear in a given day.
     This script relies on the merged topology.
     If they are not in the database, it builds them first."""
@@ -166,7 +185,11 @@ def compute_new_edge(\
     nef = NewEdgeFinder( \
         db_dir=db_dir, \
         nb_vps=nb_vps, \
-        max_workers=max_workers)
+        max_workers=max_workers, \
+        use_timeline=timeline, \
+        mrt_cache=mrt_cache, \
+        mrt_cache_size=mrt_cache_size, \
+        offline=offline)
     nef.compute_new_edge(date, 300)
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+import os
+import shutil
+import pickle
+import hashlib
+
+
+####
+# Checkpoints of a collection job (the updates of a day, a RIB snapshot, the
+# paths of new edges): the result extracted from every MRT file that was fully
+# processed is saved in db_dir/tmp/checkpoints/<job>, in a file named after the
+# hash of the parameters of the file (URL, peer filter). When the job is retried,
+# or when the collection is restarted after a crash, the files already processed
+# are read from their checkpoint and only the missing ones are processed again.
+# The checkpoints of a job are removed once its output is written.
+#
+# The same module is in db/main/utils and newedge/main/utils.
+####
+
+def checkpoint_key(*params):
+    return hashlib.sha256('\n'.join(map(str, params)).encode("utf-8")).hexdigest()
+
+
+class Checkpoint:
+    def __init__(self, checkpoint_dir: str, job: str):
+        self.job_dir = "{}/{}".format(checkpoint_dir, job)
+
+        if not os.path.isdir(self.job_dir):
+            os.makedirs(self.job_dir, exist_ok=True)
+
+    def filename(self, params):
+        return "{}/{}.pkl".format(self.job_dir, checkpoint_key(*params))
+
+    # Result saved for the parameters, None if there is none (or if it is corrupted).
+    def load(self, params):
+        fn = self.filename(params)
+        if not os.path.isfile(fn):
+            return None
+
+        try:
+            with open(fn, 'rb') as fd:
+                return pickle.load(fd)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, params, result):
+        fn = self.filename(params)
+        fn_tmp = "{}.{}.tmp".format(fn, os.getpid())
+        with open(fn_tmp, 'wb') as fd:
+            pickle.dump(result, fd, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fn_tmp, fn)
+
+    def clear(self):
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+
+
+####
+# Results of the tasks, in the order of the tasks: the results found in the
+# checkpoint are used as they are, the other tasks are submitted with submit(fn,
+# params) and their results are saved as soon as they are available. All the tasks
+# are waited for, so that every completed one is saved, before the first error
+# (if any) is raised. With raise_errors False, the result of a failed task is None,
+# except for the errors of the fatal exception types, that are always raised.
+# Every task is (fn, params, checkpoint parameters).
+####
+
+def run_tasks(tasks, submit, checkpoint: Checkpoint=None, raise_errors: bool=True, fatal: tuple=()):
+    pending = []
+    for (fn, params, key) in tasks:
+        result = checkpoint.load(key) if checkpoint is not None else None
+        pending.append((submit(fn, params) if result is None else None, result, key))
+
+    results = []
+    error = None
+    fatal_error = None
+    for (future, result, key) in pending:
+        if future is not None:
+            try:
+                result = future.result()
+                if checkpoint is not None:
+                    checkpoint.save(key, result)
+            except Exception as e:
+                error = e if error is None else error
+                if isinstance(e, fatal) and fatal_error is None:
+                    fatal_error = e
+        results.append(result)
+
+    if fatal_error is not None:
+        raise fatal_error
+    if error is not None and raise_errors:
+        raise error
+
+    return results
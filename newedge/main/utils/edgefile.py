@@ -0,0 +1,125 @@
+import os
+import numpy as np
+
+
+####
+# Binary edge files. Every text edge file "<name>.txt" (one "as1 as2" link per
+# line: merged_topology, topology/*_updates.txt, *_ribs*.txt, irr) can have a
+# binary twin "<name>.edges": a 16-byte header (magic, version, number of edges)
+# followed by the edges as sorted and unique (as1, as2) int64 pairs. The binary
+# file is memory mapped when it is at least as recent as the text file, so that
+# loading a topology does not parse any line. The text file stays the reference:
+# when the binary file is missing or outdated, the text file is parsed and the
+# binary file is written for the next readers.
+#
+# The same module is in db/main/utils and newedge/main/utils.
+####
+
+MAGIC = b"EDGS"
+VERSION = 1
+header_dtype = np.dtype([("magic", "S4"), ("version", "<u4"), ("nb_edges", "<u8")])
+
+
+def binary_filename(fn):
+    return os.path.splitext(fn)[0] + ".edges"
+
+
+def is_up_to_date(fn):
+    fn_bin = binary_filename(fn)
+    if not os.path.isfile(fn_bin):
+        return False
+
+    return not os.path.isfile(fn) or os.path.getmtime(fn_bin) >= os.path.getmtime(fn)
+
+
+####
+# ASNs of an edge, None for the lines that are not a link (comments, malformed
+# lines). The IRR files may have "as" in front of the first ASN.
+####
+
+def parse_edge(as1, as2):
+    try:
+        return int(str(as1).replace('as', '')), int(as2)
+    except ValueError:
+        return None
+
+
+def parse_text(fn):
+    edges = []
+    with open(fn, 'r') as fd:
+        for line in fd:
+            if line.startswith('#'):
+                continue
+
+            linetab = line.rstrip('\n').split(' ')
+            if len(linetab) >= 2:
+                edge = parse_edge(linetab[0], linetab[1])
+                if edge is not None:
+                    edges.append(edge)
+
+    return edges
+
+
+####
+# Write the binary twin of the text file fn from an iterable of edges (or an
+# int array of edges). It is written under a temporary name and then renamed, so
+# that a reader never maps a partially written file.
+####
+
+def write_edges(fn, edges):
+    if not isinstance(edges, np.ndarray):
+        edges = [e for e in (parse_edge(as1, as2) for (as1, as2) in edges) if e is not None]
+    edges = np.unique(np.asarray(edges, dtype=np.int64).reshape(-1, 2), axis=0)
+
+    header = np.array([(MAGIC, VERSION, len(edges))], dtype=header_dtype)
+
+    fn_bin = binary_filename(fn)
+    fn_tmp = "{}.{}.tmp".format(fn_bin, os.getpid())
+    with open(fn_tmp, "wb") as fd:
+        fd.write(header.tobytes())
+        fd.write(edges.astype("<i8").tobytes())
+    os.replace(fn_tmp, fn_bin)
+
+
+def map_edges(fn_bin):
+    header = np.fromfile(fn_bin, dtype=header_dtype, count=1)
+    if len(header) != 1 or header["magic"][0] != MAGIC or header["version"][0] != VERSION:
+        return None
+
+    nb_edges = int(header["nb_edges"][0])
+    if os.path.getsize(fn_bin) != header_dtype.itemsize + nb_edges * 16:
+        return None
+    if nb_edges == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    return np.memmap(fn_bin, dtype="<i8", mode="r", offset=header_dtype.itemsize, shape=(nb_edges, 2))
+
+
+####
+# Edges of the text file fn, as a (number of edges, 2) int64 array, sorted and
+# without duplicates. The array is read-only.
+####
+
+def load_edges(fn):
+    if is_up_to_date(fn):
+        edges = map_edges(binary_filename(fn))
+        if edges is not None:
+            return edges
+
+    edges = np.unique(np.array(parse_text(fn), dtype=np.int64).reshape(-1, 2), axis=0)
+    try:
+        write_edges(fn, edges)
+    except OSError:
+        pass
+
+    edges.flags.writeable = False
+
+    return edges
+
+
+####
+# Edges of the text file fn as (as1, as2) tuples of Python ints
+####
+
+def iter_edges(fn):
+    return map(tuple, load_edges(fn).tolist())
@@ -0,0 +1,247 @@
+import os
+import fcntl
+import numpy as np
+from datetime import datetime
+from utils.edgefile import load_edges
+
+
+####
+# Appearance timeline of the directed AS edges. For every source of edges (daily
+# updates, monthly RIBs from CAIDA and from the peers, daily IRR topology), the
+# index stores the days on which every directed edge appeared, as a run-length
+# compressed bitmap: the runs of consecutive days, with their first and last day
+# as date ordinals. The runs of a source are kept in three arrays sorted by (edge,
+# first day), an edge being a single uint64 key (as1 in the high 32 bits), so
+# that the days of an edge are found with a binary search.
+#
+# The index lives in db_dir/timeline, one set of .npy files per source, memory
+# mapped by the readers. It is updated once per collected day (update): a day is
+# indexed again when its file has been modified since it was indexed.
+#
+# The same module is in db/main/utils and newedge/main/utils.
+####
+
+sources = {
+    "updates": "topology/{}_updates.txt",
+    "ribs": "topology/{}_ribs.txt",
+    "ribs2": "topology/{}_ribs2.txt",
+    "irr": "irr/{}.txt"
+}
+
+arrays = ["keys", "starts", "ends", "days", "mtimes"]
+
+
+def edge_key(as1, as2):
+    return (int(as1) << 32) | int(as2)
+
+
+def edge_keys(edges):
+    edges = np.asarray(edges, dtype=np.uint64).reshape(-1, 2)
+    return (edges[:, 0] << np.uint64(32)) | edges[:, 1]
+
+
+def key_edges(keys):
+    return np.column_stack((keys >> np.uint64(32), keys & np.uint64(0xffffffff))).astype(np.int64)
+
+
+def ordinal(date):
+    return date.toordinal() if isinstance(date, datetime) else int(date)
+
+
+####
+# Merge the adjacent runs of the same edge. The runs must not overlap.
+####
+
+def merge_runs(keys, starts, ends):
+    order = np.lexsort((starts, keys))
+    keys, starts, ends = keys[order], starts[order], ends[order]
+    if not len(keys):
+        return keys, starts, ends
+
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] != keys[:-1]) | (starts[1:] > ends[:-1] + 1)
+    idx = np.flatnonzero(first)
+
+    return keys[idx], starts[idx], np.maximum.reduceat(ends, idx)
+
+
+class Timeline:
+    def __init__(self, db_dir: str):
+        self.db_dir = db_dir
+        self.index_dir = db_dir+'/timeline'
+        self.runs = dict()  # Source to (keys, starts, ends), loaded on first use
+        self.days = dict()  # Source to the indexed days (ordinal to mtime of the file)
+
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir, exist_ok=True)
+
+    def filename(self, source, date):
+        return self.db_dir+'/'+sources[source].format(datetime.fromordinal(ordinal(date)).strftime("%Y-%m-%d"))
+
+    def files(self, source):
+        return ["{}/{}_{}.npy".format(self.index_dir, source, name) for name in arrays]
+
+    def load(self, source):
+        files = self.files(source)
+        if all(os.path.isfile(fn) for fn in files):
+            keys, starts, ends, days, mtimes = [np.load(fn, mmap_mode="r") for fn in files]
+            self.days[source] = dict(zip(days.tolist(), mtimes.tolist()))
+        else:
+            keys = np.zeros(0, dtype=np.uint64)
+            starts, ends = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+            self.days[source] = dict()
+
+        self.runs[source] = (keys, starts, ends)
+
+    def get(self, source):
+        if source not in self.runs:
+            self.load(source)
+
+        return self.runs[source]
+
+    def save(self, source):
+        keys, starts, ends = self.runs[source]
+        days = np.array(sorted(self.days[source]), dtype=np.int32)
+        mtimes = np.array([self.days[source][d] for d in days.tolist()], dtype=float)
+
+        for (fn, arr) in zip(self.files(source), [keys, starts, ends, days, mtimes]):
+            fn_tmp = "{}.{}.tmp".format(fn, os.getpid())
+            with open(fn_tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(fn_tmp, fn)
+
+    ####
+    # Set the edges that appeared on a day: the day is first removed from all the
+    # runs (in case it was already indexed), then added to the runs of the edges.
+    ####
+
+    def set_day(self, source, date, edges):
+        day = ordinal(date)
+        keys, starts, ends = [np.array(a) for a in self.get(source)]
+
+        if day in self.days[source]:
+            inside = (starts <= day) & (ends >= day)
+            left = inside & (starts < day)
+            right = inside & (ends > day)
+
+            keys = np.concatenate((keys[~inside], keys[left], keys[right]))
+            starts = np.concatenate((starts[~inside], starts[left], np.full(np.count_nonzero(right), day + 1, dtype=np.int32)))
+            ends = np.concatenate((ends[~inside], np.full(np.count_nonzero(left), day - 1, dtype=np.int32), ends[right]))
+
+        new_keys = np.unique(edge_keys(edges))
+        keys = np.concatenate((keys, new_keys))
+        starts = np.concatenate((starts, np.full(len(new_keys), day, dtype=np.int32)))
+        ends = np.concatenate((ends, np.full(len(new_keys), day, dtype=np.int32)))
+
+        self.runs[source] = merge_runs(keys, starts, ends)
+
+    ####
+    # Index the files of the days in [first_day, last_day] that are not indexed yet,
+    # or that were modified since. Concurrent updates of a source are serialised
+    # with a lock file. Returns the number of indexed days.
+    ####
+
+    def update(self, first_day, last_day=None, sources_list=None):
+        first_day = ordinal(first_day)
+        last_day = first_day if last_day is None else ordinal(last_day)
+        nb_days = 0
+
+        for source in (sources_list or list(sources.keys())):
+            if source not in self.days:
+                self.load(source)
+
+            todo = []
+            for day in range(first_day, last_day + 1):
+                fn = self.filename(source, day)
+                if os.path.isfile(fn) and self.days[source].get(day) != os.path.getmtime(fn):
+                    todo.append(day)
+
+            if not len(todo):
+                continue
+
+            with open("{}/{}.lock".format(self.index_dir, source), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+                # The index may have been updated by another process meanwhile
+                self.load(source)
+                for day in todo:
+                    fn = self.filename(source, day)
+                    mtime = os.path.getmtime(fn)
+                    if self.days[source].get(day) != mtime:
+                        self.set_day(source, day, load_edges(fn))
+                        self.days[source][day] = mtime
+                        nb_days += 1
+                self.save(source)
+
+        return nb_days
+
+    def indexed_days(self, source):
+        if source not in self.days:
+            self.load(source)
+
+        return set(self.days[source].keys())
+
+    def edge_runs(self, source, as1, as2):
+        keys, starts, ends = self.get(source)
+        key = np.uint64(edge_key(as1, as2))
+        lo = int(np.searchsorted(keys, key, side="left"))
+        hi = int(np.searchsorted(keys, key, side="right"))
+
+        return starts[lo:hi], ends[lo:hi]
+
+    ####
+    # Days (ordinals) in [first_day, last_day] on which the edge as1 -> as2
+    # appeared in any of the sources
+    ####
+
+    def days_seen(self, as1, as2, sources_list, first_day, last_day):
+        first_day, last_day = ordinal(first_day), ordinal(last_day)
+        days = set()
+
+        for source in sources_list:
+            starts, ends = self.edge_runs(source, as1, as2)
+            for (start, end) in zip(starts.tolist(), ends.tolist()):
+                days.update(range(max(start, first_day), min(end, last_day) + 1))
+
+        return days
+
+    def seen(self, as1, as2, sources_list, first_day, last_day):
+        first_day, last_day = ordinal(first_day), ordinal(last_day)
+
+        for source in sources_list:
+            starts, ends = self.edge_runs(source, as1, as2)
+            if np.any((starts <= last_day) & (ends >= first_day)):
+                return True
+
+        return False
+
+    ####
+    # For every directed edge of the (number of edges, 2) array, whether it was
+    # seen in [first_day, last_day] in any of the sources
+    ####
+
+    def seen_edges(self, edges, sources_list, first_day, last_day):
+        first_day, last_day = ordinal(first_day), ordinal(last_day)
+        keys = edge_keys(edges)
+        seen = np.zeros(len(keys), dtype=bool)
+
+        for source in sources_list:
+            source_keys, starts, ends = self.get(source)
+            seen |= np.isin(keys, source_keys[(starts <= last_day) & (ends >= first_day)])
+
+        return seen
+
+    ####
+    # Directed edges seen in [first_day, last_day] in any of the sources, as a
+    # (number of edges, 2) int64 array
+    ####
+
+    def edges_seen(self, sources_list, first_day, last_day):
+        first_day, last_day = ordinal(first_day), ordinal(last_day)
+        keys = [np.zeros(0, dtype=np.uint64)]
+
+        for source in sources_list:
+            source_keys, starts, ends = self.get(source)
+            keys.append(source_keys[(starts <= last_day) & (ends >= first_day)])
+
+        return key_edges(np.unique(np.concatenate(keys)))
@@ -0,0 +1,229 @@
+import os
+import fcntl
+import numpy as np
+from datetime import datetime
+
+
+####
+# Index of the verdicts written in the daily cases files (db_dir/cases/<date>):
+# every "!sus as1 as2 ..." or "!leg as1 as2 ..." line is one verdict on the edge
+# as1-as2 (as1 being the lowest ASN) for the day of the file. The verdicts are kept
+# in three arrays sorted by (edge, day), an edge being a single uint64 key (as1 in
+# the high 32 bits), so that the first-seen day and the last verdict of an edge are
+# found with a binary search, and the suspicious edges of a period are selected
+# without reading the cases files again.
+#
+# The index lives in db_dir/cases_index, memory mapped by the readers. The parser
+# records the verdicts of a day when it writes its cases file (record), and the
+# readers index the cases files written without the parser or modified since they
+# were indexed (update).
+#
+# The same module is in newedge/main/utils.
+####
+
+arrays = ["keys", "days", "sus", "indexed", "mtimes"]
+
+
+def edge_key(as1, as2):
+    return (int(as1) << 32) | int(as2)
+
+
+def ordinal(date):
+    return date.toordinal() if isinstance(date, datetime) else int(date)
+
+
+####
+# Verdicts of a cases file, as (as1, as2, is suspicious) tuples
+####
+
+def parse_cases(fn):
+    verdicts = []
+    with open(fn, 'r') as fd:
+        for line in fd:
+            if line.startswith('!sus') or line.startswith('!leg'):
+                linetab = line.rstrip().split(' ')
+                verdicts.append((int(linetab[1]), int(linetab[2]), line.startswith('!sus')))
+
+    return verdicts
+
+
+class VerdictIndex:
+    def __init__(self, db_dir: str):
+        self.db_dir = db_dir
+        self.index_dir = db_dir+'/cases_index'
+        self.verdicts = None  # (keys, days, sus), loaded on first use
+        self.days = None  # Indexed days (ordinal to mtime of the cases file)
+
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir, exist_ok=True)
+
+    def filename(self, date):
+        return self.db_dir+'/cases/'+datetime.fromordinal(ordinal(date)).strftime("%Y-%m-%d")
+
+    def files(self):
+        return ["{}/{}.npy".format(self.index_dir, name) for name in arrays]
+
+    def load(self):
+        files = self.files()
+        if all(os.path.isfile(fn) for fn in files):
+            keys, days, sus, indexed, mtimes = [np.load(fn, mmap_mode="r") for fn in files]
+            self.days = dict(zip(indexed.tolist(), mtimes.tolist()))
+        else:
+            keys = np.zeros(0, dtype=np.uint64)
+            days, sus = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=bool)
+            self.days = dict()
+
+        self.verdicts = (keys, days, sus)
+
+    def get(self):
+        if self.verdicts is None:
+            self.load()
+
+        return self.verdicts
+
+    def save(self):
+        keys, days, sus = self.verdicts
+        indexed = np.array(sorted(self.days), dtype=np.int32)
+        mtimes = np.array([self.days[d] for d in indexed.tolist()], dtype=float)
+
+        for (fn, arr) in zip(self.files(), [keys, days, sus, indexed, mtimes]):
+            fn_tmp = "{}.{}.tmp".format(fn, os.getpid())
+            with open(fn_tmp, "wb") as f:
+                np.save(f, arr)
+            os.replace(fn_tmp, fn)
+
+    ####
+    # Replace the verdicts of a day. With several verdicts on the same edge, the
+    # last one is kept, as when the cases file is read line by line.
+    ####
+
+    def set_day(self, date, verdicts):
+        day = ordinal(date)
+        keys, days, sus = self.get()
+        keep = days != day
+
+        new = dict()
+        for (as1, as2, is_sus) in verdicts:
+            as1, as2 = min(int(as1), int(as2)), max(int(as1), int(as2))
+            new[edge_key(as1, as2)] = bool(is_sus)
+
+        keys = np.concatenate((keys[keep], np.fromiter(new.keys(), dtype=np.uint64, count=len(new))))
+        days = np.concatenate((days[keep], np.full(len(new), day, dtype=np.int32)))
+        sus = np.concatenate((sus[keep], np.fromiter(new.values(), dtype=bool, count=len(new))))
+
+        order = np.lexsort((days, keys))
+        self.verdicts = (keys[order], days[order], sus[order])
+
+    ####
+    # Record the verdicts of the cases file of a day, just written by the parser.
+    ####
+
+    def record(self, date, verdicts):
+        fn = self.filename(date)
+        with open(self.index_dir+'/index.lock', "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            self.load()
+            self.set_day(date, verdicts)
+            self.days[ordinal(date)] = os.path.getmtime(fn) if os.path.isfile(fn) else 0.
+            self.save()
+
+    ####
+    # Index the cases files of the days in [first_day, last_day] that are not
+    # indexed yet, or that were modified since. Returns the number of indexed days.
+    ####
+
+    def update(self, first_day, last_day):
+        first_day, last_day = ordinal(first_day), ordinal(last_day)
+        if self.days is None:
+            self.load()
+
+        todo = []
+        for day in range(first_day, last_day + 1):
+            fn = self.filename(day)
+            if os.path.isfile(fn) and self.days.get(day) != os.path.getmtime(fn):
+                todo.append(day)
+
+        if not len(todo):
+            return 0
+
+        nb_days = 0
+        with open(self.index_dir+'/index.lock', "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            # The index may have been updated by another process meanwhile
+            self.load()
+            for day in todo:
+                fn = self.filename(day)
+                mtime = os.path.getmtime(fn)
+                if self.days.get(day) != mtime:
+                    self.set_day(day, parse_cases(fn))
+                    self.days[day] = mtime
+                    nb_days += 1
+            self.save()
+
+        return nb_days
+
+    ####
+    # Days (ordinals) and verdicts (True if suspicious) of the edge as1-as2
+    ####
+
+    def history(self, as1, as2):
+        keys, days, sus = self.get()
+        key = np.uint64(edge_key(min(int(as1), int(as2)), max(int(as1), int(as2))))
+        lo = int(np.searchsorted(keys, key, side="left"))
+        hi = int(np.searchsorted(keys, key, side="right"))
+
+        return days[lo:hi], sus[lo:hi]
+
+    def first_seen(self, as1, as2):
+        days, _ = self.history(as1, as2)
+        return int(days[0]) if len(days) else None
+
+    def last_verdict(self, as1, as2):
+        days, sus = self.history(as1, as2)
+        return (int(days[-1]), bool(sus[-1])) if len(days) else None
+
+    def window(self, first_day, last_day):
+        first_day, last_day = ordinal(first_day), ordinal(last_day)
+        keys, days, sus = self.get()
+        inside = (days >= first_day) & (days <= last_day)
+
+        return keys[inside], days[inside], sus[inside]
+
+    ####
+    # Edges (as1, as2) with at least one suspicious verdict in [first_day, last_day]
+    ####
+
+    def flagged(self, first_day, last_day):
+        keys, _, sus = self.window(first_day, last_day)
+        keys = np.unique(keys[sus])
+
+        return list(zip((keys >> np.uint64(32)).tolist(), (keys & np.uint64(0xffffffff)).tolist()))
+
+    ####
+    # Edges still suspicious at the end of [first_day, last_day]: the edges with a
+    # suspicious verdict after their last legitimate verdict of the period. Returns
+    # a dict from the edge (as1, as2) to the day (datetime) of the first of these
+    # suspicious verdicts.
+    ####
+
+    def suspicious(self, first_day, last_day):
+        keys, days, sus = self.window(first_day, last_day)
+        if not len(keys):
+            return dict()
+
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        starts = np.flatnonzero(first)
+        group = np.cumsum(first) - 1
+
+        # Last legitimate day of every edge (-1 if none), then the suspicious verdicts after it
+        last_leg = np.maximum.reduceat(np.where(sus, -1, days), starts)
+        after = sus & (days > last_leg[group])
+
+        keys, idx = np.unique(keys[after], return_index=True)
+        days = days[after][idx]
+
+        return {(as1, as2): datetime.fromordinal(day) for (as1, as2, day) in \
+            zip((keys >> np.uint64(32)).tolist(), (keys & np.uint64(0xffffffff)).tolist(), days.tolist())}
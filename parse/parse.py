@@ -1,6 +1,7 @@
 from os import listdir
 from os.path import isfile, join
 from datetime import datetime
+from utils.verdicts import VerdictIndex
 
 class Parser:
     def __init__(self, db_dir: str, date: str):
@@ -65,6 +66,7 @@ class Parser:
 
         dic_res = {}
         dic_tags = {}
+        verdicts = []
         fd_out = open(outfile, 'w', 1)
 
         with open(infile, 'r') as fd:
@@ -179,6 +181,7 @@ class Parser:
                     stmp += str(e)+','
                 s += tags+':'+stmp[:-1]+';'
 
+            verdicts.append((as1, as2, sus > 0))
             if sus == 0:
                 fd_out.write('!leg {} {} {} {} {} {}\n'.format(as1, as2, leg, sus, asp_count, s[:-1]))
             else:
@@ -197,6 +200,9 @@ class Parser:
                 
         fd_out.close()
 
+        # Record the verdicts of the day in the index of the suspicious edges.
+        VerdictIndex(self.db_dir).record(datetime.strptime(self.date, "%Y-%m-%d"), verdicts)
+
 # def parse_dir(indir, outdir):
 #     onlyfiles = [f for f in listdir(indir) if isfile(join(indir, f))]
 
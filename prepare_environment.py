@@ -73,17 +73,16 @@ def download_files(days_d: list, db_dir: str, n_threads: int, max_work: int):
     local_folder = os.getcwd()
     os.chdir('./db/main/')
     print("*******************Downloading necessary files from collectors**************")
-    args = []
-    for d in days_d:
-        cmd = "python3 collector.py "
-        cmd += " --date '" + d + "T00:00:00'"
-        cmd += " --nb_vps 200 "
-        cmd += " --db_dir " + db_dir
-        cmd += " --max_workers " + n_threads
-        cmd += " --max_workers_rib " + n_threads
-        args.append([cmd])
-    with Pool(processes=2) as th_pool:
-        th_pool.starmap(os.system, args, )
+    cmd = "python3 collector.py "
+    cmd += " --date '" + days_d[0] + "T00:00:00'"
+    cmd += " --date_end '" + date_plus(days_d[-1]) + "T00:00:00'"
+    cmd += " --nb_vps 200 "
+    cmd += " --db_dir " + db_dir
+    cmd += " --max_workers " + n_threads
+    cmd += " --max_workers_rib " + n_threads
+    cmd += " --mrt_cache True"
+    cmd += " --concurrency 'updates=2,irr=2,peeringdb=2'"
+    os.system(cmd)
 
     print("*********************Downloading necessary files (Topology)*************************")
     args = []
@@ -104,6 +103,7 @@ def download_files(days_d: list, db_dir: str, n_threads: int, max_work: int):
     cmd += " --db_dir " + db_dir
     cmd += " --max_workers " + max_work
     cmd += " --date_end '" + date_plus(days_d[-1]) + "T00:00:00'"
+    cmd += " --incremental True"
     args.append([cmd])
     os.chdir('./newedge/main/')
     os.system(cmd)
@@ -131,6 +131,8 @@ def create_new_edges(days_d: list, db_dir: str, n_threads: int, max_work: int):
         cmd += " --db_dir " + db_dir
         cmd += " --max_workers " + max_work
         cmd += " --nb_vps 200 "
+        cmd += " --timeline True"
+        cmd += " --mrt_cache True"
         args.append([cmd])
     os.chdir('./newedge/main/')
     with Pool(processes=int(n_threads)) as th_pool:
@@ -4,6 +4,7 @@ import pandas as pd
 from colorama import Fore, Style
 from itertools import groupby
 import networkx as nx
+import topo.shared as shared
 import sys
 from datetime import datetime
 from time import mktime
@@ -174,11 +175,7 @@ def parse_topo_file_line(line :str):
     return as1, as2
 
 def load_topo_file(fn):
-    G = nx.Graph()
-    with open(fn, "r") as f:
-        for line in f:
-            as1, as2 = parse_topo_file_line(line)
-            G.add_edge(as1, as2)
+    G = shared.mutable_graph(fn)
 
     return G
 
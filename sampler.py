@@ -23,6 +23,7 @@ class Sampling:
         self.date = date
         self.topo = nx.Graph()
         self.topo_irr = nx.Graph()
+        self.bridges = None
         self.db_dir = db_dir
         self.overide = overide
         self.method = method
@@ -87,6 +88,9 @@ class Sampling:
             ut.err_msg("For day {}, topology is empty, abort...".format(self.date))
             exit(1)
 
+        # Bridges of the topology, never part of the negative samplings.
+        self.bridges = sampling.bridge_set(self.topo)
+
     
     def build_negative_sampling(self, size):
         fn_aspaths = "{}/paths/{}-{}-01_paths.txt".format(self.db_dir, self.date.split("-")[0], self.date.split("-")[1])
@@ -100,7 +104,7 @@ class Sampling:
             print_prefix("Building Negative sampling of size {}...".format(size))
 
             start_ts = time()
-            sampling.negative_sampling_forced(self.topo, self.topo_irr, size, self.date, self.db_dir, k=self.k_neg, outfile=fn_sampling, aspath_file=fn_aspaths)
+            sampling.negative_sampling_forced(self.topo, self.topo_irr, size, self.date, self.db_dir, k=self.k_neg, outfile=fn_sampling, aspath_file=fn_aspaths, bridges=self.bridges)
             stop_ts = time()
 
             print_prefix("Negative sampling for {} has been succefully built in {:.4f} s".format(self.date, stop_ts - start_ts))
@@ -154,7 +158,7 @@ class Sampling:
             print_prefix("Building Negative aspath sampling of size {}...".format(size))
 
             start_ts = time()
-            sampling.negative_sampling_forced(self.topo, self.topo_irr, size, self.date, self.db_dir, k=self.k_neg, outfile=fn_sampling, aspath_file=fn_aspaths)
+            sampling.negative_sampling_forced(self.topo, self.topo_irr, size, self.date, self.db_dir, k=self.k_neg, outfile=fn_sampling, aspath_file=fn_aspaths, bridges=self.bridges)
             stop_ts = time()
 
             print_prefix("Negative aspath sampling for {} has been succefully built in {:.4f} s".format(self.date, stop_ts - start_ts))
@@ -2,6 +2,7 @@ import networkx as nx
 import random 
 import math
 import utils.sampler as ut
+from utils.pathindex import PathIndex
 from time import time
 from colorama import Fore, Style
 import sys
@@ -24,27 +25,9 @@ def load_existing_as_paths_positive_sampling(infile):
     if infile is None:
         ut.err_msg("Unable to load the aspath, no aspath file specified")
         exit(1)
-    
-    all_paths = dict()
-    with open(infile, "r") as f:
-        for line in f:
-            asp = line.replace("\n", "")
-
-            # Get the origin of the AS path
-            path = ut.aspath_to_list(asp)
-            if len(path) < 3:
-                continue
-            orig = path[-1][0]
-
-
-            if orig not in all_paths:
-                all_paths[orig] = []
-            
-            # Append this path to the list of path having the
-            # same origin
-            all_paths[orig].append(asp)
 
-    return all_paths
+    # Paths having the same origin, from the index of the paths file.
+    return PathIndex(infile)
 
 
 ##
@@ -57,34 +40,8 @@ def load_existing_as_paths_negative_sampling(infile):
         ut.err_msg("Unable to load the aspath, no aspath file specified")
         exit(1)
 
-    all_paths = dict()
-
-    with open(infile, "r") as f:
-        for line in f:
-
-            asp = line.replace("\n", "")
-            path = ut.aspath_to_list(asp)
-            if len (path) > 3:
-
-                # For all the links in the AS path:
-                for i in range(0, len(path)-1):
-                    for as1 in path[i]:
-                        for as2 in path[i+1]:
-                            tmp_as1 = as1
-                            tmp_as2 = as2
-
-                            if tmp_as1 > tmp_as2:
-                                tmp_as2, tmp_as1 = tmp_as1, tmp_as2
-
-                            if tmp_as2 not in all_paths:
-                                all_paths[tmp_as2] = dict()
-
-                            if tmp_as1 not in all_paths[tmp_as2]:
-                                all_paths[tmp_as2][tmp_as1] = []
-
-                            all_paths[tmp_as2][tmp_as1].append(asp)
-
-    return all_paths
+    # Paths containing every link, from the index of the paths file.
+    return PathIndex(infile)
 
 
 
@@ -126,12 +83,30 @@ def load_possible_as_paths_negative_sampling(infile):
     return all_paths
 
 
+##
+# Bridges of the topology, in both directions: removing a bridge disconnects
+# its two ASes, so it can not be part of the negative sampling. They are found
+# once per topology (linear time), instead of running a BFS for every candidate.
+##
+
+def bridge_set(topo):
+    start_ts = time()
+    bridges = set()
+    for as1, as2 in nx.bridges(topo):
+        bridges.add((as1, as2))
+        bridges.add((as2, as1))
+    stop_ts = time()
+    print_prefix("{} bridges found in {:.2f} s".format(len(bridges)//2, stop_ts - start_ts))
+
+    return bridges
+
+
 ##
 # This Function is used to build a negative sampling, that is the
 # set of existing link that must NOT raise any alarm.
 ##
 
-def negative_sampling(topo, nb_link, outfile=None, aspath_file=None):
+def negative_sampling(topo, nb_link, outfile=None, aspath_file=None, bridges=None):
     
     selected_links = set()
     sel = set()
@@ -140,25 +115,24 @@ def negative_sampling(topo, nb_link, outfile=None, aspath_file=None):
     stop_ts = time()
     print_prefix("All aspaths loaded in {:.2f} s".format(stop_ts - start_ts))
     
+    if bridges is None:
+        bridges = bridge_set(topo)
+    all_edges = list(topo.edges())
 
     while len(selected_links) < nb_link:
-        as1, as2 = random.sample(topo.edges(), 1)[0]
+        as1, as2 = random.choice(all_edges)
         if as1 > as2:
             # Switch the two variables to follow same convention in the code.
             as1, as2 = as2, as1
 
         # Check if the removing of the link between as1 and as2 keeps the graph connexe.
-        if as2 not in all_paths:
-            print("{} is not in any AS-path".format(as2))
-        elif as1 not in all_paths[as2]:
+        in_paths = all_paths.has_link(as1, as2)
+        if not in_paths:
             print("Link {} {} is not in any path...".format(as1, as2))
         
-        if (as1, as2) not in sel and as2 in all_paths and as1 in all_paths[as2]:
-            topo.remove_edge(as1,as2)
-            res = nx.has_path(topo, as1, as2)
-            topo.add_edge(as1,as2)
-            if res:
-                asp = random.choice(all_paths[as2][as1])
+        if (as1, as2) not in sel and in_paths:
+            if (as1, as2) not in bridges:
+                asp = all_paths.choice_link(as1, as2)
                 selected_links.add((as1, as2, asp))
                 sel.add((as1, as2))
 
@@ -205,13 +179,13 @@ def positive_sampling_random(topo :nx.Graph, topo_irr :nx.Graph, nb_link, outfil
         if as1 == as2 or topo.has_edge(as1, as2) or topo_irr.has_edge(as1, as2) or (as1, as2) in sel:
             continue
 
-        if as1 in all_paths:
-            asp = random.choice(all_paths[as1])
+        if all_paths.has_origin(as1):
+            asp = all_paths.choice_origin(as1)
             edges_selected.add((as1, as2, asp))
             sel.add((as1, as2))
 
-        elif as2 in all_paths:
-            asp = random.choice(all_paths[as2])
+        elif all_paths.has_origin(as2):
+            asp = all_paths.choice_origin(as2)
             edges_selected.add((as2, as1, asp))
             sel.add((as1, as2))
 
@@ -332,13 +306,13 @@ def positive_sampling_thresholds(topo, topo_irr, nb_link, k=3./4., outfile=None,
                 node2 = tmpnode1
 
             if node1 != node2 and (node1, node2) not in sel and not topo.has_edge(node1, node2) and not topo_irr.has_edge(node1, node2):
-                if node1 in all_paths:
-                    asp = random.choice(all_paths[node1])
+                if all_paths.has_origin(node1):
+                    asp = all_paths.choice_origin(node1)
                     edges_selected.add((node1, node2, asp))
                     sel.add((node1, node2))
                     good = True
-                elif node2 in all_paths:
-                    asp = random.choice(all_paths[node2])
+                elif all_paths.has_origin(node2):
+                    asp = all_paths.choice_origin(node2)
                     edges_selected.add((node2, node1, asp))
                     sel.add((node1, node2))
                     good = True
@@ -459,12 +433,12 @@ def positive_sampling_clusters(topo :nx.Graph, topo_irr, nb_link, date, db_dir,
 
             if node1 != node2 and (node1, node2) not in edges_selected and not topo.has_edge(node1, node2) and not topo_irr.has_edge(node1, node2):  
                 if aspath_file is not None:
-                    if node1 in all_paths:
-                        asp = random.choice(all_paths[node1])
+                    if all_paths.has_origin(node1):
+                        asp = all_paths.choice_origin(node1)
                         edges_selected.add((node1, node2, asp))
                         good = True
-                    elif node2 in all_paths:
-                        asp = random.choice(all_paths[node2])
+                    elif all_paths.has_origin(node2):
+                        asp = all_paths.choice_origin(node2)
                         edges_selected.add((node2, node1, asp))
                         good = True
                 else:
@@ -498,9 +472,12 @@ def positive_sampling_clusters(topo :nx.Graph, topo_irr, nb_link, date, db_dir,
 
 
 
-def negative_sampling_forced(topo :nx.Graph, topo_irr: nx.Graph, nb_link, date, db_dir, k=1., outfile=None, aspath_file=None):    
+def negative_sampling_forced(topo :nx.Graph, topo_irr: nx.Graph, nb_link, date, db_dir, k=1., outfile=None, aspath_file=None, bridges=None):    
     labels, max_lab = load_labels(date, db_dir, topo, topo_irr)
 
+    if bridges is None:
+        bridges = bridge_set(topo)
+
     table_set = [set() for _ in range(0, max_lab * max_lab)]
     table_proba = [0 for _ in range(0, max_lab * max_lab)]
     table_index = [i for i in range(0, max_lab * max_lab)]
@@ -530,7 +507,10 @@ def negative_sampling_forced(topo :nx.Graph, topo_irr: nx.Graph, nb_link, date,
         index2 = labels[as2]
 
         table_proba[index1+index2] += 1
-        table_set[index1+index2].add((as1, as2))
+
+        # The bridges count in the weight of the category, but are never selected.
+        if (as1, as2) not in bridges:
+            table_set[index1+index2].add((as1, as2))
 
         number_of_edges += 1
 
@@ -556,13 +536,6 @@ def negative_sampling_forced(topo :nx.Graph, topo_irr: nx.Graph, nb_link, date,
 
             tmpnode1, tmpnode2 = random.choices(table_list[index_selected], k=1)[0]
 
-            topo.remove_edge(tmpnode1, tmpnode2)
-            res = nx.has_path(topo, tmpnode1, tmpnode2)
-            topo.add_edge(tmpnode1, tmpnode2)
-
-            if not res:
-                continue
-
             if tmpnode1 <= tmpnode2:
                 node1 = tmpnode1
                 node2 = tmpnode2
@@ -572,8 +545,8 @@ def negative_sampling_forced(topo :nx.Graph, topo_irr: nx.Graph, nb_link, date,
 
             if node1 != node2 and (node1, node2) not in sel_links:  
                 if aspath_file is not None:
-                    if node2 in all_paths and node1 in all_paths[node2]:
-                        asp = random.choice(all_paths[node2][node1])
+                    if all_paths.has_link(node1, node2):
+                        asp = all_paths.choice_link(node1, node2)
                         edges_selected.add((node1, node2, asp))
                         sel_links.add((node1, node2))
                         good = True
@@ -0,0 +1,56 @@
+import random
+
+import networkx as nx
+import pytest
+
+from topo_feat import TopoFeatComputer
+
+DATE = "2022-04-30"
+
+# The reference PageRank and eigenvector centrality stop after 20 iterations of
+# networkx, and most often fail to converge (their value is then None), while the
+# incremental mode estimates them: they are not compared.
+FEAT_EXCLUDE = ["pagerank", "eigenvector_centrality"]
+
+
+####
+# Small random topology, written in db_dir/merged_topology/<date>.txt
+####
+
+@pytest.fixture
+def db_dir(tmp_path):
+    G = nx.gnm_random_graph(40, 90, seed=7)
+    (tmp_path / "merged_topology").mkdir()
+    (tmp_path / "features" / "positive").mkdir(parents=True)
+    (tmp_path / "features" / "negative").mkdir(parents=True)
+    with open(tmp_path / "merged_topology" / "{}.txt".format(DATE), "w") as fd:
+        for as1, as2 in G.edges():
+            fd.write("{} {}\n".format(as1 + 1, as2 + 1))
+
+    return str(tmp_path)
+
+
+def links(G):
+    rng = random.Random(1)
+    nodes = sorted(G.nodes, key=int)
+
+    existing = rng.sample(sorted(G.edges), 6)
+    missing = [(as1, as2) for as1 in nodes for as2 in nodes if as1 < as2 and not G.has_edge(as1, as2)]
+    unknown = [(nodes[0], "64512"), ("64513", nodes[1]), ("64514", "64515")]
+
+    return existing + rng.sample(missing, 6) + unknown
+
+
+####
+# The toggle evaluation and the incremental features give the same feature values
+# as the reference modes (copy of the graph, features computed twice), for links
+# in the graph, links not in the graph, and links to unknown ASes.
+####
+
+@pytest.mark.parametrize("eval_mode", ["toggle", "copy"])
+@pytest.mark.parametrize("feat_mode", ["incremental", "reference"])
+def test_modes_match_reference(db_dir, eval_mode, feat_mode):
+    tfc = TopoFeatComputer(DATE, db_dir, FEAT_EXCLUDE, 1, False, False, "clusters", eval_mode, feat_mode, node_cache_mb=0)
+    tfc.load_data()
+
+    assert tfc.check_modes(links(tfc.G)) == []
@@ -0,0 +1,346 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+import utils.edgefile as edgefile
+
+
+####
+# Array-backed topology: the ASes are mapped to integer node ids (in the order of
+# their ASN) and the adjacency is stored as the CSR arrays indptr and indices, with
+# sorted neighbors. It takes a few bytes per edge, against hundreds for the
+# dict-of-dicts adjacency of networkx, and it can be memory mapped by all the
+# workers (see topo/shared.py).
+####
+
+class CSRTopology:
+    def __init__(self, asns, indptr, indices):
+        self.asns = asns                                # ASN of each node id (sorted)
+        self.indptr = indptr                            # Neighbors of i: indices[indptr[i]:indptr[i+1]]
+        self.indices = indices
+        self.nb_nodes = len(asns)
+
+        # Self loops are counted twice in the degree, like networkx does
+        rows = np.repeat(np.arange(self.nb_nodes), np.diff(indptr))
+        self.loops = np.zeros(self.nb_nodes, dtype=bool)
+        self.loops[rows[rows == indices]] = True
+        self.degrees = np.diff(indptr) + self.loops
+
+        self.nb_edges = int((len(indices) + np.count_nonzero(self.loops)) // 2)
+        self.adj = None  # Sparse adjacency matrix, built on first use
+
+    ####
+    # Adjacency matrix as a scipy sparse array, with the entries of networkx's
+    # to_scipy_sparse_array (a self loop is a single 1 on the diagonal)
+    ####
+
+    def adjacency(self):
+        if self.adj is None:
+            data = np.ones(len(self.indices), dtype=float)
+            self.adj = sp.csr_array((data, self.indices, self.indptr), shape=(self.nb_nodes, self.nb_nodes))
+
+        return self.adj
+
+    @classmethod
+    def from_edges(cls, edges):
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        asns, ids = np.unique(edges.ravel(), return_inverse=True)
+        ids = ids.reshape(-1, 2)
+
+        # Both directions of every edge, duplicates are merged by tocsr()
+        rows = np.concatenate((ids[:, 0], ids[:, 1]))
+        cols = np.concatenate((ids[:, 1], ids[:, 0]))
+        adj = sp.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(len(asns), len(asns))).tocsr()
+        adj.sum_duplicates()
+        adj.sort_indices()
+
+        return cls(asns, adj.indptr.astype(np.int64), adj.indices.astype(np.int32))
+
+    ####
+    # Load a topology file, one "as1 as2" link per line (through its binary edge
+    # file, see utils/edgefile.py)
+    ####
+
+    @classmethod
+    def from_file(cls, fn):
+        return cls.from_edges(edgefile.load_edges(fn))
+
+    ####
+    # Store the arrays as .npy files (one per array, named after the prefix), and map
+    # them back read-only. All the processes that map the same files share the same
+    # physical pages. The files are written under a temporary name and then renamed,
+    # so that a reader never sees a partially written array.
+    ####
+
+    arrays = ["asns", "indptr", "indices"]
+
+    @classmethod
+    def files(cls, prefix):
+        return ["{}_{}.npy".format(prefix, name) for name in cls.arrays]
+
+    def save(self, prefix):
+        for (name, fn) in zip(self.arrays, self.files(prefix)):
+            fn_tmp = "{}.{}.tmp".format(fn, os.getpid())
+            with open(fn_tmp, "wb") as f:
+                np.save(f, getattr(self, name))
+            os.replace(fn_tmp, fn)
+
+    @classmethod
+    def load(cls, prefix, mmap_mode="r"):
+        return cls(*[np.load(fn, mmap_mode=mmap_mode) for fn in cls.files(prefix)])
+
+    def node_id(self, asn):
+        asn = int(asn)
+        i = int(np.searchsorted(self.asns, asn))
+        if i < self.nb_nodes and self.asns[i] == asn:
+            return i
+
+        raise KeyError(asn)
+
+    def __contains__(self, asn):
+        try:
+            self.node_id(asn)
+        except (KeyError, ValueError):
+            return False
+        return True
+
+    def __len__(self):
+        return self.nb_nodes
+
+    def neighbors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def edge_position(self, i, j):
+        pos = self.indptr[i] + int(np.searchsorted(self.neighbors(i), j))
+        if pos < self.indptr[i + 1] and self.indices[pos] == j:
+            return pos
+
+        return None
+
+    def has_edge(self, as1, as2):
+        if as1 not in self or as2 not in self:
+            return False
+
+        return self.edge_position(self.node_id(as1), self.node_id(as2)) is not None
+
+    ####
+    # Return the topology without the edge "removed" and/or with the edge "added",
+    # as an immutable view. The arrays are never modified, so the same topology is
+    # safely shared by all the links. ASes of the added edge that are not in the
+    # topology are given the next node ids.
+    ####
+
+    def view(self, removed=None, added=None):
+        return CSRView(self, removed, added)
+
+
+class CSRView:
+    def __init__(self, topo: CSRTopology, removed=None, added=None):
+        self.topo = topo
+        self.virtual = dict()  # ASN to node id, for ASes that are not in the topology
+        self.removed = None
+        self.removed_pos = []
+        self.added = None
+        self.dists = dict()  # BFS distances, memoized per source node
+        self.lengths = None  # Number of neighbors of every node id, memoized
+
+        if removed is not None:
+            u, v = topo.node_id(removed[0]), topo.node_id(removed[1])
+            self.removed = (u, v)
+            self.removed_pos = [topo.edge_position(u, v), topo.edge_position(v, u)]
+
+        if added is not None:
+            for asn in added:
+                if asn not in topo and int(asn) not in self.virtual:
+                    self.virtual[int(asn)] = topo.nb_nodes + len(self.virtual)
+            self.added = (self.node_id(added[0]), self.node_id(added[1]))
+
+        self.nb_nodes = topo.nb_nodes + len(self.virtual)
+
+    def __len__(self):
+        return self.nb_nodes
+
+    def node_id(self, asn):
+        if int(asn) in self.virtual:
+            return self.virtual[int(asn)]
+
+        return self.topo.node_id(asn)
+
+    ####
+    # Degree kernel: degree of every node id in ids
+    ####
+
+    def degree(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        deg = np.zeros(len(ids), dtype=np.int64)
+
+        real = ids < self.topo.nb_nodes
+        deg[real] = self.topo.degrees[ids[real]]
+
+        for (edge, delta) in [(self.removed, -1), (self.added, 1)]:
+            if edge is not None:
+                deg[ids == edge[0]] += delta
+                deg[ids == edge[1]] += delta
+
+        return deg
+
+    ####
+    # Neighbors of all the nodes of the frontier at once. Returns the source and the
+    # neighbor of every (directed) edge leaving the frontier.
+    ####
+
+    def frontier_neighbors(self, frontier):
+        topo = self.topo
+        real = frontier[frontier < topo.nb_nodes]
+
+        starts = topo.indptr[real]
+        lens = topo.indptr[real + 1] - starts
+        pos = np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(lens.sum())
+
+        srcs = np.repeat(real, lens)
+        nbrs = topo.indices[pos].astype(np.int64)
+
+        if self.removed is not None:
+            keep = np.ones(len(pos), dtype=bool)
+            for p in self.removed_pos:
+                keep &= pos != p
+            srcs, nbrs = srcs[keep], nbrs[keep]
+
+        if self.added is not None:
+            u, v = self.added
+            extra_srcs = [a for a in (u, v) if np.any(frontier == a)]
+            extra_nbrs = [v if a == u else u for a in extra_srcs]
+            if len(extra_srcs):
+                srcs = np.concatenate((srcs, np.array(extra_srcs, dtype=np.int64)))
+                nbrs = np.concatenate((nbrs, np.array(extra_nbrs, dtype=np.int64)))
+
+        return srcs, nbrs
+
+    def neighbors(self, i):
+        return self.frontier_neighbors(np.array([i], dtype=np.int64))[1]
+
+    ####
+    # Number of neighbors of every node id (a self loop is one neighbor), i.e. the
+    # row sums of the adjacency matrix
+    ####
+
+    def row_lengths(self):
+        if self.lengths is None:
+            lengths = np.zeros(self.nb_nodes, dtype=np.int64)
+            lengths[:self.topo.nb_nodes] = np.diff(self.topo.indptr)
+
+            for (edge, delta) in [(self.removed, -1), (self.added, 1)]:
+                if edge is not None:
+                    for n in set(edge):
+                        lengths[n] += delta
+            self.lengths = lengths
+
+        return self.lengths
+
+    ####
+    # Product of the adjacency matrix with the vector x (one value per node id)
+    ####
+
+    def matvec(self, x):
+        y = np.zeros(self.nb_nodes, dtype=float)
+        y[:self.topo.nb_nodes] = self.topo.adjacency() @ x[:self.topo.nb_nodes]
+
+        for (edge, delta) in [(self.removed, -1), (self.added, 1)]:
+            if edge is not None:
+                u, v = edge
+                if u == v:
+                    y[u] += delta * x[u]
+                else:
+                    y[u] += delta * x[v]
+                    y[v] += delta * x[u]
+
+        return y
+
+    ####
+    # One random neighbor of every node id of nodes, the neighbor of rank
+    # int(rnd * number of neighbors) in the view. Nodes without neighbors get -1.
+    ####
+
+    def random_neighbors(self, nodes, rnd):
+        topo = self.topo
+        lengths = self.row_lengths()[nodes]
+        ranks = (rnd * lengths).astype(np.int64)
+
+        res = np.full(len(nodes), -1, dtype=np.int64)
+        real = (nodes < topo.nb_nodes) & (lengths > 0)
+
+        # The removed edge is skipped in the rows of its nodes
+        pos = topo.indptr[nodes[real]] + ranks[real]
+        if self.removed is not None:
+            for (n, p) in dict(zip(self.removed, self.removed_pos)).items():
+                pos[(nodes[real] == n) & (pos >= p)] += 1
+
+        # The added edge is the last neighbor in the rows of its nodes
+        end = pos >= topo.indptr[nodes[real] + 1]
+        res[real] = topo.indices[np.where(end, 0, pos)]
+        if self.added is not None:
+            u, v = self.added
+            last = np.zeros(len(nodes), dtype=bool)
+            last[real] = end
+            last[nodes >= topo.nb_nodes] = lengths[nodes >= topo.nb_nodes] > 0
+            res[last & (nodes == u)] = v
+            res[last & (nodes == v)] = u
+
+        return res
+
+    ####
+    # Neighbor intersection kernel: common neighbors of u and v, u and v excluded
+    ####
+
+    def common_neighbors(self, u, v):
+        cn = np.intersect1d(self.neighbors(u), self.neighbors(v), assume_unique=True)
+
+        return cn[(cn != u) & (cn != v)]
+
+    ####
+    # Vectorised BFS: the whole frontier is expanded at each level. Returns the
+    # distance of every node id to the source, -1 for the unreachable ones.
+    ####
+
+    def bfs(self, source):
+        if source in self.dists:
+            return self.dists[source]
+
+        dist = np.full(self.nb_nodes, -1, dtype=np.int64)
+        dist[source] = 0
+        frontier = np.array([source], dtype=np.int64)
+        level = 0
+
+        while len(frontier):
+            level += 1
+            nbrs = self.frontier_neighbors(frontier)[1]
+            nbrs = nbrs[dist[nbrs] < 0]
+            dist[nbrs] = level
+            frontier = np.unique(nbrs)
+
+        self.dists[source] = dist
+
+        return dist
+
+    ####
+    # Number of nodes at each distance of the source
+    ####
+
+    def levels(self, source):
+        dist = self.bfs(source)
+
+        return np.bincount(dist[dist >= 0])
+
+    ####
+    # Twice the number of triangles of u (self loops ignored), and the number of
+    # neighbors of u other than itself
+    ####
+
+    def triangles_and_degree(self, u):
+        vs = self.neighbors(u)
+        vs = vs[vs != u]
+
+        in_vs = np.zeros(self.nb_nodes, dtype=bool)
+        in_vs[vs] = True
+        srcs, nbrs = self.frontier_neighbors(vs)
+
+        return int(np.count_nonzero(in_vs[nbrs] & (nbrs != srcs))), len(vs)
@@ -0,0 +1,165 @@
+import os
+import hashlib
+import numpy as np
+import topo.utils as ut
+
+
+####
+# Persistent cache of the per-node features of a topology, shared by all the runs
+# on the same merged topology (positive and negative sampling, broker). The values
+# are keyed by (hash of the topology file, ASN, feature): there is one file per
+# topology, db_dir/tmp/node_features/<sha1>.bin, made of fixed-size binary records
+# (ASN, feature id, value). New values are appended to the file, and the least
+# recently used files are evicted when the directory exceeds its size budget.
+####
+
+# Features that can be cached, the id of a feature is its index in this list
+node_feats = [
+    "pagerank",
+    "eigenvector_centrality",
+    "degree_centrality",
+    "number_of_cliques",
+    "average_neighbor_degree",
+    "triangles",
+    "clustering",
+    "square_clustering",
+    "eccentricity",
+    "harmonic_centrality",
+    "closeness_centrality"
+]
+
+# The high bit of the feature id is set for integer values, so that the values
+# are returned with the type they have been computed with
+INT_FLAG = 0x80
+
+record_dtype = np.dtype([("asn", "<u4"), ("feat", "u1"), ("value", "<f8")])
+
+# Values loaded in this process, per cache file. A cache pickled to a worker
+# (every batch of links) finds the values of its file here instead of reading
+# the file again. The values of a topology never change, so the dict stays
+# valid; it just misses the values flushed by the other workers meanwhile.
+loaded = dict()
+
+
+def file_hash(fn):
+    h = hashlib.sha1()
+    with open(fn, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+class NodeFeatureCache:
+    def __init__(self, db_dir, fn_topo, max_size_mb=256):
+        self.cache_dir = "{}/tmp/node_features".format(db_dir)
+        self.max_size = max_size_mb * 1024 * 1024
+        self.fn = "{}/{}.bin".format(self.cache_dir, file_hash(fn_topo))
+        self.values = None  # (ASN, feature id) to value, loaded on first use
+        self.pending = []  # Records not yet written to the file
+        self.nb_hits = 0
+
+        ut.create_directory("{}/tmp".format(db_dir))
+        ut.create_directory(self.cache_dir)
+        if os.path.exists(self.fn):
+            os.utime(self.fn)
+        self.evict()
+
+    ####
+    # The loaded values are not sent to the workers, they read the file once per
+    # process (see loaded)
+    ####
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["values"] = None
+        state["pending"] = []
+
+        return state
+
+    def load(self):
+        if self.fn in loaded:
+            self.values = loaded[self.fn]
+            return
+
+        self.values = loaded[self.fn] = dict()
+        if not os.path.exists(self.fn):
+            return
+
+        with open(self.fn, "rb") as f:
+            data = f.read()
+
+        # A record interrupted by a crash at the end of the file is ignored
+        records = np.frombuffer(data[:len(data) - len(data) % record_dtype.itemsize], dtype=record_dtype)
+        for (asn, feat, value) in zip(records["asn"].tolist(), records["feat"].tolist(), records["value"].tolist()):
+            self.values[(asn, feat & ~INT_FLAG)] = int(value) if feat & INT_FLAG else value
+
+    def get(self, asn, feat):
+        if self.values is None:
+            self.load()
+
+        value = self.values.get((int(asn), node_feats.index(feat)))
+        if value is not None:
+            self.nb_hits += 1
+
+        return value
+
+    def put(self, asn, feat, value):
+        if self.values is None:
+            self.load()
+
+        key = (int(asn), node_feats.index(feat))
+        if value is None or key in self.values:
+            return
+
+        self.values[key] = value
+        flag = INT_FLAG if isinstance(value, (int, np.integer)) else 0
+        self.pending.append((key[0], key[1] | flag, float(value)))
+
+    ####
+    # Append the new values to the file, in a single write so that concurrent
+    # workers do not interleave their records
+    ####
+
+    def flush(self):
+        if not len(self.pending):
+            return
+
+        size = os.path.getsize(self.fn) if os.path.exists(self.fn) else 0
+        records = np.array(self.pending, dtype=record_dtype)
+        self.pending = []
+
+        # The file of the topology alone never exceeds the budget
+        if size + records.nbytes > self.max_size:
+            return
+
+        fd = os.open(self.fn, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, records.tobytes())
+        finally:
+            os.close(fd)
+
+    ####
+    # Remove the least recently used files of the other topologies until the
+    # directory fits in its budget
+    ####
+
+    def evict(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            fn = "{}/{}".format(self.cache_dir, name)
+            if name.endswith(".bin") and fn != self.fn:
+                files.append((os.path.getmtime(fn), os.path.getsize(fn), fn))
+
+        total = sum(size for (_, size, _) in files)
+        if os.path.exists(self.fn):
+            total += os.path.getsize(self.fn)
+
+        for (_, size, fn) in sorted(files):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(fn)
+            except FileNotFoundError:
+                pass
+            total -= size
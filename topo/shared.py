@@ -0,0 +1,175 @@
+import os
+import multiprocessing
+from collections import OrderedDict
+import networkx as nx
+import topo.csr as csr
+import topo.utils as ut
+import utils.edgefile as edgefile
+
+
+####
+# Topologies shared with the worker processes. A topology is published once under a
+# handle, and the workers attach to it from that handle instead of receiving a
+# pickled copy of the whole graph with every submitted task:
+#  - "csr": the arrays are written as .npy files under db_dir/tmp/topology and memory
+#    mapped read-only, so that all the processes share the same physical pages. The
+#    files are reused as long as they are more recent than the topology file;
+#  - "fork": a networkx graph cannot be mapped, it is inherited by the forked workers
+#    (only available with the fork start method).
+####
+
+attached = dict()  # Handle to topology, in the current process
+
+
+def csr_prefix(db_dir, date):
+    return "{}/tmp/topology/{}".format(db_dir, date)
+
+
+def csr_is_up_to_date(prefix, fn_topo):
+    for fn in csr.CSRTopology.files(prefix):
+        if not os.path.exists(fn) or os.path.getmtime(fn) < os.path.getmtime(fn_topo):
+            return False
+
+    return True
+
+
+####
+# Load the topology file as a csr topology, through its memory mapped arrays
+# (written first if needed). Returns the handle and the topology.
+####
+
+def load_csr(fn_topo, db_dir, date):
+    prefix = csr_prefix(db_dir, date)
+
+    if not csr_is_up_to_date(prefix, fn_topo):
+        ut.create_directory("{}/tmp".format(db_dir))
+        ut.create_directory(os.path.dirname(prefix))
+        csr.CSRTopology.from_file(fn_topo).save(prefix)
+
+    handle = ("csr", prefix)
+
+    return handle, attach(handle)
+
+
+####
+# Context of the worker processes. They are forked whenever possible, whatever
+# the default start method (spawn on macOS): they then inherit the published
+# topologies and the engines filled by the parent (cptf.bfs_engine,
+# cptf.sparse_engine). Without fork (Windows), every worker computes them again.
+####
+
+def worker_context():
+    if "fork" not in multiprocessing.get_all_start_methods():
+        ut.wrn_msg("The workers cannot be forked, they do not share the topology and its engines")
+        return None
+
+    return multiprocessing.get_context("fork")
+
+
+####
+# Publish a networkx graph to the workers that will be forked from now on. Returns
+# None if the workers are not forked, the graph then has to be pickled.
+####
+
+def publish_graph(G, key):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+
+    handle = ("fork", key)
+    keep_only(handle)
+    attached[handle] = G
+
+    return handle
+
+
+def attach(handle):
+    if handle not in attached:
+        kind, ref = handle
+        if kind != "csr":
+            raise KeyError(handle)
+
+        keep_only(handle)
+        attached[handle] = csr.CSRTopology.load(ref)
+
+    return attached[handle]
+
+
+####
+# Only the last topology of each kind is kept, the previous ones (other days) are
+# released
+####
+
+def keep_only(handle):
+    for h in [h for h in attached.keys() if h[0] == handle[0] and h != handle]:
+        del attached[h]
+
+
+####
+# Process-local topology provider. All the feature families of a process get the
+# topology of a date from here: the file is loaded once, and every caller gets the
+# same read-only (frozen) networkx graph, whose nodes are the ASNs as node_type.
+# The callers that change the graph work on their own copy (mutable_graph). The
+# degrees and the CSR topology are derived from the same file, without building
+# a networkx graph. Entries are keyed by (file, modification time), and only the
+# most recently used ones are kept.
+####
+
+max_entries = 4
+provided = OrderedDict()  # (kind, file, mtime, node type) to graph, degrees or csr topology
+
+
+def provide(kind, fn, node_type, build):
+    key = (kind, os.path.abspath(fn), os.path.getmtime(fn), node_type)
+    if key in provided:
+        provided.move_to_end(key)
+    else:
+        provided[key] = build()
+        while len(provided) > max_entries:
+            provided.popitem(last=False)
+
+    return provided[key]
+
+
+def build_graph(fn, node_type=str):
+    G = nx.Graph()
+    for as1, as2 in edgefile.iter_edges(fn):
+        if as1 > as2:
+            as1, as2 = as2, as1
+        G.add_edge(node_type(as1), node_type(as2))
+
+    return G
+
+
+def graph(fn, node_type=str):
+    return provide("graph", fn, node_type, lambda: nx.freeze(build_graph(fn, node_type)))
+
+
+####
+# A mutable copy of the graph of the file, identical to graph(fn).copy(). It is
+# copied from the provided graph if the process already has it, else built
+# without being provided: the process does not keep a second, frozen, graph.
+####
+
+def mutable_graph(fn, node_type=str):
+    key = ("graph", os.path.abspath(fn), os.path.getmtime(fn), node_type)
+    if key in provided:
+        provided.move_to_end(key)
+        return provided[key].copy()
+
+    return build_graph(fn, node_type).copy()
+
+
+def csr_topology(fn):
+    return provide("csr", fn, None, lambda: csr.CSRTopology.from_file(fn))
+
+
+####
+# Degree of every AS (self loops counted twice, like networkx does)
+####
+
+def degrees(fn, node_type=str):
+    def build():
+        topo = csr_topology(fn)
+        return dict(zip(map(node_type, topo.asns.tolist()), topo.degrees.tolist()))
+
+    return provide("degrees", fn, node_type, build)
@@ -1,4 +1,5 @@
 import networkx as nx
+from utils.edgefile import iter_edges
 from colorama import Fore, Style
 from itertools import islice
 import os
@@ -39,14 +40,37 @@ def parse_topo_file_line(line :str):
 
 def load_topo_file(fn):
     G = nx.Graph()
-    with open(fn, "r") as f:
-        for line in f:
-            as1, as2 = parse_topo_file_line(line)
-            G.add_edge(as1, as2)
+    for as1, as2 in iter_edges(fn):
+        if as1 > as2:
+            as1, as2 = as2, as1
+        G.add_edge(str(as1), str(as2))
 
     return G
 
 
+####
+# Insert the edge (u, v) back in G at the given positions of the adjacency
+# dictionaries of u and v. Unlike G.add_edge, which appends the neighbors at
+# the end, this keeps the neighbor ordering (and thus the traversal order of
+# the networkx algorithms) exactly as it was before the edge was removed.
+#
+# @param G              Networkx undirected graph, without the edge (u, v)
+# @param pos_u          Position of v in the neighbors of u
+# @param pos_v          Position of u in the neighbors of v
+# @param datadict       Attribute dictionary of the edge
+####
+
+def insert_edge_at(G :nx.Graph, u, v, pos_u, pos_v, datadict):
+    for (node, nbr, pos) in [(u, v, pos_u), (v, u, pos_v)]:
+        nbrs = G._adj[node]
+        items = list(nbrs.items())
+        items.insert(pos, (nbr, datadict))
+
+        # Rebuild the same dictionary object, as views of G keep a reference on it
+        nbrs.clear()
+        nbrs.update(items)
+
+
 def divide_into_n_parts(lst, chunk):
     size = int(len(lst) / chunk) + 1
     lst = iter(lst)
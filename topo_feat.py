@@ -1,16 +1,19 @@
 # from cgitb import reset
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import compute_topo_features as cptf
 import os
 from colorama import Fore, Style
 import topo.utils as ut
+import topo.csr as csr
+import topo.shared as shared
+import topo.node_cache as node_cache
 # import click
 from time import time
 import json
 import sys
+import math
+from utils.results import ColumnarResults
 from datetime import datetime
-import pandas as pd
-from io import StringIO
 
 
 def print_prefix(msg, end="\n"):
@@ -39,6 +42,13 @@ def load_link_file(link_file):
     return links
 
 
+def same_feature_value(val_ref, val, exact):
+    if exact or not isinstance(val_ref, float) or not isinstance(val, float):
+        return repr(val_ref) == repr(val)
+
+    return math.isclose(val_ref, val, rel_tol=1e-12, abs_tol=1e-12)
+
+
 # This array holds all the features that can be
 # considered
 
@@ -77,22 +87,40 @@ all_feats = [
 
 # This class corresponds to the Topological features computer module
 class TopoFeatComputer:
-    def __init__(self, date, db_dir, feat_to_remove, max_workers, debug, overide, method):
+    def __init__(self, date, db_dir, feat_to_remove, max_workers, debug, overide, method, eval_mode="toggle",
+                 feat_mode="incremental", bfs_cache_mb=1024, backend="networkx", batch_size=4, node_cache_mb=256):
         self.date = date  # Date of the topology to load
         self.db_dir = db_dir  # Database directory
         self.G = None  # Topology
-        self.feats = dict()  # Feature values, as a result
+        self.feats = None  # Feature values, as a result (one column per feature)
         self.feat_to_remove = feat_to_remove  # Features to remove
         self.max_workers = max_workers  # Number of available threads
         self.debug = debug
         self.overide = overide
         self.method = method
+        self.eval_mode = eval_mode  # "toggle" (edge toggled in place) or "copy" (reference, on a copy of G)
+        self.feat_mode = feat_mode  # "incremental" (closed-form and shared-BFS features) or "reference" (computed twice)
+        self.bfs_cache_mb = bfs_cache_mb  # Memory budget of the shared-BFS distance vectors
+        self.backend = backend  # "networkx" (G is a nx.Graph) or "csr" (G is a csr.CSRTopology)
+        self.batch_size = batch_size  # Number of links per batch handed out to the workers
+        self.node_cache_mb = node_cache_mb  # Size budget of the persistent node-feature cache, 0 to disable it
+        self.node_cache = None  # Persistent node-feature cache of the topology (see topo/node_cache.py)
+        self.shared_topo = None  # Handle of the topology published to the workers (see topo/shared.py)
+
+        if self.eval_mode not in ["toggle", "copy"]:
+            ut.err_msg("Evaluation mode {} is not available, must be chosen between [toggle, copy]".format(eval_mode))
+            exit(1)
+
+        if self.feat_mode not in ["incremental", "reference"]:
+            ut.err_msg("Feature mode {} is not available, must be chosen between [incremental, reference]".format(feat_mode))
+            exit(1)
 
-        # Initialize the data structure for the feature results
-        for feat in all_feats:
-            # Skip the features to remove
-            if ut.not_in_feat_to_remove(feat, feat_to_remove):
-                self.feats[feat] = []
+        if self.backend not in ["networkx", "csr"]:
+            ut.err_msg("Backend {} is not available, must be chosen between [networkx, csr]".format(backend))
+            exit(1)
+
+        # Initialize the data structure for the feature results, skipping the features to remove
+        self.feats = ColumnarResults([feat for feat in all_feats if ut.not_in_feat_to_remove(feat, feat_to_remove)])
 
         try:
             if not os.path.isdir("{}/features/positive/topological_{}".format(self.db_dir, self.method)):
@@ -105,15 +133,51 @@ class TopoFeatComputer:
                     self.db_dir))
             exit(1)
 
+    ####
+    # The instance is pickled with every task submitted to the workers. When the
+    # topology has been published, it is left out and the workers attach to it.
+    ####
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.shared_topo is not None:
+            state["G"] = None
+
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared_topo is not None:
+            self.G = shared.attach(self.shared_topo)
+
     def load_data(self):
         fn_topo = "{}/merged_topology/{}.txt".format(self.db_dir, self.date)
         # If the file representing the topology has been found,
         if os.path.exists(fn_topo):
+            if self.node_cache_mb > 0:
+                self.node_cache = node_cache.NodeFeatureCache(self.db_dir, fn_topo, max_size_mb=self.node_cache_mb)
+
             print_prefix("Loading topology graph...")
 
             start_ts = time()
             # Then load it
-            self.G = ut.load_topo_file(fn_topo)
+            if self.backend == "csr":
+                self.shared_topo, self.G = shared.load_csr(fn_topo, self.db_dir, self.date)
+                stop_ts = time()
+
+                print_prefix("Topology loaded in {:.4f} s ({} links)".format(stop_ts - start_ts, self.G.nb_edges))
+                return
+
+            # G.copy() does not keep the neighbor ordering of the loaded graph, but
+            # a copy of a copy is identical to it. Working on such a canonical graph
+            # makes the in-place evaluation traverse the graph exactly like the
+            # copy-based one, and thus produce bit-identical feature values. The
+            # mutable graph is not kept by the provider, as the frozen one is.
+            if self.eval_mode == "toggle":
+                self.G = shared.mutable_graph(fn_topo)
+            else:
+                self.G = shared.graph(fn_topo)
+            self.shared_topo = shared.publish_graph(self.G, (self.db_dir, self.date))
             stop_ts = time()
 
             print_prefix("Topology loaded in {:.4f} s ({} links)".format(stop_ts - start_ts, len(self.G.edges)))
@@ -138,28 +202,20 @@ class TopoFeatComputer:
 
         cptf.warning_ = self.debug
 
-        topo = self.G.copy()
-
-        # Remove the edge (only if it is a negative sample)
-        if topo.has_edge(as1, as2):
-            topo.remove_edge(as1, as2)
+        # The sparse engine is built on the topology as loaded, before any change
+        if self.uses_sparse_engine():
+            self.get_sparse_engine()
 
-        # Compute the features without the edge
-        if as1 not in self.G.nodes or as2 not in self.G.nodes:
-            ut.wrn_msg("Either {} or {} is not in G".format(as1, as2))
-            feats_before = cptf.res_zero
+        if self.backend == "csr":
+            feats_before, feats_after = self.compute_before_after_csr(as1, as2)
+        elif self.eval_mode == "copy":
+            feats_before, feats_after = self.compute_before_after_copy(as1, as2)
         else:
-            feats_before = cptf.compute_all_features(topo, as1, as2, feat_exclude=self.feat_to_remove)
+            feats_before, feats_after = self.compute_before_after_toggle(as1, as2)
 
         if None in list(feats_before.values()):
             feats_before = cptf.res_zero
 
-        # add the edge
-        topo.add_edge(as1, as2)
-
-        # Compute the features after the edge apears
-        feats_after = cptf.compute_all_features(topo, as1, as2, feat_exclude=self.feat_to_remove)
-
         if None in list(feats_after.values()):
             return None
 
@@ -176,14 +232,441 @@ class TopoFeatComputer:
 
         return diff_feat
 
+    ####
+    # Return the shared-BFS engine of the process for the topology. In the workers
+    # forked after prepare_shared_bfs, it is inherited from the parent process (the
+    # workers are forked even when it is not the default, see shared.worker_context).
+    ####
+
+    def get_shared_bfs(self):
+        key = (self.db_dir, self.date)
+        if cptf.bfs_engine is None or cptf.bfs_engine.key != key:
+            cptf.bfs_engine = cptf.SharedBFS(self.G, key=key, max_size_mb=self.bfs_cache_mb)
+
+        return cptf.bfs_engine
+
+    def compute_bunch_distances(self, nodes):
+        bfs = self.get_shared_bfs()
+
+        return [(n, bfs.compute_entry(self.G, n)) for n in nodes]
+
+    ####
+    # Run one BFS per distinct AS of the link list on the topology, on multiple
+    # threads, and keep the distance vectors in the shared-BFS engine. The most
+    # frequent ASes first, as long as the cache can hold them.
+    ####
+
+    def prepare_shared_bfs(self, link_list):
+        if self.backend == "csr" or self.feat_mode == "reference" or not cptf.needs_distance_feats(self.feat_to_remove):
+            return
+
+        bfs = self.get_shared_bfs()
+
+        nb_links = dict()
+        for (as1, as2) in link_list:
+            for n in (as1, as2):
+                if n in self.G and n not in bfs.cache:
+                    nb_links[n] = nb_links.get(n, 0) + 1
+
+        nodes = sorted(nb_links.keys(), key=lambda n: (-nb_links[n], int(n)))
+        nodes = nodes[:max(0, bfs.max_entries - len(bfs.cache))]
+
+        start = time()
+        if self.max_workers == 1 or len(nodes) <= 1:
+            for n in nodes:
+                bfs.get(self.G, n)
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=shared.worker_context()) as exec:
+                proc_list = []
+                for chunk in ut.divide_into_n_parts(nodes, self.max_workers):
+                    proc_list.append(exec.submit(self.compute_bunch_distances, list(chunk)))
+
+                for p in proc_list:
+                    for (n, entry) in p.result():
+                        bfs.insert(n, entry)
+            bfs.nb_bfs += len(nodes)
+
+        print_prefix("Shared BFS: {} traversals for {} links in {:.4f} s ({} ASes in cache)".format(
+            len(nodes), len(link_list), time() - start, len(bfs.cache)))
+
+    ####
+    # The sparse engine computes the costly global and local features (see
+    # cptf.sparse_feats). It is used unless these features are computed by networkx
+    # (reference mode of the networkx backend).
+    ####
+
+    def uses_sparse_engine(self):
+        return cptf.needs_sparse_feats(self.feat_to_remove) and (self.backend == "csr" or self.feat_mode != "reference")
+
+    ####
+    # Node cache to use for a graph, only if it is the topology as loaded
+    ####
+
+    def topology_cache(self, is_topology):
+        return self.node_cache if is_topology else None
+
+    ####
+    # Return the sparse engine of the process for the topology. It must be called
+    # while self.G is the topology as loaded.
+    ####
+
+    def get_sparse_engine(self):
+        key = (self.db_dir, self.date)
+        if cptf.sparse_engine is None or cptf.sparse_engine.key != key:
+            if self.backend == "csr":
+                topo = self.G
+            else:
+                topo = csr.CSRTopology.from_edges([(int(as1), int(as2)) for (as1, as2) in self.G.edges])
+            cptf.sparse_engine = cptf.SparseEngine(topo, key=key)
+
+        return cptf.sparse_engine
+
+    ####
+    # Compute the PageRank and eigenvector vectors of the topology once, before
+    # the workers are forked
+    ####
+
+    def prepare_sparse_engine(self):
+        if not self.uses_sparse_engine():
+            return
+
+        engine = self.get_sparse_engine()
+
+        start = time()
+        for feat in cptf.spectral_func.keys():
+            if feat not in self.feat_to_remove:
+                try:
+                    engine.base_vector(feat)
+                except:
+                    ut.err_msg("{} of the topology could not be computed".format(feat))
+
+        print_prefix("Sparse engine: topology vectors computed in {:.4f} s".format(time() - start))
+
+    ####
+    # Compute the features of the link on G, which must not contain the edge. With the
+    # incremental kernel, the local features with the edge are derived at the same time,
+    # as well as the distance-based ones when the edge was not in the topology. These are
+    # returned to be reused by compute_features_with_edge. As in compute_all_features,
+    # the features that cannot be computed are None.
+    ####
+
+    def compute_features_without_edge(self, G, as1, as2, had_edge):
+        if self.feat_mode == "reference":
+            return cptf.compute_all_features(G, as1, as2, feat_exclude=self.feat_to_remove,
+                                             node_cache=self.topology_cache(not had_edge)), None
+
+        if int(as1) > int(as2):
+            as1, as2 = as2, as1
+
+        try:
+            local_before, derived_after = cptf.compute_local_features(G, as1, as2, feat_exclude=self.feat_to_remove)
+        except:
+            # As in compute_all_features, the link is then skipped (see add_link_result)
+            keys = cptf.local_keys(self.feat_to_remove)
+            local_before, derived_after = dict.fromkeys(keys), dict.fromkeys(keys)
+
+        feats = cptf.compute_all_features(G, as1, as2, feat_exclude=self.feat_to_remove + cptf.local_feats +
+                                          cptf.distance_feats + cptf.sparse_feats,
+                                          node_cache=self.topology_cache(not had_edge))
+        feats.update(local_before)
+
+        if self.uses_sparse_engine():
+            sparse_before, derived_after["vectors"] = self.get_sparse_engine().compute_before(
+                as1, as2, had_edge, self.feat_to_remove, node_cache=self.node_cache)
+            feats.update(sparse_before)
+
+        if cptf.needs_distance_feats(self.feat_to_remove):
+            # G is the topology as loaded: the distances of both ASes are shared with the
+            # other links, and the ones with the edge are derived from them
+            if not had_edge:
+                bfs = self.get_shared_bfs()
+                try:
+                    feats.update(zip(cptf.distance_keys, cptf.with_node_cache(
+                        self.node_cache, cptf.distance_node_feats, as1, as2, lambda: bfs.stats(G, as1) + bfs.stats(G, as2))))
+                except:
+                    feats.update(dict.fromkeys(cptf.distance_keys))
+                try:
+                    derived_after.update(zip(cptf.distance_keys, bfs.stats_after(G, as1, as2)))
+                except:
+                    derived_after.update(dict.fromkeys(cptf.distance_keys))
+
+            # G is the topology without one of its edges, specific to this link
+            else:
+                try:
+                    feats.update(zip(cptf.distance_keys, cptf.compute_harmonic_closeness_centrality_eccentricity(G, as1, as2)))
+                except:
+                    feats.update(dict.fromkeys(cptf.distance_keys))
+
+        return feats, derived_after
+
+    ####
+    # Compute the features of the link on G, which contains the edge. The features that
+    # have been derived without the edge are not computed again.
+    ####
+
+    def compute_features_with_edge(self, G, as1, as2, had_edge, derived_after):
+        if derived_after is None and not self.uses_sparse_engine():
+            return cptf.compute_all_features(G, as1, as2, feat_exclude=self.feat_to_remove,
+                                             node_cache=self.topology_cache(had_edge))
+
+        if int(as1) > int(as2):
+            as1, as2 = as2, as1
+
+        # One of the ASes is not in the topology, nothing has been derived without the edge
+        if derived_after is None:
+            feats = cptf.compute_all_features(G, as1, as2, feat_exclude=self.feat_to_remove + cptf.sparse_feats)
+            feats.update(self.get_sparse_engine().compute_after(as1, as2, had_edge, self.feat_to_remove))
+            return feats
+
+        feats = cptf.compute_all_features(G, as1, as2, feat_exclude=self.feat_to_remove + cptf.local_feats +
+                                          cptf.distance_feats + cptf.sparse_feats,
+                                          node_cache=self.topology_cache(had_edge))
+        vectors = derived_after.pop("vectors", None)
+        feats.update(derived_after)
+
+        if self.uses_sparse_engine():
+            feats.update(self.get_sparse_engine().compute_after(as1, as2, had_edge, self.feat_to_remove, vectors,
+                                                                node_cache=self.node_cache))
+
+        # G is the topology as loaded, whose distances are shared with the other links
+        if had_edge and cptf.needs_distance_feats(self.feat_to_remove):
+            bfs = self.get_shared_bfs()
+            try:
+                feats.update(zip(cptf.distance_keys, cptf.with_node_cache(
+                    self.node_cache, cptf.distance_node_feats, as1, as2, lambda: bfs.stats(G, as1) + bfs.stats(G, as2))))
+            except:
+                feats.update(dict.fromkeys(cptf.distance_keys))
+
+        return feats
+
+    ####
+    # Reference evaluation: the features without and with the edge are computed
+    # on a private copy of the topology
+    ####
+
+    def compute_before_after_copy(self, as1, as2):
+        topo = self.G.copy()
+        had_edge = topo.has_edge(as1, as2)
+
+        # Remove the edge (only if it is a negative sample)
+        if had_edge:
+            topo.remove_edge(as1, as2)
+
+        # Compute the features without the edge
+        if as1 not in self.G.nodes or as2 not in self.G.nodes:
+            ut.wrn_msg("Either {} or {} is not in G".format(as1, as2))
+            feats_before, derived_after = cptf.res_zero, None
+        else:
+            feats_before, derived_after = self.compute_features_without_edge(topo, as1, as2, had_edge)
+
+        # add the edge
+        topo.add_edge(as1, as2)
+
+        # Compute the features after the edge apears
+        feats_after = self.compute_features_with_edge(topo, as1, as2, had_edge, derived_after)
+
+        return feats_before, feats_after
+
+    ####
+    # Copy-free evaluation: the edge is removed from the topology in place, then
+    # added back, and the topology is restored as it was (same nodes, same edges
+    # and same neighbor ordering) before returning. The ProcessPoolExecutor workers
+    # are forked after the topology is published (shared.publish_graph): their
+    # memory is shared with the parent copy-on-write, so the in-place changes of a
+    # worker only touch its own copy of the pages, and never leak to the parent or
+    # to the other workers. Without fork, each worker unpickles its own topology.
+    # Within a worker, the links of a bunch are processed one after the other.
+    ####
+
+    def compute_before_after_toggle(self, as1, as2):
+        G = self.G
+
+        new_nodes = [n for n in (as1, as2) if n not in G]
+        had_edge = G.has_edge(as1, as2)
+
+        # Remove the edge (only if it is a negative sample), but remember
+        # where it was in the adjacency of both nodes
+        if had_edge:
+            pos_as1 = list(G.adj[as1]).index(as2)
+            pos_as2 = list(G.adj[as2]).index(as1)
+            datadict = G.adj[as1][as2]
+            G.remove_edge(as1, as2)
+
+        try:
+            # Compute the features without the edge
+            if len(new_nodes):
+                ut.wrn_msg("Either {} or {} is not in G".format(as1, as2))
+                feats_before, derived_after = cptf.res_zero, None
+            else:
+                feats_before, derived_after = self.compute_features_without_edge(G, as1, as2, had_edge)
+
+            # add the edge
+            G.add_edge(as1, as2)
+
+            # Compute the features after the edge apears
+            feats_after = self.compute_features_with_edge(G, as1, as2, had_edge, derived_after)
+
+        finally:
+            # Restore the topology, even if the computation has been interrupted
+            if G.has_edge(as1, as2):
+                G.remove_edge(as1, as2)
+            for n in new_nodes:
+                if n in G:
+                    G.remove_node(n)
+            if had_edge:
+                ut.insert_edge_at(G, as1, as2, pos_as1, pos_as2, datadict)
+
+        return feats_before, feats_after
+
+    ####
+    # Evaluation on the CSR backend: the topology without and with the edge are
+    # immutable views of the same arrays, nothing is copied nor modified
+    ####
+
+    def compute_before_after_csr(self, as1, as2):
+        had_edge = self.G.has_edge(as1, as2)
+
+        # Compute the features without the edge
+        if as1 not in self.G or as2 not in self.G:
+            ut.wrn_msg("Either {} or {} is not in G".format(as1, as2))
+            feats_before, vectors = cptf.res_zero, None
+        else:
+            topo = self.G.view(removed=(as1, as2) if had_edge else None)
+            feats_before = cptf.compute_all_features(topo, as1, as2,
+                                                     feat_exclude=self.feat_to_remove + cptf.sparse_feats,
+                                                     node_cache=self.topology_cache(not had_edge))
+            sparse_before, vectors = self.get_sparse_engine().compute_before(as1, as2, had_edge, self.feat_to_remove,
+                                                                             node_cache=self.node_cache)
+            feats_before.update(sparse_before)
+
+        # Compute the features after the edge apears
+        topo = self.G.view(added=None if had_edge else (as1, as2))
+        feats_after = cptf.compute_all_features(topo, as1, as2, feat_exclude=self.feat_to_remove + cptf.sparse_feats,
+                                                node_cache=self.topology_cache(had_edge))
+        feats_after.update(self.get_sparse_engine().compute_after(as1, as2, had_edge, self.feat_to_remove, vectors,
+                                                                  node_cache=self.node_cache))
+
+        return feats_before, feats_after
+
+    ####
+    # Differential check of the modes: every link is computed with the configured
+    # modes and with the reference ones (networkx backend, copy-based evaluation, every
+    # feature computed twice), and the feature values must be bit-identical. With the
+    # csr backend, floats only need to be equal up to the summation order. The
+    # features estimated by the sparse engine (cptf.approx_feats) are not compared,
+    # their largest deviation from the reference is reported instead.
+    # Returns the list of the links that do not match.
+    ####
+
+    def check_modes(self, link_list):
+        G, backend, eval_mode, feat_mode = self.G, self.backend, self.eval_mode, self.feat_mode
+        mismatches = []
+        deviations = dict()
+
+        # Every value is computed, none is taken from the node cache
+        cache, self.node_cache = self.node_cache, None
+
+        G_ref = G
+        if backend == "csr":
+            G_ref = shared.graph("{}/merged_topology/{}.txt".format(self.db_dir, self.date))
+
+        for (as1, as2) in link_list:
+            self.G, self.backend, self.eval_mode, self.feat_mode = G_ref, "networkx", "copy", "reference"
+            feats_ref = self.compute_one_link(as1, as2)
+            self.G, self.backend, self.eval_mode, self.feat_mode = G, backend, eval_mode, feat_mode
+            feats = self.compute_one_link(as1, as2)
+
+            if feats_ref is None or feats is None:
+                same = feats_ref is None and feats is None
+            else:
+                approx = [feat for feat in feats_ref.keys() if self.uses_sparse_engine() and
+                          any(feat.startswith(f) for f in cptf.approx_feats)]
+                for feat in approx:
+                    if feat in feats:
+                        deviations[feat] = max(deviations.get(feat, 0), abs(feats_ref[feat] - feats[feat]))
+
+                same = feats_ref.keys() == feats.keys() and \
+                    all(same_feature_value(feats_ref[feat], feats[feat], backend == "networkx")
+                        for feat in feats_ref.keys() if feat not in approx)
+
+            if not same:
+                ut.err_msg("Link {} {} does not have the same features as with the reference modes".format(as1, as2))
+                mismatches.append((as1, as2))
+
+        for (feat, dev) in deviations.items():
+            print_prefix("{}: largest deviation from the reference {:.3e}".format(feat, dev))
+        self.node_cache = cache
+        print_prefix("{} links checked, {} mismatches with the reference modes".format(len(link_list), len(mismatches)))
+
+        return mismatches
+
     def compute_bunch_links(self, links):
         all_res = []
 
         for (as1, as2) in links:
             all_res.append((self.compute_one_link(as1, as2), as1, as2))
 
+        if self.node_cache is not None:
+            self.node_cache.flush()
+
         return all_res
 
+    ####
+    # Same as compute_bunch_links, also returns the worker pid and the time spent
+    # computing the links, for the utilisation report
+    ####
+
+    def compute_timed_bunch_links(self, links):
+        start = time()
+        all_res = self.compute_bunch_links(links)
+
+        return os.getpid(), time() - start, all_res
+
+    ####
+    # Estimated cost of a link: the degree of its ASes, which bounds the size of
+    # the neighbourhoods that are explored
+    ####
+
+    def link_cost(self, as1, as2):
+        cost = 0
+        for n in (as1, as2):
+            if n in self.G:
+                if self.backend == "csr":
+                    cost += int(self.G.degrees[self.G.node_id(n)])
+                else:
+                    cost += self.G.degree(n)
+
+        return cost
+
+    ####
+    # Split the link list (as indexes) into small batches, the most expensive links
+    # first. The batches are handed out to the workers as soon as they are idle,
+    # instead of one static chunk per worker.
+    ####
+
+    def schedule_batches(self, link_list):
+        order = sorted(range(len(link_list)), key=lambda i: -self.link_cost(*link_list[i]))
+
+        return [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+    def add_link_result(self, feats, as1, as2):
+        if feats is None:
+            ut.err_msg(
+                "Link {} {} cannot be computed because either {} or {} are not in G, skipped...".format(as1, as2,
+                                                                                                        as1, as2))
+        elif None in list(feats.values()):
+            ut.err_msg("Link {} {} cannot be computed because of a Networkx error, skipped...".format(as1, as2))
+        else:
+            self.feats.append(feats)
+
+    def print_utilisation(self, busy, wall_time):
+        for (i, (pid, (tick, nb_links))) in enumerate(sorted(busy.items())):
+            print_prefix("Worker {} (pid {}): {} links, busy {:.4f} s ({:.1f}% of {:.4f} s)".format(
+                i, pid, nb_links, tick, 100 * tick / max(wall_time, 1e-9), wall_time))
+
+        total = sum(tick for (tick, _) in busy.values())
+        print_prefix("Workers utilisation: {:.1f}%".format(100 * total / max(wall_time * self.max_workers, 1e-9)))
+
     ####
     # Function used to compute the topological features for
     # all the links in the list
@@ -191,66 +674,46 @@ class TopoFeatComputer:
 
     def compute_multiple_links(self, link_list):
 
+        # One BFS per distinct AS, shared by all the links of the day
+        self.prepare_shared_bfs(link_list)
+        self.prepare_sparse_engine()
+
         # If there is only one worker or only one elem in the
         # list of links, process it sequentially
         start = time()
         if self.max_workers == 1 or len(link_list) <= 1:
-            res = self.compute_bunch_links(link_list)
-
-            # For each edge in result
-            for (feats, as1, as2) in res:
-                # For each feature of the edge
-                if feats is None:
-                    ut.err_msg(
-                        "Link {} {} cannot be computed because either {} or {} are not in G, skipped...".format(as1,
-                                                                                                                as2,
-                                                                                                                as1,
-                                                                                                                as2))
-                else:
-                    if None in list(feats.values()):
-                        ut.err_msg(
-                            "Link {} {} cannot be computed because of a Networkx error, skipped...".format(as1, as2))
-                    else:
-                        for (feat, val) in feats.items():
-                            self.feats[feat].append(val)
+            for (feats, as1, as2) in self.compute_bunch_links(link_list):
+                self.add_link_result(feats, as1, as2)
 
         # Else, process it on multiple threads
         else:
-            all_chunks = ut.divide_into_n_parts(link_list, self.max_workers)
+            all_res = [None] * len(link_list)
+            busy = dict()  # Worker pid to (busy time, number of links)
 
-            proc_list = []
+            with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=shared.worker_context()) as exec:
+                proc_list = dict()
+                for batch in self.schedule_batches(link_list):
+                    proc_list[exec.submit(self.compute_timed_bunch_links, [link_list[i] for i in batch])] = batch
 
-            with ProcessPoolExecutor(max_workers=self.max_workers) as exec:
-                for i in range(0, len(all_chunks)):
-                    proc_list.append(exec.submit(self.compute_bunch_links, list(all_chunks[i])))
+                # Collect the batches as they finish
+                for p in as_completed(proc_list):
+                    pid, tick, res = p.result()
+                    busy[pid] = (busy.get(pid, (0, 0))[0] + tick, busy.get(pid, (0, 0))[1] + len(res))
 
-                for p in proc_list:
-                    res = p.result()
-
-                    # For each edge in result
-                    for (feats, as1, as2) in res:
-                        # For each feature of the edge
-                        if feats is None:
-                            ut.err_msg(
-                                "Link {} {} cannot be computed because either {} or {} are not in G, skipped...".format(
-                                    as1, as2, as1, as2))
-                        else:
-                            if None in list(feats.values()):
-                                ut.err_msg(
-                                    "Link {} {} cannot be computed because of a Networkx error, skipped...".format(as1,
-                                                                                                                   as2))
-                            else:
-                                for (feat, val) in feats.items():
-                                    self.feats[feat].append(val)
+                    for (i, r) in zip(proc_list[p], res):
+                        all_res[i] = r
+
+            self.print_utilisation(busy, time() - start)
+
+            # The results are kept in the order of the link list
+            for (feats, as1, as2) in all_res:
+                self.add_link_result(feats, as1, as2)
 
         tick = time() - start
         print_prefix("Link list for day {} took {:.4f} s".format(self.date, tick))
 
     def clear(self):
-        for feat in all_feats:
-            # Skip the features to remove
-            if ut.not_in_feat_to_remove(feat, self.feat_to_remove):
-                self.feats[feat] = []
+        self.feats.clear()
 
     def build_daily_sampling(self):
         pos_sampling = "{}/sampling/positive/sampling_{}/{}_positive.txt".format(self.db_dir, self.method, self.date)
@@ -266,7 +729,7 @@ class TopoFeatComputer:
             self.compute_multiple_links(links)
 
             with open(fn_pos, "w") as f:
-                f.write(self.to_string(None))
+                self.feats.write(f)
 
         self.clear()
 
@@ -280,36 +743,14 @@ class TopoFeatComputer:
             self.compute_multiple_links(links)
 
             with open(fn_neg, "w") as f:
-                f.write(self.to_string(None))
+                self.feats.write(f)
 
 
     ####
     # Transform the results into string
     ####
     def to_string(self, label):
-        s = ""
-
-        line = []
-        all_feats = list(self.feats.keys())
-        for feat in all_feats:
-            line.append(feat)
-
-        if label is None:
-            s += "{}\n".format(" ".join(line))
-        else:
-            s += "{} label\n".format(" ".join(line))
-
-        for i in range(0, len(self.feats["as1"])):
-            line = []
-            for feat in all_feats:
-                line.append(str(self.feats[feat][i]))
-
-            if label is None:
-                s += "{}\n".format(" ".join(line))
-            else:
-                s += "{} {}\n".format(" ".join(line), label)
-
-        return s
+        return self.feats.to_string(label)
     '''
     def to_df(self):
         columns = ["as1", "as2", "degree_centrality_as1", "degree_centrality_as2", "average_neighbor_degree_as1",
@@ -317,8 +758,8 @@ class TopoFeatComputer:
                    "eccentricity_as1", "eccentricity_as2", "harmonic_centrality_as1", "harmonic_centrality_as2",
                    "closeness_centrality_as1", "closeness_centrality_as2", "shortest_path", "jaccard", "adamic_adar",
                    "preferential_attachement"]
-        
-        
+
+
         try:
             df = pd.DataFrame(self.feats, columns=columns)
         except:
@@ -328,33 +769,25 @@ class TopoFeatComputer:
     '''
     def to_json(self, label):
         res = []
-        all_feats = list(self.feats.keys())
 
-        for i in range(0, len(self.feats["as1"])):
-            elem = dict()
-            for feat in all_feats:
-                elem[feat] = self.feats[feat][i]
+        for row in self.feats.rows():
+            elem = dict(zip(self.feats.columns.keys(), row))
 
             if label is not None:
                 elem["label"] = label
-            res.append(elem.copy())
+            res.append(elem)
 
         return json.dumps(res)
 
-
     def to_df(self, label):
-        s = self.to_string(label)
-        io_data = StringIO(s)
-        try:
-            df = pd.read_csv(io_data, sep=" ")
-        except:
-            print('Error to convert string to DF')
-            exit(1)
-        return df
+        return self.feats.to_df(label)
 
 
-def topo_feat_aux(date, db_dir, nb_threads, feat_exclude, debug, overide, method):
-    tfc = TopoFeatComputer(date, db_dir, feat_exclude.split(","), nb_threads, debug, overide, method)
+def topo_feat_aux(date, db_dir, nb_threads, feat_exclude, debug, overide, method, eval_mode="toggle",
+                  feat_mode="incremental", backend="networkx", batch_size=4, node_cache_mb=256, bfs_cache_mb=1024):
+    tfc = TopoFeatComputer(date, db_dir, feat_exclude.split(","), nb_threads, debug, overide, method, eval_mode,
+                           feat_mode, bfs_cache_mb=bfs_cache_mb, backend=backend, batch_size=batch_size,
+                           node_cache_mb=node_cache_mb)
     tfc.load_data()
 
     tfc.build_daily_sampling()
@@ -377,13 +810,21 @@ def topo_feat_aux(date, db_dir, nb_threads, feat_exclude, debug, overide, method
 @click.option("--overide", default=0, help="overide topological feature files", type=int)
 @click.option("--end_date", default=None, help="End date of bunch", type=str)
 @click.option("--method", default="clusters", help="Sampling method used", type=str)
+@click.option("--eval_mode", default="toggle", help="Evaluation of the links, either \"toggle\" (edge toggled in the topology) or \"copy\" (on a copy of the topology)", type=str)
+@click.option("--feat_mode", default="incremental", help="Computation of the local features, either \"incremental\" (closed form with the edge) or \"reference\" (computed twice)", type=str)
+@click.option("--backend", default="networkx", help="Graph backend, either \"networkx\" or \"csr\" (NumPy/SciPy arrays)", type=str)
+@click.option("--batch_size", default=4, help="Number of links per batch handed out to the workers", type=int)
+@click.option("--node_cache_mb", default=256, help="Size budget of the persistent node-feature cache (in MB), 0 to disable it", type=int)
+@click.option("--bfs_cache_mb", default=1024, help="Memory budget of the shared-BFS distance vectors (in MB), shared with the workers", type=int)
+@click.option("--check_modes", default=0, help="Check that the links in input have identical features with the reference modes", type=int)
 '''
 
 
 def run_orchestrator(date, outfile=None, nb_threads=2, db_dir='db',
                      feat_exclude="pagerank,eigenvector_centrality,square_clustering,number_of_cliques,simrank_similarity",
                      link_list=None, link_file=None, label=None, json_dump=0, daily_sampling=0, debug=0, overide=0,
-                     end_date=None, method="clusters", return_df=False):
+                     end_date=None, method="clusters", return_df=False, eval_mode="toggle", feat_mode="incremental",
+                     backend="networkx", batch_size=4, node_cache_mb=256, bfs_cache_mb=1024, check_modes=0):
     if date is None:
         ut.err_msg("Please enter a date with option --date")
         exit(1)
@@ -395,7 +836,8 @@ def run_orchestrator(date, outfile=None, nb_threads=2, db_dir='db',
 
         with ProcessPoolExecutor(max_workers=nb_threads) as exec:
             for d in all_dates:
-                all_procs.append(exec.submit(topo_feat_aux, d, db_dir, 1, feat_exclude, debug, overide, method))
+                all_procs.append(exec.submit(topo_feat_aux, d, db_dir, 1, feat_exclude, debug, overide, method, eval_mode,
+                                             feat_mode, backend, batch_size, node_cache_mb, bfs_cache_mb))
 
             for p in all_procs:
                 p.result()
@@ -405,7 +847,9 @@ def run_orchestrator(date, outfile=None, nb_threads=2, db_dir='db',
         ut.err_msg("You must give some links in input. Look at options --link_list or --link_file")
         exit(1)
 
-    tfc = TopoFeatComputer(date, db_dir, feat_exclude.split(','), nb_threads, debug, overide, method)
+    tfc = TopoFeatComputer(date, db_dir, feat_exclude.split(','), nb_threads, debug, overide, method, eval_mode,
+                           feat_mode, bfs_cache_mb=bfs_cache_mb, backend=backend, batch_size=batch_size,
+                           node_cache_mb=node_cache_mb)
     tfc.load_data()
 
     if daily_sampling:
@@ -439,6 +883,10 @@ def run_orchestrator(date, outfile=None, nb_threads=2, db_dir='db',
         ut.err_msg("No links in any provided input")
         exit(1)
 
+    if check_modes:
+        tfc.check_modes(links)
+        return None
+
     tfc.compute_multiple_links(links)
 
     if return_df:
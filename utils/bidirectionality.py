@@ -3,6 +3,7 @@ import pickle
 import csv
 import pandas as pd
 import networkx as nx
+from utils.edgefile import iter_edges
 from datetime import datetime, timedelta
 
 from colorama import Fore
@@ -18,32 +19,10 @@ def topo_merger_bgp_irr(bgp_topo_file, irr_topo_file):
     topo = nx.DiGraph()
 
     # Read the topology inferred from BGP updates and rib.
-    with open(bgp_topo_file, 'r') as fd:
-        for line in fd.readlines():
-            if line.startswith('#'):
-                continue
+    topo.add_edges_from(iter_edges(bgp_topo_file))
 
-            linetab = line.rstrip('\n').split(' ')
-            as1 = int(linetab[0])
-            as2 = int(linetab[1])
-
-            topo.add_edge(as1, as2)
-
-    # Read the topology inferred from IRR.
-    with open(irr_topo_file, 'r') as fd:
-        for line in fd.readlines():
-            if line.startswith('#'):
-                continue
-
-            linetab = line.rstrip('\n').split(' ')
-            try:
-                as1 = int(linetab[0].replace('as', ''))
-                as2 = int(linetab[1])
-            except ValueError:
-                pass
-                # print (print_prefix()+'Error in the IRR parsed graph: {} in {}'.format(linetab, irr_topo_file)) 
-
-            topo.add_edge(as1, as2)
+    # Read the topology inferred from IRR (the lines that are not a link are skipped).
+    topo.add_edges_from(iter_edges(irr_topo_file))
 
     return topo
 
@@ -71,16 +50,7 @@ def bidirectional_links(links, rib_file: str, bgp_topo_files: list, irr_topo_fil
     print(print_prefix()+'Processing RIB file {}.'.format(rib_file))
 
     if rib_file is not None:
-        with open(rib_file, 'r') as fd:
-            for line in fd.readlines():
-                if line.startswith('#'):
-                    continue
-
-                linetab = line.rstrip('\n').split(' ')
-                as1 = int(linetab[0])
-                as2 = int(linetab[1])
-
-                topo_rib.add_edge(as1, as2)
+        topo_rib.add_edges_from(iter_edges(rib_file))
 
     for as1, as2 in links:
         if (topo_updates.has_edge(as1, as2) and \
@@ -94,3 +64,37 @@ def bidirectional_links(links, rib_file: str, bgp_topo_files: list, irr_topo_fil
             df.loc[len(df)] = [as1, as2, 0]
 
     return df
+
+
+####
+# Same as bidirectional_links, from the appearance timeline of the edges (see
+# utils/timeline.py) instead of the daily files: the days of the updates and IRR
+# topologies are the given days, the RIB dump is the one of rib_date (if any).
+####
+
+def bidirectional_links_timeline(links, timeline, rib_date, days: list, threshold_days_appearance: int=2):
+    df = pd.DataFrame(columns=['as1', 'as2', 'bidi'])
+    days = set(d.toordinal() for d in days)
+    threshold = max(threshold_days_appearance, 1)
+
+    if len(days):
+        timeline.update(min(days), max(days), sources_list=["updates", "irr"])
+    if rib_date is not None:
+        timeline.update(rib_date, sources_list=["ribs"])
+
+    for as1, as2 in links:
+        bidi = 0
+
+        if len(days):
+            count_12 = len(timeline.days_seen(as1, as2, ["updates", "irr"], min(days), max(days)) & days)
+            count_21 = len(timeline.days_seen(as2, as1, ["updates", "irr"], min(days), max(days)) & days)
+            if count_12 >= threshold and count_21 >= threshold:
+                bidi = 1
+
+        if rib_date is not None and \
+            timeline.seen(as1, as2, ["ribs"], rib_date, rib_date) and timeline.seen(as2, as1, ["ribs"], rib_date, rib_date):
+            bidi = 1
+
+        df.loc[len(df)] = [as1, as2, bidi]
+
+    return df
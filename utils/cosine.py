@@ -1,6 +1,7 @@
 import networkx as nx
 import sys
 import csv
+import topo.shared as shared
 import pandas as pd
 import numpy as np
 from scipy.spatial import distance
@@ -18,18 +19,7 @@ class CosineDistance:
 
         # Build the AS-level topology.
         print (self.print_prefix()+'Building the topology.', file=sys.stderr)
-        self.topo = nx.Graph()
-
-        with open(topo_file, 'r') as fd:
-            for line in fd.readlines():
-                if line.startswith('#'):
-                    continue
-
-                linetab = line.rstrip('\n').split(' ')
-                as1 = int(linetab[0])
-                as2 = int(linetab[1])
-
-                self.topo.add_edge(as1, as2)
+        self.topo = shared.graph(topo_file, int)
 
         print (self.print_prefix()+'Loading the features', file=sys.stderr)
         # Load the pickle object with the features.
@@ -1,6 +1,7 @@
 import sys
 import networkx as nx
 import csv 
+import topo.shared as shared
 import pandas as pd
 from sklearn.preprocessing import Normalizer
 
@@ -10,18 +11,7 @@ class FacilityFeaturesComputation:
         self.facility_file = facility_file
 
         # Build the AS-level topology.
-        self.topo = nx.Graph()
-
-        with open(topo_file, 'r') as fd:
-            for line in fd.readlines():
-                if line.startswith('#'):
-                    continue
-
-                linetab = line.rstrip('\n').split(' ')
-                as1 = int(linetab[0])
-                as2 = int(linetab[1])
-
-                self.topo.add_edge(as1, as2)
+        self.topo = shared.graph(topo_file, int)
 
         self.node_to_facilities = {}
         self.node_to_cities = {}
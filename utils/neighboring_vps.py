@@ -2,6 +2,7 @@ import sys
 import urllib.request
 import networkx as nx
 import pandas as pd
+import topo.shared as shared
 
 
 def get_routeviews_peers():
@@ -66,19 +67,8 @@ def get_vps():
 
 class CountNeighboringVPs:
     def __init__(self, topo_file):
-        self.topo = nx.Graph()
-
         # Load the graph on which the features will be computed.
-        with open(topo_file, 'r') as fd:
-            for line in fd.readlines():
-                if line.startswith('#'):
-                    continue
-
-                linetab = line.rstrip('\n').split(' ')
-                as1 = int(linetab[0])
-                as2 = int(linetab[1])
-
-                self.topo.add_edge(as1, as2)
+        self.topo = shared.graph(topo_file, int)
 
         self.vps = get_vps()
         self.features = None
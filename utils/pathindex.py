@@ -0,0 +1,183 @@
+import os
+import fcntl
+import random
+import numpy as np
+from array import array
+from utils.sampler import aspath_to_list
+
+
+####
+# Index of the AS paths of a monthly paths file (db_dir/paths/<month>_paths.txt),
+# for the samplings: the paths that contain a link (for the negative sampling,
+# paths of more than 3 hops) and the paths of an origin (for the positive
+# sampling, paths of at least 3 hops). The paths file itself is the path table:
+# it is memory mapped, a path being the bytes between two line offsets. A link
+# (a single uint64 key, the lowest ASN in the high 32 bits) or an origin maps to
+# a range of path numbers, found with a binary search. A path is listed once per
+# occurrence of the link in it, so that a path drawn from the range follows the
+# same distribution as with the lists of paths used before.
+#
+# The index is built once, in <paths file>.index, and rebuilt when the paths file
+# is modified. The hops with a non numerical ASN are not indexed.
+####
+
+arrays = ["offsets", "link_keys", "link_starts", "link_paths", "orig_keys", "orig_starts", "orig_paths", "source"]
+
+
+def edge_key(as1, as2):
+    return (min(as1, as2) << 32) | max(as1, as2)
+
+
+# ASN of a hop, None if it can not be indexed.
+def to_asn(hop):
+    hop = str(hop)
+    if not hop.isdecimal() or int(hop) >= 1 << 32:
+        return None
+
+    return int(hop)
+
+
+####
+# Sort the (key, path number) pairs by key, keeping the order of the paths file
+# within a key. Returns the unique keys, the start of every key in the path
+# numbers (plus the end), and the path numbers.
+####
+
+def group_by_key(keys, paths):
+    keys = np.frombuffer(keys, dtype=np.uint64)
+    paths = np.frombuffer(paths, dtype=np.uint64)
+
+    order = np.argsort(keys, kind="stable")
+    keys, paths = keys[order], paths[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+
+    return unique_keys, np.append(starts, len(keys)).astype(np.uint64), paths
+
+
+class PathIndex:
+    def __init__(self, paths_file: str):
+        self.paths_file = paths_file
+        self.index_dir = paths_file+'.index'
+        self.data = None  # Arrays of the index, memory mapped
+        self.table = None  # Paths file, memory mapped
+
+        if not os.path.isdir(self.index_dir):
+            os.makedirs(self.index_dir, exist_ok=True)
+
+        if not self.is_fresh():
+            with open(self.index_dir+'/index.lock', "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+                # The index may have been built by another process meanwhile
+                if not self.is_fresh():
+                    self.build()
+
+        self.load()
+
+    def files(self):
+        return ["{}/{}.npy".format(self.index_dir, name) for name in arrays]
+
+    # Size and modification time of the paths file, as stored with the index.
+    def source(self):
+        st = os.stat(self.paths_file)
+        return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+    def is_fresh(self):
+        files = self.files()
+        if not all(os.path.isfile(fn) for fn in files):
+            return False
+
+        return np.array_equal(np.load(files[-1]), self.source())
+
+    def build(self):
+        source = self.source()
+        offsets = array('Q', [0])
+        link_keys, link_paths = array('Q'), array('Q')
+        orig_keys, orig_paths = array('Q'), array('Q')
+
+        with open(self.paths_file, 'rb') as f:
+            for i, line in enumerate(f):
+                offsets.append(offsets[-1] + len(line))
+                path = aspath_to_list(line.decode('utf-8', errors='ignore').replace("\n", ""))
+                path = [[to_asn(h) for h in hop] for hop in path]
+
+                # Links of the paths of more than 3 hops.
+                if len(path) > 3:
+                    for j in range(0, len(path)-1):
+                        for as1 in path[j]:
+                            for as2 in path[j+1]:
+                                if as1 is not None and as2 is not None:
+                                    link_keys.append(edge_key(as1, as2))
+                                    link_paths.append(i)
+
+                # Origin of the paths of at least 3 hops.
+                if len(path) >= 3 and path[-1][0] is not None:
+                    orig_keys.append(path[-1][0])
+                    orig_paths.append(i)
+
+        data = [np.frombuffer(offsets, dtype=np.uint64)]
+        data.extend(group_by_key(link_keys, link_paths))
+        data.extend(group_by_key(orig_keys, orig_paths))
+        data.append(source)
+
+        # The source is written last: the index is complete once it matches.
+        for (fn, arr) in zip(self.files(), data):
+            fn_tmp = "{}.{}.tmp".format(fn, os.getpid())
+            with open(fn_tmp, "wb") as fd:
+                np.save(fd, arr)
+            os.replace(fn_tmp, fn)
+
+    def load(self):
+        self.data = dict(zip(arrays, [np.load(fn, mmap_mode="r") for fn in self.files()]))
+
+        if os.path.getsize(self.paths_file) > 0:
+            self.table = np.memmap(self.paths_file, dtype=np.uint8, mode="r")
+        else:
+            self.table = np.zeros(0, dtype=np.uint8)
+
+    def path(self, i):
+        offsets = self.data["offsets"]
+        return bytes(self.table[int(offsets[i]):int(offsets[i+1])]).decode('utf-8', errors='ignore').replace("\n", "")
+
+    # Range of the key in the path numbers, (0, 0) if the key is not indexed.
+    def key_range(self, keys, starts, key):
+        i = int(np.searchsorted(keys, key))
+        if i < len(keys) and keys[i] == key:
+            return int(starts[i]), int(starts[i+1])
+
+        return 0, 0
+
+    def link_range(self, as1, as2):
+        as1, as2 = to_asn(as1), to_asn(as2)
+        if as1 is None or as2 is None:
+            return 0, 0
+
+        return self.key_range(self.data["link_keys"], self.data["link_starts"], np.uint64(edge_key(as1, as2)))
+
+    def origin_range(self, asn):
+        asn = to_asn(asn)
+        if asn is None:
+            return 0, 0
+
+        return self.key_range(self.data["orig_keys"], self.data["orig_starts"], np.uint64(asn))
+
+    ####
+    # Whether some paths contain the link as1-as2 (in any direction) or have the
+    # origin asn, and a random path among them.
+    ####
+
+    def has_link(self, as1, as2):
+        lo, hi = self.link_range(as1, as2)
+        return hi > lo
+
+    def has_origin(self, asn):
+        lo, hi = self.origin_range(asn)
+        return hi > lo
+
+    def choice_link(self, as1, as2):
+        lo, hi = self.link_range(as1, as2)
+        return self.path(int(self.data["link_paths"][lo + random.randrange(hi - lo)]))
+
+    def choice_origin(self, asn):
+        lo, hi = self.origin_range(asn)
+        return self.path(int(self.data["orig_paths"][lo + random.randrange(hi - lo)]))
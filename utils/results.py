@@ -0,0 +1,75 @@
+import pandas as pd
+
+
+####
+# Results accumulated column by column: one list per column, in the order of the
+# first row. They are written as space-separated lines, or converted to a DataFrame
+# directly, without formatting and parsing them again. The DataFrame has the dtypes
+# pd.read_csv would infer from the written lines: the object columns that only hold
+# numbers (or None) are made numeric.
+####
+
+class ColumnarResults:
+    def __init__(self, names=None):
+        self.columns = dict()  # Column name to the list of its values
+
+        for name in names or []:
+            self.columns[name] = []
+
+    def __len__(self):
+        if not len(self.columns):
+            return 0
+
+        return len(next(iter(self.columns.values())))
+
+    def append(self, row: dict):
+        if not len(self.columns):
+            for name in row.keys():
+                self.columns[name] = []
+
+        for (name, values) in self.columns.items():
+            values.append(row[name])
+
+    def clear(self):
+        for values in self.columns.values():
+            values.clear()
+
+    def rows(self):
+        return zip(*self.columns.values())
+
+    ####
+    # Header line, then one line per row. The label, if any, is added as a last
+    # column with the same value for all the rows.
+    ####
+
+    def lines(self, label=None):
+        names = list(self.columns.keys())
+        suffix = ""
+        if label is not None:
+            names.append("label")
+            suffix = " {}".format(label)
+
+        yield " ".join(names)
+        for row in self.rows():
+            yield " ".join(map(str, row)) + suffix
+
+    def to_string(self, label=None):
+        return "".join(line + "\n" for line in self.lines(label))
+
+    def write(self, f, label=None):
+        f.writelines(line + "\n" for line in self.lines(label))
+
+    def to_df(self, label=None):
+        df = pd.DataFrame(self.columns)
+
+        for name in df.columns:
+            if df[name].dtype == object:
+                try:
+                    df[name] = pd.to_numeric(df[name])
+                except (ValueError, TypeError):
+                    pass
+
+        if label is not None:
+            df["label"] = label
+
+        return df
@@ -1,6 +1,9 @@
 #import numpy as np
 from itertools import groupby
 import networkx as nx
+from utils.edgefile import iter_edges
+from utils.verdicts import VerdictIndex
+import topo.shared as shared
 from colorama import Fore, Style
 import os
 import sys
@@ -34,13 +37,7 @@ def compute_table(topo, thresholds, edges_file=None):
     if edges_file is None:
         edges_list = topo.edges()
     else:
-        edges_list = []
-        with open(edges_file, 'r') as fd:
-            for line in fd.readlines():
-                linetab = line.rstrip('\n').split(' ')
-                as1 = int(linetab[0])
-                as2 = int(linetab[1])
-                edges_list.append((as1, as2))
+        edges_list = list(iter_edges(edges_file))
 
     for as1, as2 in edges_list:
         if as1 in topo and as2 in topo:
@@ -92,14 +89,9 @@ def parse_topo_file_line(line):
 
     return as1, as2
 
+# The topology is changed by the sampling, this is a private copy of the shared one
 def load_topo_file(fn):
-    G = nx.Graph()
-    with open(fn, "r") as f:
-        for line in f:
-            as1, as2 = parse_topo_file_line(line)
-            G.add_edge(as1, as2)
-
-    return G
+    return shared.mutable_graph(fn)
 
 # Helper function to iterate between two dates.
 def daterange(start_date, end_date):
@@ -113,17 +105,9 @@ def load_suspicious_new_edge(db_dir, datestr, nbdays):
     first_day = date - timedelta(days=nbdays)
 
     # All the suspicious cases detected the last nbdays days (to omit them).
-    suspicious_edges = set()
-    for cur_date in daterange(first_day, date):
-        case_filename = db_dir+'/cases/'+cur_date.strftime("%Y-%m-%d")
-        if os.path.isfile(case_filename):
-            with open(case_filename, 'r') as fd:
-                for line in fd.readlines():
-                    if line.startswith('!sus'):
-                        linetab = line.rstrip().split(' ')
-                        as1 = linetab[1]
-                        as2 = linetab[2]
-                        suspicious_edges.add((as1, as2))
+    index = VerdictIndex(db_dir)
+    index.update(first_day, date - timedelta(days=1))
+    suspicious_edges = set((str(as1), str(as2)) for (as1, as2) in index.flagged(first_day, date - timedelta(days=1)))
 
     return suspicious_edges
 
@@ -154,23 +138,14 @@ def get_all_cone_sizes(date, db_dir):
 
 def get_all_degrees(date, db_dir):
     fn = "{}/merged_topology/{}.txt".format(db_dir, date)
-    G = nx.Graph()
+    degrees = dict()
 
     if os.path.exists(fn):
-        with open(fn, "r") as f:
-            for line in f:
-                as1 = line.strip("\n").split(" ")[0]
-                as2 = line.strip("\n").split(" ")[1]
-
-                G.add_edge(as1, as2)
+        degrees.update(shared.degrees(fn))
 
     else:
         print("Unable to find file {}".format(fn))
 
-    degrees = dict()
-    for node in G.nodes:
-        degrees[node] = G.degree[node]
-
     return degrees
 
 def merge_degree_cones(degrees :dict, cones :dict, topo, topo_irr):